@@ -15,7 +15,8 @@ import './components/MassDetailViewer.css';
 import './components/HomilyStats.css';
 import './components/HomilyKeywordHistogram.css';
 import './components/HomilyTranscript.css';
-import { Mass } from './types';
+import { Mass, ResultsIndex, INDEX_VERSION } from './types';
+import { RESULTS_BASE } from './hooks/useTranscripts';
 
 const GraphSection: React.FC<{children: React.ReactNode}> = ({ children }) => {
     const [ref, isIntersecting] = useIntersectionObserver({ threshold: 0.5 });
@@ -33,6 +34,7 @@ function App() {
   const [massData, setMassData] = useState<Mass[]>([]);
   const [massSortOrder, setMassSortOrder] = useState('asc');
   const [currentMassIndex, setCurrentMassIndex] = useState(0);
+  const [dataError, setDataError] = useState('');
 
   const toggleTheme = () => {
     const newTheme = theme === 'light' ? 'dark' : 'light';
@@ -52,11 +54,18 @@ function App() {
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const response = await fetch('/results.json');
-        const data = await response.json();
-        setMassData(data);
+        // Only the summary index is fetched up front, transcripts are loaded when they are shown
+        const response = await fetch(RESULTS_BASE + 'index.json');
+        const data: ResultsIndex = await response.json();
+        // An older export lacks the fields the charts read, so it is rejected rather than shown as NaN
+        if (!data.version || data.version < INDEX_VERSION) {
+          setDataError(`The results index is version ${data.version ?? 1}, but the dashboard needs version ${INDEX_VERSION}. Export the results again with pipeline/results.py.`);
+          return;
+        }
+        setMassData(data.masses);
       } catch (error) {
         console.error("Error fetching mass data:", error);
+        setDataError('Could not load the results index.');
       }
     };
     fetchData();
@@ -73,19 +82,14 @@ function App() {
   }), [massData, massType]);
 
   const sortedMasses = useMemo(() => {
-    const massesWithDuration = filteredData.map(mass => {
-        const start = parseFloat(mass.mass_parts.beginning_of_mass as string);
-        const end = parseFloat(mass.mass_parts.end_of_mass as string);
-        const duration = (!isNaN(start) && !isNaN(end)) ? end - start : 0;
-        return { ...mass, duration };
-    });
+    const sorted = [...filteredData];
 
     if (massSortOrder === 'asc') {
-        massesWithDuration.sort((a, b) => (a.duration || 0) - (b.duration || 0));
+        sorted.sort((a, b) => (a.duration || 0) - (b.duration || 0));
     } else {
-        massesWithDuration.sort((a, b) => (b.duration || 0) - (a.duration || 0));
+        sorted.sort((a, b) => (b.duration || 0) - (a.duration || 0));
     }
-    return massesWithDuration;
+    return sorted;
   }, [filteredData, massSortOrder]);
 
   useEffect(() => {
@@ -104,14 +108,7 @@ function App() {
 
   const averageDuration = useMemo(() => {
     if (filteredData.length === 0) return 0;
-    const totalDuration = filteredData.reduce((acc, mass) => {
-      const start = parseFloat(mass.mass_parts.beginning_of_mass as string);
-      const end = parseFloat(mass.mass_parts.end_of_mass as string);
-      if (!isNaN(start) && !isNaN(end)) {
-        return acc + (end - start);
-      }
-      return acc;
-    }, 0);
+    const totalDuration = filteredData.reduce((acc, mass) => acc + (mass.duration ?? 0), 0);
     return totalDuration / filteredData.length;
   }, [filteredData]);
 
@@ -127,6 +124,7 @@ function App() {
         setMassType={setMassType}
       />
       <main className="main-content-scrolling">
+        {dataError && <div className="data-error">{dataError}</div>}
         <GraphSection>
             <h2>Mass Duration Histogram</h2>
             {filteredData.length > 0 && (
@@ -1,8 +1,12 @@
-import React, { useState, useEffect, useRef } from 'react';
+import React, { useState, useEffect, useRef, useMemo } from 'react';
 import { Mass } from '../types';
 import Chart from 'chart.js/auto';
-import { getHomily } from './getHomily';
 import HomilyTranscript from './HomilyTranscript';
+import useTranscripts from '../hooks/useTranscripts';
+import useSearchIndex from '../hooks/useSearchIndex';
+
+const formatTime = (seconds: number): string =>
+    `${Math.floor(seconds / 60)}:${String(Math.floor(seconds % 60)).padStart(2, '0')}`;
 
 interface HomilyKeywordHistogramProps {
     data: Mass[];
@@ -30,18 +34,31 @@ const HomilyKeywordHistogram: React.FC<HomilyKeywordHistogramProps> = ({ data, t
         setKeyword(event.target.value);
     };
 
-    const filteredHomilies = (() => {
+    // Keywords are looked up in the search index; only the transcript being shown is fetched
+    const occurrences = useSearchIndex(keyword, 'homily');
+
+    // The times each shown Mass's homily says the keyword
+    const occurrenceTimes = useMemo(() => {
+        const times: { [massId: string]: number[] } = {};
+        occurrences.forEach(occurrence => {
+            (times[occurrence.mass_id] ??= []).push(occurrence.time);
+        });
+        return times;
+    }, [occurrences]);
+
+    const filteredHomilies = useMemo(() => {
         if (!selectedPriest) return [];
         return data
-            .filter(mass => mass.metadata.priest === selectedPriest && mass.transcript)
-            .filter(mass => (getHomily(mass).match(new RegExp(keyword, 'gi')) || []).length > 0)
-    })();
+            .filter(mass => mass.metadata.priest === selectedPriest && mass.homily_start !== null)
+            .filter(mass => !keyword || occurrenceTimes[mass.id]);
+    }, [data, selectedPriest, keyword, occurrenceTimes]);
 
     useEffect(() => {
         setCurrentHomilyIndex(0);
     }, [selectedPriest, keyword]);
 
-    const currentMass = filteredHomilies[currentHomilyIndex];
+    const shownMasses = useMemo(() => filteredHomilies.slice(currentHomilyIndex, currentHomilyIndex + 1), [filteredHomilies, currentHomilyIndex]);
+    const [currentMass] = useTranscripts(shownMasses);
 
     const handleNextHomily = () => {
         if (filteredHomilies.length > 0) {
@@ -69,14 +86,7 @@ const HomilyKeywordHistogram: React.FC<HomilyKeywordHistogramProps> = ({ data, t
         data.forEach(mass => {
             const priest = mass.metadata.priest;
             if (!priest) return;
-
-            if (!priestKeywordCounts[priest]) {
-                priestKeywordCounts[priest] = 0;
-            }
-
-            const homilyText = getHomily(mass);
-            const keywordCount = (homilyText.match(new RegExp(keyword, 'gi')) || []).length;
-            priestKeywordCounts[priest] += keywordCount;
+            priestKeywordCounts[priest] = (priestKeywordCounts[priest] ?? 0) + (occurrenceTimes[mass.id]?.length ?? 0);
         });
 
         const priestLabels = Object.keys(priestKeywordCounts);
@@ -113,7 +123,7 @@ const HomilyKeywordHistogram: React.FC<HomilyKeywordHistogramProps> = ({ data, t
             }
         });
 
-    }, [data, keyword, theme]);
+    }, [data, occurrenceTimes, keyword, theme]);
 
     return (
         <div className='homily-keyword-container'>
@@ -143,13 +153,20 @@ const HomilyKeywordHistogram: React.FC<HomilyKeywordHistogramProps> = ({ data, t
                             {priests.map(p => <option key={p} value={p}>{p}</option>)}
                         </select>
                     </h3>
-                    {currentMass ? (
+                    {filteredHomilies.length > 0 ? (
                         <div>
                             <div className="controls">
                                 <button onClick={handlePrevHomily}>&larr; Previous</button>
                                 <button onClick={handleNextHomily}>Next &rarr;</button>
                             </div>
-                            <HomilyTranscript mass={currentMass} keyword={keyword} />
+                            {currentMass ? (
+                                <>
+                                    {occurrenceTimes[currentMass.id] && (
+                                        <p>Said at {occurrenceTimes[currentMass.id].map(formatTime).join(', ')}</p>
+                                    )}
+                                    <HomilyTranscript mass={currentMass} keyword={keyword} />
+                                </>
+                            ) : <p>Loading transcript...</p>}
                         </div>
                     ) : <p>No homilies found for the selected priest and keyword.</p>}
                 </div>
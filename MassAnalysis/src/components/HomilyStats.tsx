@@ -7,33 +7,8 @@ interface HomilyStatsProps {
     theme: string;
 }
 
-const massPartOrder = [
-    'homily', 
-    'creed', 
-    'prayers_of_the_faithful', 
-    'eucharistic_prayer', 
-];
-
 const getHomilyDuration = (mass: Mass): number | null => {
-    const massParts = mass.mass_parts;
-    const homilyStart = parseFloat(massParts.homily as string);
-    if(isNaN(homilyStart)) return null;
-
-    let nextPartName: string | null = null;
-    for (let i = 1; i < massPartOrder.length; i++) {
-        if (massParts[massPartOrder[i]]) {
-            nextPartName = massPartOrder[i];
-            break;
-        }
-    }
-
-    if (nextPartName) {
-        const nextPartStart = parseFloat(massParts[nextPartName] as string);
-        if(!isNaN(nextPartStart)) {
-            return (nextPartStart - homilyStart) / 60; // in minutes
-        }
-    }
-    return null;
+    return mass.homily_duration !== null ? mass.homily_duration / 60 : null; // in minutes
 }
 
 const PriestAverageHomilyChart: React.FC<HomilyStatsProps> = ({ data, theme }) => {
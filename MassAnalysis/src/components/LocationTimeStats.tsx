@@ -23,10 +23,8 @@ const LocationTimeAverageDurationChart: React.FC<LocationTimeStatsProps> = ({ da
             if (!locationTimeData[key]) {
                 locationTimeData[key] = { totalDuration: 0, count: 0 };
             }
-            const start = parseFloat(mass.mass_parts.beginning_of_mass as string);
-            const end = parseFloat(mass.mass_parts.end_of_mass as string);
-            if (!isNaN(start) && !isNaN(end)) {
-                locationTimeData[key].totalDuration += (end - start) / 60; // in minutes
+            if (mass.duration !== null) {
+                locationTimeData[key].totalDuration += mass.duration / 60; // in minutes
                 locationTimeData[key].count++;
             }
         });
@@ -96,12 +94,7 @@ const LocationTimeMassHistogram: React.FC<LocationTimeMassHistogramProps> = ({ d
         };
 
         const massDurations = filteredData.map(mass => {
-            const start = parseFloat(mass.mass_parts.beginning_of_mass as string);
-            const end = parseFloat(mass.mass_parts.end_of_mass as string);
-            if (!isNaN(start) && !isNaN(end)) {
-                return (end - start) / 60; // in minutes
-            }
-            return null;
+            return mass.duration !== null ? mass.duration / 60 : null; // in minutes
         }).filter((duration): duration is number => duration !== null);
 
         if (chartInstance.current) {
@@ -1,24 +1,19 @@
-import React from 'react';
-import { Mass } from '../types';
+import React, { useMemo } from 'react';
+import { Mass, MassSectionDurations } from '../types';
 import Chart from 'chart.js/auto';
-
-const massSections = [
-    { name: 'Introductory Rites', startKey: 'beginning_of_mass', endKey: 'first_reading' },
-    { name: 'Liturgy of the Word', startKey: 'first_reading', endKey: 'homily' },
-    { name: 'Homily', startKey: 'homily', endKey: 'creed', fallbackEndKey: 'prayers_of_the_faithful' },
-    { name: 'Creed & Prayers', startKey: 'creed', fallbackStartKey: 'prayers_of_the_faithful', endKey: 'eucharistic_prayer' },
-    { name: 'Liturgy of the Eucharist', startKey: 'eucharistic_prayer', endKey: 'distribution_of_communion' },
-    { name: 'Communion & Concluding Rites', startKey: 'distribution_of_communion', endKey: 'end_of_mass' }
+import HomilyTranscript from './HomilyTranscript';
+import useTranscripts from '../hooks/useTranscripts';
+
+// Section durations are computed by the pipeline, see MASS_SECTIONS in pipeline/mass_summary.py
+const massSections: { name: string, key: keyof MassSectionDurations }[] = [
+    { name: 'Introductory Rites', key: 'introductory_rites' },
+    { name: 'Liturgy of the Word', key: 'liturgy_of_the_word' },
+    { name: 'Homily', key: 'homily' },
+    { name: 'Creed & Prayers', key: 'creed_and_prayers' },
+    { name: 'Liturgy of the Eucharist', key: 'liturgy_of_the_eucharist' },
+    { name: 'Communion & Concluding Rites', key: 'communion_and_concluding_rites' }
 ];
 
-const getPartTime = (massParts: { [key: string]: number | string }, key: string): number | null => {
-    if (massParts[key]) {
-        const time = parseFloat(massParts[key] as string);
-        if (!isNaN(time)) return time;
-    }
-    return null;
-};
-
 interface PriestMassBreakdownChartProps {
     data: Mass[];
     theme: string;
@@ -44,28 +39,11 @@ const PriestMassBreakdownChart: React.FC<PriestMassBreakdownChartProps> = ({ dat
                 });
             }
 
-            const massParts = mass.mass_parts;
-
             massSections.forEach(section => {
-                let startKey = section.startKey;
-                let endKey = section.endKey;
-
-                if (section.fallbackStartKey && !massParts[startKey]) {
-                    startKey = section.fallbackStartKey;
-                }
-                if (section.fallbackEndKey && !massParts[endKey]) {
-                    endKey = section.fallbackEndKey;
-                }
-
-                const startTime = getPartTime(massParts, startKey);
-                const endTime = getPartTime(massParts, endKey);
-
-                if (startTime !== null && endTime !== null) {
-                    const duration = (endTime - startTime) / 60;
-                    if (duration >= 0) {
-                        priestData[priest][section.name].totalDuration += duration;
-                        priestData[priest][section.name].count++;
-                    }
+                const duration = mass.section_durations?.[section.key];
+                if (duration !== undefined) {
+                    priestData[priest][section.name].totalDuration += duration / 60;
+                    priestData[priest][section.name].count++;
                 }
             });
         });
@@ -159,7 +137,10 @@ interface MassDetailViewerProps {
     onPrev?: () => void;
 }
 
-const MassDetailViewer: React.FC<MassDetailViewerProps> = ({ theme, data }) => {
+const MassDetailViewer: React.FC<MassDetailViewerProps> = ({ mass, theme, data, massSortOrder, setMassSortOrder, onNext, onPrev }) => {
+    // The transcript of a mass is only fetched once it is opened here
+    const openedMasses = useMemo(() => mass ? [mass] : [], [mass]);
+    const [openedMass] = useTranscripts(openedMasses);
 
     return (
         <div className="mass-detail-viewer">
@@ -167,6 +148,24 @@ const MassDetailViewer: React.FC<MassDetailViewerProps> = ({ theme, data }) => {
                 <h3>Priest Average Mass Breakdown by Section</h3>
                 <PriestMassBreakdownChart data={data} theme={theme} />
             </div>
+            {mass && (
+                <div className="mass-detail-metadata">
+                    <div className="controls">
+                        <button onClick={onPrev}>&larr; Previous</button>
+                        <select value={massSortOrder} onChange={e => setMassSortOrder?.(e.target.value)}>
+                            <option value="asc">Shortest first</option>
+                            <option value="desc">Longest first</option>
+                        </select>
+                        <button onClick={onNext}>Next &rarr;</button>
+                    </div>
+                    <h3>{mass.metadata.date} {mass.metadata.mass_time}, {mass.metadata.mass_location}</h3>
+                    <p>{mass.metadata.priest}</p>
+                    {mass.duration !== null && (
+                        <p>Duration: {Math.floor(mass.duration / 60)}m {Math.round(mass.duration % 60)}s</p>
+                    )}
+                    {openedMass ? <HomilyTranscript mass={openedMass} /> : <p>Loading transcript...</p>}
+                </div>
+            )}
         </div>
     );
 };
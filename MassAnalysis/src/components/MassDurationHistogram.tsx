@@ -21,12 +21,7 @@ const MassDurationHistogram: React.FC<MassDurationHistogramProps> = ({ data, the
     }
 
     const massDurations = data.map(mass => {
-      const start = parseFloat(mass.mass_parts.beginning_of_mass as string);
-      const end = parseFloat(mass.mass_parts.end_of_mass as string);
-      if (!isNaN(start) && !isNaN(end)) {
-        return (end - start) / 60; // in minutes
-      }
-      return null;
+      return mass.duration !== null ? mass.duration / 60 : null; // in minutes
     }).filter((duration): duration is number => duration !== null);
 
     if (chartInstance.current) {
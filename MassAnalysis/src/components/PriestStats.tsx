@@ -21,10 +21,8 @@ const PriestAverageDurationChart: React.FC<PriestStatsProps> = ({ data, theme })
             if (!priestData[priest]) {
                 priestData[priest] = { totalDuration: 0, count: 0 };
             }
-            const start = parseFloat(mass.mass_parts.beginning_of_mass as string);
-            const end = parseFloat(mass.mass_parts.end_of_mass as string);
-            if (!isNaN(start) && !isNaN(end)) {
-                priestData[priest].totalDuration += (end - start) / 60; // in minutes
+            if (mass.duration !== null) {
+                priestData[priest].totalDuration += mass.duration / 60; // in minutes
                 priestData[priest].count++;
             }
         });
@@ -90,12 +88,7 @@ const PriestMassHistogram: React.FC<PriestMassHistogramProps> = ({ data, priest,
         };
 
         const massDurations = filteredData.map(mass => {
-            const start = parseFloat(mass.mass_parts.beginning_of_mass as string);
-            const end = parseFloat(mass.mass_parts.end_of_mass as string);
-            if (!isNaN(start) && !isNaN(end)) {
-                return (end - start) / 60; // in minutes
-            }
-            return null;
+            return mass.duration !== null ? mass.duration / 60 : null; // in minutes
         }).filter((duration): duration is number => duration !== null);
 
         if (chartInstance.current) {
@@ -0,0 +1,109 @@
+import { useState, useEffect } from 'react';
+import { RESULTS_BASE } from './useTranscripts';
+
+// The search index exported with the results, see pipeline/search_index.py
+const SEARCH_BASE = RESULTS_BASE + 'search/';
+
+export interface SearchManifest {
+    version: number;
+    shards: number;
+    masses: { id: string; priest: string }[];
+    priests: { [priest: string]: { masses: number; homily_tokens: number; tokens: number } };
+}
+
+interface Postings {
+    m: number[];
+    p: number[];
+    t: number[];
+    h: number[];
+}
+
+export interface Occurrence {
+    mass_id: string;
+    priest: string;
+    time: number;
+    part: 'homily' | 'rest';
+}
+
+// Must match search_index.tokenize
+export const tokenize = (text: string): string[] =>
+    text.toLowerCase().replace(/’/g, "'").match(/[a-z0-9]+(?:'[a-z0-9]+)*/g) ?? [];
+
+// Must match search_index.term_shard: 32-bit FNV-1a. Terms are ASCII, so characters are bytes.
+const termShard = (term: string, shards: number): number => {
+    let h = 0x811c9dc5;
+    for (let i = 0; i < term.length; i++) {
+        h = Math.imul(h ^ term.charCodeAt(i), 0x01000193) >>> 0;
+    }
+    return h % shards;
+};
+
+// Each file is fetched once for the lifetime of the page
+const fileCache = new Map<string, Promise<any>>();
+
+const loadJson = (path: string): Promise<any> => {
+    let file = fileCache.get(path);
+    if (!file) {
+        file = fetch(SEARCH_BASE + path)
+            .then(response => response.json())
+            .catch(error => {
+                console.error(`Error fetching ${path}:`, error);
+                fileCache.delete(path);
+                return {};
+            });
+        fileCache.set(path, file);
+    }
+    return file;
+};
+
+export const loadManifest = (): Promise<SearchManifest> => loadJson('manifest.json');
+
+const loadShard = async (kind: 'counts' | 'postings', term: string) => {
+    const manifest = await loadManifest();
+    const shard = String(termShard(term, manifest.shards)).padStart(2, '0');
+    return loadJson(`${kind}/${shard}.json`);
+};
+
+// Every occurrence of a word or phrase, optionally only in the homily (or outside it)
+export const findOccurrences = async (query: string, part?: 'homily' | 'rest'): Promise<Occurrence[]> => {
+    const terms = tokenize(query);
+    if (terms.length === 0) return [];
+    const [manifest, ...entries] = await Promise.all([
+        loadManifest(),
+        ...terms.map(term => loadShard('postings', term).then(shard => shard[term] as Postings | undefined))
+    ]);
+    if (entries.some(entry => !entry)) return [];
+
+    // A phrase occurs where each of its words follows the previous one in the same Mass
+    const following = entries.slice(1).map(entry => new Set(entry!.m.map((mass, i) => `${mass}:${entry!.p[i]}`)));
+    const first = entries[0]!;
+    const occurrences: Occurrence[] = [];
+    first.m.forEach((mass, i) => {
+        const occurrencePart = first.h[i] ? 'homily' : 'rest';
+        if (part && occurrencePart !== part) return;
+        if (following.every((positions, offset) => positions.has(`${mass}:${first.p[i] + offset + 1}`))) {
+            occurrences.push({ mass_id: manifest.masses[mass].id, priest: manifest.masses[mass].priest, time: first.t[i], part: occurrencePart });
+        }
+    });
+    return occurrences;
+};
+
+// Returns every occurrence of a word or phrase (in `part`, if given), or an empty list while
+// they are being looked up
+const useSearchIndex = (query: string, part?: 'homily' | 'rest'): Occurrence[] => {
+    const [occurrences, setOccurrences] = useState<Occurrence[]>([]);
+
+    useEffect(() => {
+        let cancelled = false;
+        findOccurrences(query, part).then(found => {
+            if (!cancelled) setOccurrences(found);
+        });
+        return () => {
+            cancelled = true;
+        };
+    }, [query, part]);
+
+    return occurrences;
+};
+
+export default useSearchIndex;
@@ -0,0 +1,56 @@
+import { useState, useEffect, useMemo } from 'react';
+import { Mass, TranscriptShard } from '../types';
+
+export const RESULTS_BASE = '/results/';
+
+const EMPTY_SHARD: TranscriptShard = { chunks: [], homily_text: null };
+
+// One request per shard for the lifetime of the page, shared by every component that needs it
+const transcriptCache = new Map<string, Promise<TranscriptShard>>();
+
+export const loadTranscript = (mass: Mass): Promise<TranscriptShard> => {
+    let transcript = transcriptCache.get(mass.id);
+    if (!transcript) {
+        transcript = fetch(RESULTS_BASE + mass.transcript_shard)
+            .then(response => response.json())
+            .then(shard => ({ ...EMPTY_SHARD, ...shard }) as TranscriptShard)
+            .catch(error => {
+                console.error(`Error fetching transcript for ${mass.audio_file}:`, error);
+                transcriptCache.delete(mass.id);
+                return EMPTY_SHARD;
+            });
+        transcriptCache.set(mass.id, transcript);
+    }
+    return transcript;
+};
+
+// Returns the masses with their transcript segments and homily text filled in once they are loaded.
+// Nothing is fetched while `enabled` is false.
+const useTranscripts = (masses: Mass[], enabled = true): Mass[] => {
+    const [transcripts, setTranscripts] = useState<{ [id: string]: TranscriptShard }>({});
+
+    useEffect(() => {
+        if (!enabled) return;
+        let cancelled = false;
+        // Applied in one update, so charts are drawn once rather than once per transcript
+        Promise.all(masses.map(loadTranscript)).then(loaded => {
+            if (cancelled) return;
+            setTranscripts(prev => {
+                const next = { ...prev };
+                masses.forEach((mass, index) => {
+                    next[mass.id] = loaded[index];
+                });
+                return next;
+            });
+        });
+        return () => {
+            cancelled = true;
+        };
+    }, [masses, enabled]);
+
+    return useMemo(() => masses
+        .filter(mass => transcripts[mass.id] !== undefined)
+        .map(mass => ({ ...mass, ...transcripts[mass.id] })), [masses, transcripts]);
+};
+
+export default useTranscripts;
@@ -1,5 +1,22 @@
+export interface TranscriptChunk {
+    start: number;
+    end: number | null;
+    text: string;
+}
+
+// Fields the pipeline derives from a Mass's analysis, all durations in seconds
+export interface MassSectionDurations {
+    introductory_rites?: number;
+    liturgy_of_the_word?: number;
+    homily?: number;
+    creed_and_prayers?: number;
+    liturgy_of_the_eucharist?: number;
+    communion_and_concluding_rites?: number;
+}
+
 export interface Mass {
-    transcript: string;
+    id: string;
+    audio_file: string;
     mass_parts: {
         [key: string]: number | string;
     };
@@ -10,5 +27,29 @@ export interface Mass {
         date: string;
         is_sunday: boolean;
     };
-    duration?: number;
-}
\ No newline at end of file
+    duration: number | null;
+    homily_start: number | null;
+    // null if no part after the homily was found
+    homily_end: number | null;
+    homily_duration: number | null;
+    section_durations: MassSectionDurations;
+    // Path of the transcript shard, relative to the results directory
+    transcript_shard: string;
+    // Only set once the shard has been loaded, see useTranscripts
+    chunks?: TranscriptChunk[];
+    // null if the homily was not found
+    homily_text?: string | null;
+}
+
+export interface TranscriptShard {
+    chunks: TranscriptChunk[];
+    homily_text: string | null;
+}
+
+// The index version the dashboard reads, see INDEX_VERSION in pipeline/results.py
+export const INDEX_VERSION = 2;
+
+export interface ResultsIndex {
+    version: number;
+    masses: Mass[];
+}
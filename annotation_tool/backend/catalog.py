@@ -0,0 +1,280 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from bisect import bisect_left, bisect_right
+
+UNKNOWN_PRIEST = "Unknown"
+DEFAULT_POLL_SECONDS = float(os.environ.get("ANNOTATION_CATALOG_POLL_SECONDS", 5))
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+DATE_LOCATION_PATTERN = re.compile(r'(\d{4})/(\d{1,2})/(\d{1,2})(?:/([^/]+)/)?')
+
+
+def get_date_from_path(path):
+    """
+    Extracts the date from a path like '2025/6/30/GoH/...', as an ISO date ('2025-06-30'),
+    so dates sort and compare correctly as strings. Returns None if the path has no date.
+    """
+    match = DATE_LOCATION_PATTERN.search(path)
+    if not match:
+        return None
+    year, month, day = (int(part) for part in match.group(1, 2, 3))
+    return f"{year:04d}-{month:02d}-{day:02d}"
+
+
+def get_location_from_path(path):
+    """Extracts the location from a path like '2025/6/30/GoH/...' ('GoH')."""
+    match = DATE_LOCATION_PATTERN.search(path)
+    return match.group(4) if match else None
+
+
+def sort_key(path):
+    """
+    The key masses are ordered by: their date, then their path (the recording's start time).
+    Masses without a date come before every dated mass.
+    """
+    return (get_date_from_path(path) or "", path)
+
+
+def render_json(data):
+    """
+    Returns the (JSON body, ETag) of `data`.
+    """
+    body = json.dumps(data).encode("utf-8")
+    return body, '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+class CatalogIndex:
+    """
+    A snapshot of the catalog sorted by `sort_key`, oldest first, with the positions of the
+    masses labelled with each priest, each location, and the labelled and unlabelled masses, in the same order.
+    A mass the pipeline only predicted a priest for is unlabelled, so it stays in the annotation queue.
+
+    It is built once per change to the catalog, and never modified, so queries can read it
+    without holding the catalog's lock.
+    """
+
+    def __init__(self, entries):
+        self.entries = sorted(entries, key=lambda entry: sort_key(entry["path"]))
+        self.keys = [sort_key(entry["path"]) for entry in self.entries]
+        self.dates = [key[0] for key in self.keys]
+        self.by_priest = {}
+        self.by_location = {}
+        self.by_labelled = {True: [], False: []}
+        for position, entry in enumerate(self.entries):
+            self.by_priest.setdefault(entry["priest"], []).append(position)
+            self.by_location.setdefault(entry["location"], []).append(position)
+            self.by_labelled[entry["priest"] != UNKNOWN_PRIEST].append(position)
+
+
+class MassCatalog:
+    """
+    Every mass under a data directory whose homily was extracted, kept in memory.
+
+    The catalog is read from the pipeline's catalog database (see pipeline/mass_database.py)
+    once by `scan`, then kept current by `poll`, which only fetches the masses written since the
+    last revision it saw, and by `set_label` when a label is saved through the API. The JSON of
+    the mass and priest lists is rendered once per change, with an ETag, so serving them does
+    no I/O at all.
+    """
+
+    def __init__(self, database, data_dir, homily_suffix="_homily"):
+        self.database = database
+        self.data_dir = os.path.realpath(data_dir)
+        self.homily_suffix = homily_suffix
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._revision = 0
+        self._entries = {}
+        self._version = 0
+        self._rendered = {}
+        self._index = None
+        self._poller = None
+        self._stop = threading.Event()
+
+    def _entry(self, mass):
+        mass_id = os.path.relpath(mass["base_name"], self.data_dir) + self.homily_suffix
+        return {
+            "id": mass_id.replace(os.path.sep, '_'), # Create a URL-safe ID
+            "path": mass_id, # Keep the original path for lookups
+            "priest": mass["annotated_priest"] or UNKNOWN_PRIEST, # Only a person's label makes a mass labelled
+            "predicted_priest": mass["predicted_priest"], # The speaker index's guess, to help the annotator
+            "date": mass["date"],
+            "location": mass["location"],
+            "revision": mass["revision"], # Changes whenever the pipeline re-runs, for versioned preview URLs
+        }
+
+    def scan(self):
+        """
+        Brings the catalog up to date with the database.
+
+        Returns:
+            bool: Whether anything changed.
+        """
+        with self._scan_lock:
+            masses, revision = self.database.changed_since(self._revision)
+            self._revision = revision
+            if not masses:
+                return False
+            with self._lock:
+                for mass in masses:
+                    if not mass["base_name"].startswith(self.data_dir + os.sep):
+                        continue
+                    if mass["homily_audio"]:
+                        self._entries[mass["base_name"]] = self._entry(mass)
+                    else:
+                        self._entries.pop(mass["base_name"], None)
+                self._changed()
+        return True
+
+    def set_label(self, base_name, priest_name):
+        """
+        Saves the priest a person labelled a recording with (`base_name` is its path without the
+        extension) to the database, and updates the catalog.
+
+        Returns:
+            bool: Whether the recording is in the database.
+        """
+        priest_name = priest_name.strip()
+        found = self.database.set_annotation(base_name, None if priest_name == UNKNOWN_PRIEST else priest_name)
+        self.scan()
+        return found
+
+    def _changed(self):
+        self._version += 1
+        self._rendered = {}
+        self._index = None
+
+    def _render(self, name, build):
+        with self._lock:
+            rendered = self._rendered.get(name)
+            if rendered is None:
+                rendered = self._rendered[name] = render_json(build())
+            return rendered
+
+    def index(self):
+        """
+        Returns the CatalogIndex of the catalog as it is now, building it if it changed.
+        """
+        with self._lock:
+            if self._index is None:
+                self._index = CatalogIndex(self._entries.values())
+            return self._index
+
+    def query(self, priest=None, location=None, labelled=None, date_from=None, date_to=None,
+              after=None, offset=0, limit=DEFAULT_PAGE_SIZE, oldest_first=False):
+        """
+        Returns one page of the masses matching every given filter, newest first.
+
+        The smallest index list among the filters is walked, restricted to the date range by
+        bisection, so a page costs time in proportion to the masses of that list in the range,
+        not to the whole catalog.
+
+        Args:
+            priest (str): Only masses labelled with this priest.
+            location (str): Only masses recorded at this location (e.g. 'GoH').
+            labelled (bool): Only labelled (True) or unlabelled (False) masses.
+            date_from (str): Only masses on or after this ISO date.
+            date_to (str): Only masses on or before this ISO date.
+            after (str): A cursor, the path of the last mass of the previous page. The page
+                         starts after it, even if masses were added or labelled since.
+            offset (int): How many matching masses to skip (after the cursor, if any).
+            limit (int): The most masses to return, at most MAX_PAGE_SIZE.
+            oldest_first (bool): Sort oldest first instead.
+
+        Returns:
+            dict: The page's "masses", the "total" number of masses matching the filters, and
+                  the "next_cursor" to pass as `after` for the next page (None on the last page).
+        """
+        index = self.index()
+        limit = max(0, min(limit, MAX_PAGE_SIZE))
+        offset = max(0, offset)
+
+        # Masses without a date sort first, and never match a date range, open-ended or not
+        start = bisect_left(index.dates, date_from) if date_from else 0
+        if date_from or date_to:
+            start = max(start, bisect_right(index.dates, ""))
+        end = bisect_right(index.dates, date_to) if date_to else len(index.entries)
+
+        lists = []
+        if priest is not None:
+            lists.append(index.by_priest.get(priest, []))
+        if location is not None:
+            lists.append(index.by_location.get(location, []))
+        if labelled is not None:
+            lists.append(index.by_labelled[bool(labelled)])
+        if lists:
+            positions = min(lists, key=len)
+            positions = positions[bisect_left(positions, start):bisect_left(positions, end)]
+        else:
+            positions = range(start, end)
+
+        def matches(entry):
+            return ((priest is None or entry["priest"] == priest)
+                    and (location is None or entry["location"] == location)
+                    and (labelled is None or (entry["priest"] != UNKNOWN_PRIEST) == bool(labelled)))
+        if len(lists) > 1:
+            positions = [position for position in positions if matches(index.entries[position])]
+        total = len(positions)
+
+        if after is not None:
+            # The cursor's key, not its position, so it still works if that mass is gone
+            if oldest_first:
+                cursor = bisect_right(index.keys, sort_key(after))
+                positions = positions[bisect_left(positions, cursor):]
+            else:
+                cursor = bisect_left(index.keys, sort_key(after))
+                positions = positions[:bisect_left(positions, cursor)]
+        if not oldest_first:
+            positions = positions[::-1]
+
+        page = [index.entries[position] for position in positions[offset:offset + limit]]
+        next_cursor = page[-1]["path"] if page and len(positions) > offset + limit else None
+        return {"masses": page, "total": total, "next_cursor": next_cursor}
+
+    def unlabelled(self, limit=DEFAULT_PAGE_SIZE, after=None):
+        """
+        Returns the next `limit` unlabelled masses, newest first, in the same format as `query`.
+        Masses labelled since the previous page drop out of the queue without shifting it.
+        """
+        return self.query(labelled=False, after=after, limit=limit)
+
+    def priests(self):
+        """
+        Returns the (JSON body, ETag) of the sorted names of every known priest.
+        """
+        def build():
+            return sorted({entry["priest"] for entry in self._entries.values() if entry["priest"] != UNKNOWN_PRIEST})
+        return self._render("priests", build)
+
+    def locations(self):
+        """
+        Returns the (JSON body, ETag) of the sorted names of every location.
+        """
+        def build():
+            return sorted({entry["location"] for entry in self._entries.values() if entry["location"]})
+        return self._render("locations", build)
+
+    def poll(self, interval=DEFAULT_POLL_SECONDS):
+        """
+        Starts a background thread that calls `scan` every `interval` seconds.
+        """
+        if self._poller is not None:
+            return
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    if self.scan():
+                        print(f"Catalog updated: {len(self._entries)} masses.")
+                except Exception as e:
+                    print(f"Error reading {self.database.path}: {e}")
+
+        self._poller = threading.Thread(target=run, name="mass-catalog-poller", daemon=True)
+        self._poller.start()
+
+    def stop(self):
+        self._stop.set()
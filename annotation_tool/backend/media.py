@@ -0,0 +1,119 @@
+import os
+import re
+import threading
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".aac")
+MEDIA_TYPES = {".mp3": "audio/mpeg", ".wav": "audio/wav", ".m4a": "audio/mp4", ".aac": "audio/aac", ".json": "application/json"}
+CHUNK_SIZE = 64 * 1024
+MAX_CACHED_PATHS = 4096
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header, size):
+    """
+    Parses a single-range HTTP Range header ("bytes=start-end", "bytes=start-" or "bytes=-length").
+
+    Returns:
+        tuple: The (start, end) byte offsets, end inclusive, or None if the header is missing or
+               not one this server understands (the whole file is sent instead).
+
+    Raises:
+        RangeNotSatisfiable: If the range starts past the end of the file.
+    """
+    match = RANGE_PATTERN.match((header or "").strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        # The last `last` bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable(header)
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def read_chunks(path, start, end, chunk_size=CHUNK_SIZE):
+    """
+    Yields the bytes of a file from `start` to `end` (inclusive), `chunk_size` bytes at a time.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def entity_tag(stat):
+    """
+    Returns an ETag for a file from its size and modification time, so it changes whenever the file does.
+    """
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+class MediaFiles:
+    """
+    Finds the files the annotation tool serves under a data directory, remembering where each
+    one was found.
+
+    A request then costs a single stat of the remembered path (which it needs anyway for the
+    size and ETag) instead of probing every extension; a path whose file is gone is looked up again.
+    Paths that would leave the data directory are never served.
+    """
+
+    def __init__(self, data_dir, max_cached=MAX_CACHED_PATHS):
+        self.data_dir = os.path.realpath(data_dir)
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._paths = {}
+
+    def _inside(self, path):
+        return os.path.realpath(path).startswith(self.data_dir + os.sep)
+
+    def resolve(self, relative_base, extensions=AUDIO_EXTENSIONS):
+        """
+        Finds the file at `relative_base` (relative to the data directory, without its extension)
+        with the first of `extensions` that exists.
+
+        Returns:
+            tuple: The (path, os.stat_result) of the file, or None if there is none.
+        """
+        key = (relative_base, extensions)
+        with self._lock:
+            path = self._paths.get(key)
+        if path is not None:
+            try:
+                return path, os.stat(path)
+            except FileNotFoundError:
+                with self._lock:
+                    self._paths.pop(key, None)
+
+        base = os.path.join(self.data_dir, relative_base)
+        if not self._inside(base):
+            return None
+        for extension in extensions:
+            try:
+                stat = os.stat(base + extension)
+            except FileNotFoundError:
+                continue
+            with self._lock:
+                if len(self._paths) >= self.max_cached:
+                    # Forget the oldest path (dicts keep insertion order)
+                    self._paths.pop(next(iter(self._paths)))
+                self._paths[key] = base + extension
+            return base + extension, stat
+        return None
@@ -1,11 +1,12 @@
 import os
+import sys
 import json
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import FileResponse
+from datetime import date
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import glob
-import re
 
 app = FastAPI()
 
@@ -23,99 +24,191 @@ class Annotation(BaseModel):
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 DATA_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, "..", "..", "s3_downloads"))
 LABEL_SUFFIX = "_priest_label.txt"
-AUDIO_SUFFIX = ".mp3"
+HOMILY_SUFFIX = "_homily"
+PEAKS_SUFFIX = "_peaks"
+
+sys.path.insert(0, os.path.join(SCRIPT_DIR, "..", "..", "pipeline"))
+from speaker_index import get_speaker_index
+from mass_database import get_database
+from catalog import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, MassCatalog, render_json
+from previews import CLIP_POSITIONS, SPEECH_SUFFIX, clip_suffix
+from media import MEDIA_TYPES, MediaFiles, RangeNotSatisfiable, entity_tag, parse_range, read_chunks
+
+database = get_database()
+catalog = MassCatalog(database, DATA_DIR, HOMILY_SUFFIX)
+media = MediaFiles(DATA_DIR)
+
+# The files the pipeline's --previews makes next to a homily, by the name the API knows them by
+PREVIEW_FILES = {"speech": SPEECH_SUFFIX, **{position: clip_suffix(position) for position in CLIP_POSITIONS}}
+# Versioned preview URLs always name the same file, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+@app.on_event("startup")
+def load_catalog():
+    """
+    Builds the catalog of masses, and keeps it current with what the pipeline adds to the database.
+    """
+    catalog.scan()
+    catalog.poll()
 
-def get_date_from_path(path):
-    """Extracts date from a path like '2025/6/30/GoH/...'"""
-    match = re.search(r'(\d{4}/\d{1,2}/\d{1,2})', path)
-    return match.group(1) if match else "No Date"
+@app.on_event("shutdown")
+def stop_catalog():
+    catalog.stop()
 
-@app.get("/api/masses")
-async def get_masses():
+def cached_json(request: Request, rendered):
     """
-    Scans the data directory for priest label files (.txt) and returns a list of masses.
+    Returns a rendered (body, ETag) pair, or 304 Not Modified if the client already has it.
     """
-    masses = []
-    search_path = os.path.join(DATA_DIR, '**/*' + LABEL_SUFFIX)
-    label_files = glob.glob(search_path, recursive=True)
+    body, etag = rendered
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
-    for file_path in label_files:
-        try:
-            with open(file_path, 'r') as f:
-                priest_name = f.read().strip()
-                if not priest_name:
-                    priest_name = "Unknown"
-
-            relative_path = os.path.relpath(file_path, DATA_DIR)
-            mass_id = relative_path.replace(LABEL_SUFFIX, "")
-            
-            masses.append({
-                "id": mass_id.replace(os.path.sep, '_'), # Create a URL-safe ID
-                "path": mass_id, # Keep the original path for lookups
-                "priest": priest_name,
-                "date": get_date_from_path(mass_id),
-            })
-        except Exception as e:
-            print(f"Skipping file {file_path} due to error: {e}")
-            continue
+@app.get("/api/masses")
+async def get_masses(
+    request: Request,
+    priest: Optional[str] = None,
+    location: Optional[str] = None,
+    labelled: Optional[bool] = None,
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    after: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    order: str = Query("newest", pattern="^(newest|oldest)$"),
+):
+    """
+    Returns one page of the masses with an extracted homily, from the in-memory catalog,
+    newest first, filtered by priest, location (e.g. GoH), labelled or not, and date range.
 
-    masses.sort(key=lambda x: (x['priest'] == 'Unknown', x['date']), reverse=True)
-    return masses
+    Pass the returned `next_cursor` as `after` to get the next page.
+    """
+    page = catalog.query(
+        priest=priest, location=location, labelled=labelled,
+        date_from=date_from.isoformat() if date_from else None,
+        date_to=date_to.isoformat() if date_to else None,
+        after=after, offset=offset, limit=limit, oldest_first=order == "oldest"
+    )
+    return cached_json(request, render_json(page))
+
+@app.get("/api/masses/unlabelled")
+async def get_unlabelled_masses(
+    request: Request,
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+):
+    """
+    Returns the next `limit` unlabelled masses, newest first: the annotation queue.
+    """
+    return cached_json(request, render_json(catalog.unlabelled(limit, after)))
 
 @app.get("/api/priests")
-async def get_priests():
+async def get_priests(request: Request):
     """
-    Scans all data files to compile a unique list of known priest names.
+    Returns the unique list of known priest names, from the in-memory catalog.
     """
-    priests = set()
-    search_path = os.path.join(DATA_DIR, '**/*' + LABEL_SUFFIX)
-    label_files = glob.glob(search_path, recursive=True)
-    for file_path in label_files:
-        try:
-            with open(file_path, 'r') as f:
-                priest_name = f.read().strip()
-                if priest_name and priest_name != "Unknown":
-                    priests.add(priest_name)
-        except Exception:
-            continue
-    return sorted(list(priests))
+    return cached_json(request, catalog.priests())
 
+@app.get("/api/locations")
+async def get_locations(request: Request):
+    """
+    Returns the list of locations masses were recorded at, from the in-memory catalog.
+    """
+    return cached_json(request, catalog.locations())
 
+
+def file_response(request: Request, path, stat, cache_control="no-cache"):
+    """
+    Serves a file, or the one byte range of it the request asks for, so the browser can seek
+    in a long homily without downloading all of it.
+    """
+    etag = entity_tag(stat)
+    headers = {"Accept-Ranges": "bytes", "ETag": etag, "Cache-Control": cache_control}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    # A range of a file that changed since the client last saw it would be garbage, so send it all
+    if request.headers.get("if-range", etag) != etag:
+        range_header = None
+    try:
+        byte_range = parse_range(range_header, stat.st_size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+
+    media_type = MEDIA_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(read_chunks(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+# Plain functions, so FastAPI runs their file I/O in a worker thread instead of the event loop
 @app.get("/api/audio/{mass_path:path}")
-async def get_audio(mass_path: str):
+def get_audio(mass_path: str, request: Request):
     """
-    Serves the audio file for the specified mass path.
+    Serves the audio file for the specified mass path (e.g. '2025/6/30/GoH/14-01-27_homily'),
+    with support for Range requests.
     """
-    # The path comes from the 'path' field in the mass object
-    audio_path_base = os.path.join(DATA_DIR, mass_path)
-    
-    # The user example was `14-01-27_homily.mp3`
-    # The ID is `2025/6/30/GoH/14-01-27_homily`
-    # So we need to find the audio file based on the base name
-    audio_file = audio_path_base + ".mp3" # Assuming mp3 based on user feedback
+    found = media.resolve(mass_path)
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Audio file not found for {mass_path}")
+    return file_response(request, *found)
 
-    if not os.path.exists(audio_file):
-        # Fallback for other audio types if needed
-        for ext in [".wav", ".m4a", ".aac"]:
-            if os.path.exists(audio_path_base + ext):
-                audio_file = audio_path_base + ext
-                break
-        else: # If no loop break
-             raise HTTPException(status_code=404, detail=f"Audio file not found at {audio_file}")
-
-    return FileResponse(audio_file)
+@app.get("/api/peaks/{mass_path:path}")
+def get_peaks(mass_path: str, request: Request):
+    """
+    Serves the waveform peaks the pipeline computed for a homily, so it can be drawn before
+    (or without) downloading the audio.
+    """
+    found = media.resolve(mass_path + PEAKS_SUFFIX, (".json",))
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"Waveform peaks not found for {mass_path}")
+    return file_response(request, *found)
+
+@app.get("/api/previews/{mass_path:path}")
+def get_preview(
+    mass_path: str,
+    request: Request,
+    clip: str = Query("start", pattern="^(" + "|".join(PREVIEW_FILES) + ")$"),
+    v: Optional[str] = None,
+):
+    """
+    Serves a low-bitrate preview of a homily: a short clip from its start, middle or end, or the
+    whole homily as mono speech ("speech"). Pass the mass's `revision` as `v` to let the browser
+    cache it for good; a re-run of the pipeline changes the revision, and so the URL.
+    """
+    found = media.resolve(mass_path + os.path.splitext(PREVIEW_FILES[clip])[0], (".mp3",))
+    if found is None:
+        raise HTTPException(status_code=404, detail=f"No {clip} preview for {mass_path}")
+    return file_response(request, *found, IMMUTABLE_CACHE_CONTROL if v else "no-cache")
 
 @app.post("/api/masses/{mass_path:path}/annotate")
-async def annotate_mass(mass_path: str, annotation: Annotation):
+def annotate_mass(mass_path: str, annotation: Annotation):
     """
     Updates the priest label for a specific mass.
     """
-    label_path = os.path.join(DATA_DIR, mass_path + LABEL_SUFFIX)
-    if not os.path.exists(label_path):
-        raise HTTPException(status_code=404, detail=f"Label file not found at {label_path}")
-
-    with open(label_path, 'w') as f:
+    recording_base = os.path.join(DATA_DIR, mass_path)
+    if recording_base.endswith(HOMILY_SUFFIX):
+        recording_base = recording_base[:-len(HOMILY_SUFFIX)]
+    if database.mass(recording_base) is None:
+        raise HTTPException(status_code=404, detail=f"Mass not found at {mass_path}")
+
+    # The label file is still written for tools that read the sidecar files
+    with open(os.path.join(DATA_DIR, mass_path + LABEL_SUFFIX), 'w') as f:
         f.write(annotation.priest)
+    catalog.set_label(recording_base, annotation.priest)
+
+    # Teach the speaker index, so the pipeline recognizes this priest in new homilies
+    stored = database.fingerprint(recording_base)
+    if stored is not None:
+        version, fingerprint, _ = stored
+        try:
+            get_speaker_index(fingerprint_version=version).add(os.path.realpath(recording_base), fingerprint, annotation.priest)
+        except Exception as e:
+            print(f"Could not add the fingerprint of {mass_path} to the speaker index: {e}")
 
     return {"status": "success", "mass_path": mass_path, "new_priest": annotation.priest}
 
@@ -1,29 +1,58 @@
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
+import Waveform from './Waveform';
 import './App.css';
 
 const API_BASE_URL = 'http://127.0.0.1:8000';
+const PAGE_SIZE = 50;
+const DEFAULT_FILTERS = { priest: '', location: '', labelled: 'unlabelled', from: '', to: '' };
+const PREVIEW_CLIPS = ['start', 'middle', 'end'];
+
+// Previews are versioned by the mass's revision, so the server lets the browser cache them for good
+const previewUrl = (mass, clip) => `${API_BASE_URL}/api/previews/${mass.path}?clip=${clip}&v=${mass.revision}`;
 
 function App() {
     const [masses, setMasses] = useState([]);
+    const [total, setTotal] = useState(0);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [filters, setFilters] = useState(DEFAULT_FILTERS);
     const [priests, setPriests] = useState([]);
+    const [locations, setLocations] = useState([]);
     const [selectedMass, setSelectedMass] = useState(null);
     const [newPriestName, setNewPriestName] = useState('');
     const [selectedPriest, setSelectedPriest] = useState('');
     const [isLoading, setIsLoading] = useState(false);
     const [error, setError] = useState('');
+    const audioRef = useRef(null);
+    const previewRef = useRef(null);
+    // Masses processed without --previews only have the original homily audio
+    const [useOriginal, setUseOriginal] = useState(false);
 
     useEffect(() => {
-        fetchMasses();
         fetchPriests();
+        fetchLocations();
     }, []);
 
-    const fetchMasses = async () => {
+    useEffect(() => {
+        fetchMasses();
+    }, [filters]);
+
+    // Fetches the first page of masses matching the filters, or the page after `after`
+    const fetchMasses = async (after = null) => {
         setIsLoading(true);
+        const params = { limit: PAGE_SIZE };
+        if (filters.priest) params.priest = filters.priest;
+        if (filters.location) params.location = filters.location;
+        if (filters.labelled) params.labelled = filters.labelled === 'labelled';
+        if (filters.from) params.from = filters.from;
+        if (filters.to) params.to = filters.to;
+        if (after) params.after = after;
         try {
-            const response = await axios.get(`${API_BASE_URL}/api/masses`);
-            setMasses(response.data);
+            const response = await axios.get(`${API_BASE_URL}/api/masses`, { params });
+            setMasses(after ? [...masses, ...response.data.masses] : response.data.masses);
+            setTotal(response.data.total);
+            setNextCursor(response.data.next_cursor);
         } catch (err) {
             setError('Failed to fetch masses. Is the backend server running?');
             console.error(err);
@@ -41,12 +70,32 @@ function App() {
         }
     };
 
+    const fetchLocations = async () => {
+        try {
+            const response = await axios.get(`${API_BASE_URL}/api/locations`);
+            setLocations(response.data);
+        } catch (err) {
+            console.error(err);
+        }
+    };
+
+    const handleFilterChange = (name) => (e) => {
+        setFilters({ ...filters, [name]: e.target.value });
+    };
+
     const handleSelectMass = (mass) => {
         setSelectedMass(mass);
+        setUseOriginal(false);
         setSelectedPriest('');
         setNewPriestName('');
     };
 
+    const playPreview = (clip) => {
+        audioRef.current?.pause();
+        previewRef.current.src = previewUrl(selectedMass, clip);
+        previewRef.current.play();
+    };
+
     const handleAnnotationSubmit = async (e) => {
         e.preventDefault();
         if (!selectedMass) return;
@@ -73,6 +122,36 @@ function App() {
         }
     };
 
+    const renderFilters = () => (
+        <div className="row g-2 mb-3">
+            <div className="col-6">
+                <select className="form-select" value={filters.labelled} onChange={handleFilterChange('labelled')}>
+                    <option value="unlabelled">Unlabelled</option>
+                    <option value="labelled">Labelled</option>
+                    <option value="">All</option>
+                </select>
+            </div>
+            <div className="col-6">
+                <select className="form-select" value={filters.location} onChange={handleFilterChange('location')}>
+                    <option value="">All locations</option>
+                    {locations.map(l => <option key={l} value={l}>{l}</option>)}
+                </select>
+            </div>
+            <div className="col-12">
+                <select className="form-select" value={filters.priest} onChange={handleFilterChange('priest')}>
+                    <option value="">All priests</option>
+                    {priests.map(p => <option key={p} value={p}>{p}</option>)}
+                </select>
+            </div>
+            <div className="col-6">
+                <input type="date" className="form-control" value={filters.from} onChange={handleFilterChange('from')} />
+            </div>
+            <div className="col-6">
+                <input type="date" className="form-control" value={filters.to} onChange={handleFilterChange('to')} />
+            </div>
+        </div>
+    );
+
     const renderMassList = () => (
         <div className="list-group">
             {masses.map(mass => (
@@ -85,11 +164,16 @@ function App() {
                     <div className="d-flex w-100 justify-content-between">
                         {/* Display the readable path */}
                         <h5 className="mb-1">{mass.path}</h5> 
-                        <small>{mass.date}</small>
+                        <small>{mass.date || 'No date'}</small>
                     </div>
-                    <p className="mb-1">Priest: <strong>{mass.priest}</strong></p>
+                    <p className="mb-1">Priest: <strong>{mass.priest}</strong>{mass.predicted_priest && mass.priest === 'Unknown' && <> (predicted: {mass.predicted_priest})</>}</p>
                 </button>
             ))}
+            {nextCursor && (
+                <button type="button" className="list-group-item list-group-item-action text-center" onClick={() => fetchMasses(nextCursor)} disabled={isLoading}>
+                    Load more ({masses.length} of {total})
+                </button>
+            )}
         </div>
     );
 
@@ -98,6 +182,7 @@ function App() {
 
         // Use the raw path to construct the audio URL
         const audioUrl = `${API_BASE_URL}/api/audio/${selectedMass.path}`;
+        const peaksUrl = `${API_BASE_URL}/api/peaks/${selectedMass.path}`;
 
         return (
             <div className="card">
@@ -107,8 +192,30 @@ function App() {
                 </div>
                 <div className="card-body">
                     <p>Current Priest: <strong>{selectedMass.priest}</strong></p>
+                    {selectedMass.predicted_priest && <p>Predicted Priest: <strong>{selectedMass.predicted_priest}</strong></p>}
                     <h5>Listen to Homily</h5>
-                    <audio controls src={audioUrl} className="w-100 mb-3">
+                    {!useOriginal && (
+                        <div className="mb-2">
+                            {PREVIEW_CLIPS.map(clip => (
+                                <button key={clip} type="button" className="btn btn-outline-secondary btn-sm me-2" onClick={() => playPreview(clip)}>
+                                    Play {clip}
+                                </button>
+                            ))}
+                            <button type="button" className="btn btn-link btn-sm" onClick={() => setUseOriginal(true)}>Original quality</button>
+                            <audio ref={previewRef} />
+                        </div>
+                    )}
+                    <Waveform peaksUrl={peaksUrl} audioRef={audioRef} />
+                    {/* Only the metadata is fetched up front; the server answers Range requests as it plays or seeks */}
+                    <audio
+                        ref={audioRef}
+                        controls
+                        preload="metadata"
+                        src={useOriginal ? audioUrl : previewUrl(selectedMass, 'speech')}
+                        onPlay={() => previewRef.current?.pause()}
+                        onError={() => setUseOriginal(true)}
+                        className="w-100 mb-3"
+                    >
                         Your browser does not support the audio element.
                     </audio>
                     
@@ -168,6 +275,7 @@ function App() {
             <div className="row">
                 <div className="col-md-5">
                     <h2>Masses to Annotate</h2>
+                    {renderFilters()}
                     {renderMassList()}
                 </div>
                 <div className="col-md-7">
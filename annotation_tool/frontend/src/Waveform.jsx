@@ -0,0 +1,78 @@
+import { useState, useEffect, useRef } from 'react';
+import axios from 'axios';
+
+const HEIGHT = 80;
+
+// Draws the waveform peaks the pipeline computed for a homily (see pipeline/audio.py's
+// waveform_peaks), with the playhead of `audioRef`. Clicking it seeks there, so annotators can
+// jump around a homily before its audio has loaded.
+function Waveform({ peaksUrl, audioRef }) {
+    const canvasRef = useRef(null);
+    const [peaks, setPeaks] = useState(null);
+    const [currentTime, setCurrentTime] = useState(0);
+
+    useEffect(() => {
+        let cancelled = false;
+        setPeaks(null);
+        axios.get(peaksUrl)
+            .then(response => { if (!cancelled) setPeaks(response.data); })
+            .catch(() => { /* Homilies extracted before peaks existed have none; the audio controls still work */ });
+        return () => { cancelled = true; };
+    }, [peaksUrl]);
+
+    useEffect(() => {
+        const audio = audioRef.current;
+        if (!audio) return;
+        const update = () => setCurrentTime(audio.currentTime);
+        audio.addEventListener('timeupdate', update);
+        audio.addEventListener('seeked', update);
+        return () => {
+            audio.removeEventListener('timeupdate', update);
+            audio.removeEventListener('seeked', update);
+        };
+    }, [audioRef, peaksUrl]);
+
+    useEffect(() => {
+        const canvas = canvasRef.current;
+        if (!canvas || !peaks) return;
+        const width = canvas.clientWidth;
+        canvas.width = width * window.devicePixelRatio;
+        canvas.height = HEIGHT * window.devicePixelRatio;
+        const context = canvas.getContext('2d');
+        context.scale(window.devicePixelRatio, window.devicePixelRatio);
+        context.clearRect(0, 0, width, HEIGHT);
+
+        // Each pixel column shows the loudest window it covers
+        const windows = peaks.peaks.length;
+        const played = peaks.duration ? currentTime / peaks.duration * width : 0;
+        for (let x = 0; x < width; x++) {
+            const first = Math.floor(x / width * windows);
+            const last = Math.max(first + 1, Math.floor((x + 1) / width * windows));
+            let peak = 0;
+            let rms = 0;
+            for (let i = first; i < last && i < windows; i++) {
+                peak = Math.max(peak, peaks.peaks[i]);
+                rms = Math.max(rms, peaks.rms[i]);
+            }
+            const peakHeight = peak / 255 * HEIGHT;
+            const rmsHeight = rms / 255 * HEIGHT;
+            context.fillStyle = x < played ? '#9ec5fe' : '#ced4da';
+            context.fillRect(x, (HEIGHT - peakHeight) / 2, 1, peakHeight);
+            context.fillStyle = x < played ? '#0d6efd' : '#6c757d';
+            context.fillRect(x, (HEIGHT - rmsHeight) / 2, 1, rmsHeight);
+        }
+    }, [peaks, currentTime]);
+
+    const handleClick = (e) => {
+        const audio = audioRef.current;
+        if (!audio || !peaks) return;
+        const bounds = e.currentTarget.getBoundingClientRect();
+        audio.currentTime = (e.clientX - bounds.left) / bounds.width * peaks.duration;
+        audio.play();
+    };
+
+    if (!peaks) return null;
+    return <canvas ref={canvasRef} className="waveform w-100 mb-2" style={{ height: HEIGHT }} onClick={handleClick} />;
+}
+
+export default Waveform;
@@ -8,25 +8,15 @@ from sklearn.decomposition import PCA
 from sklearn.cluster import KMeans
 from sklearn.cluster import DBSCAN
 from sklearn.neighbors import NearestNeighbors
+from feature_store import FeatureStore
+from fingerprint import FINGERPRINT_VERSION, FINGERPRINT_SAMPLE_RATE, frame_features
+from mass_database import get_database
 
 # Assuming extract_features and analyze_features are defined as before
 def extract_features(audio_path):
-    y, sr = librosa.load(audio_path, sr=None)
-
-    # MFCCs
-    mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-
-    # Chroma Features
-    chroma = librosa.feature.chroma_stft(y=y, sr=sr)
-
-    # Mel Spectrogram
-    mel_spectrogram = librosa.feature.melspectrogram(y=y, sr=sr)
-
-    return {
-        "mfccs": mfccs,
-        "chroma": chroma,
-        "mel_spectrogram": mel_spectrogram
-    }
+    # The per-frame MFCCs, deltas, chroma and log-mel spectrogram, all from one STFT
+    y, sr = librosa.load(audio_path, sr=FINGERPRINT_SAMPLE_RATE)
+    return frame_features(y, sr)
 
 def analyze_features(features_dict):
     analysis_results = {}
@@ -40,78 +30,37 @@ def analyze_features(features_dict):
         }
     return analysis_results
 
-def get_aggregated_features(s3_downloads_dir):
-    homily_mp3_files = []
-    for root, _, files in os.walk(s3_downloads_dir):
-        for file in files:
-            if file.endswith('_homily.mp3'):
-                homily_mp3_files.append(os.path.join(root, file))
-
-    all_mfccs = []
-    all_chroma = []
-    all_mel_spectrograms = []
-    labels = []
+def get_aggregated_features(s3_downloads_dir, workers=None, database=None):
+    # The homilies and their priests are read from the catalog rather than found by walking the archive
+    if database is None:
+        database = get_database()
+    masses = database.masses(with_homily=True, under=s3_downloads_dir)
+    homily_mp3_files = [mass["homily_audio"] for mass in masses if os.path.exists(mass["homily_audio"])]
 
     if not homily_mp3_files:
-        print("No _homily.mp3 files found in the s3_downloads directory.")
-        return np.array([]), np.array([]), np.array([]), np.array([])
-
-    print(f"Found {len(homily_mp3_files)} _homily.mp3 files. Extracting and aggregating features...")
-    for i, audio_file in enumerate(homily_mp3_files):
-        try:
-            features = extract_features(audio_file)
-            # Take the mean across the time axis to get a single vector per audio file
-            all_mfccs.append(np.mean(features["mfccs"], axis=1))
-            all_chroma.append(np.mean(features["chroma"], axis=1))
-            all_mel_spectrograms.append(np.mean(features["mel_spectrogram"], axis=1))
-
-            # Read label from _priest_label.txt file
-            base_name = os.path.splitext(audio_file)[0]
-            label_file_path = f"{base_name}_priest_label.txt"
-            if os.path.exists(label_file_path):
-                with open(label_file_path, 'r') as f:
-                    label = f.read().strip()
-                    labels.append(label)
-            else:
-                # Fallback to path-based label if _priest_label.txt doesn't exist
-                path_parts = audio_file.split(os.sep)
-                if len(path_parts) >= 5:
-                    labels.append(path_parts[-2])
-                else:
-                    labels.append('unknown')
+        print("No extracted homilies found in the catalog under the s3_downloads directory.")
+        return {}, np.array([])
+
+    # Label by priest (annotated, else predicted), falling back to the location (e.g., GoH or SB)
+    labels_by_file = {mass["homily_audio"]: mass["priest"] or mass["location"] or 'unknown' for mass in masses}
 
-        except Exception as e:
-            print(f"Error processing {audio_file}: {e}")
+    print(f"Found {len(homily_mp3_files)} extracted homilies. Extracting and aggregating features...")
+    # Features are only extracted for files that are new or changed since the last run
+    homily_mp3_files, features = FeatureStore().get_features(homily_mp3_files, workers=workers)
+    labels = [labels_by_file[audio_file] for audio_file in homily_mp3_files]
 
-    # Ensure all feature lists are converted to numpy arrays
-    return np.array(all_mfccs), np.array(all_chroma), np.array(all_mel_spectrograms), np.array(labels)
+    return features, np.array(labels)
 
-def load_fingerprints(data_dir):
+def load_fingerprints(data_dir, database=None):
+    if database is None:
+        database = get_database()
     fingerprints = []
     labels = []
-    for root, _, files in os.walk(data_dir):
-        for file in files:
-            if file.endswith("_fingerprint.json"):
-                filepath = os.path.join(root, file)
-                with open(filepath, 'r') as f:
-                    try:
-                        fingerprint = json.load(f)
-                        # Ensure fingerprint is a list/array of numbers
-                        if isinstance(fingerprint, list) and all(isinstance(x, (int, float)) for x in fingerprint):
-                            fingerprints.append(fingerprint)
-                            # Extract speaker label from the path (e.g., GoH or SB)
-                            path_parts = filepath.split(os.sep)
-                            # Assuming the structure is s3_downloads/YEAR/MONTH/DAY/SPEAKER/file.json
-                            if len(path_parts) >= 5:
-                                labels.append(path_parts[-2])
-                            else:
-                                labels.append('unknown') # Fallback label
-                        else:
-                            print(f"Skipping invalid fingerprint data in {filepath}")
-                    except json.JSONDecodeError as e:
-                        print(f"Error decoding JSON from {filepath}: {e}")
-                    except Exception as e:
-                        print(f"An unexpected error occurred with {filepath}: {e}")
+    # Only fingerprints of the current version can be compared with each other
+    for mass, fingerprint in database.fingerprints(FINGERPRINT_VERSION, under=data_dir):
+        fingerprints.append(fingerprint)
+        # Label by location (e.g., GoH or SB)
+        labels.append(mass["location"] or 'unknown')
     return np.array(fingerprints), np.array(labels)
 
 def plot_tsne(data, labels, output_file, title_prefix=""):
@@ -189,12 +138,13 @@ if __name__ == '__main__':
     # fingerprints, labels = load_fingerprints(data_dir)
 
     # Get new features from homily.mp3 files
-    mfccs, chroma, mel_spectrograms, labels = get_aggregated_features(data_dir)
+    features, labels = get_aggregated_features(data_dir)
 
     feature_sets = {
-        "MFCCs": mfccs,
-        "Chroma": chroma,
-        "Mel_Spectrograms": mel_spectrograms
+        "Fingerprint": features.get("fingerprint", []),
+        "MFCCs": features.get("mfccs", []),
+        "Chroma": features.get("chroma", []),
+        "Mel_Spectrograms": features.get("mel_spectrogram", [])
     }
 
     for name, features_data in feature_sets.items():
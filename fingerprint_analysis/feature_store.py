@@ -0,0 +1,163 @@
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline"))
+from fingerprint import FINGERPRINT_VERSION, stream_voice_fingerprint, fingerprint_components
+
+FEATURE_STORE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "features.npz")
+
+# Bump the version whenever extract_pooled_features changes in a way that changes its output
+FEATURE_PARAMS = {
+    "version": 3,
+    "fingerprint_version": FINGERPRINT_VERSION
+}
+FEATURE_NAMES = ["fingerprint", "mfccs", "chroma", "mel_spectrogram"]
+
+
+def hash_file(path, block_size=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def extract_pooled_features(audio_path):
+    """
+    Streams an audio file and returns its voice fingerprint, the same one the pipeline stores,
+    along with the MFCC, chroma and log-mel means it contains.
+    """
+    result = stream_voice_fingerprint(audio_path)
+    if result is None:
+        raise ValueError("Could not compute a voice fingerprint")
+    fingerprint = result.fingerprint
+    components = fingerprint_components(fingerprint)
+    return {
+        "fingerprint": fingerprint,
+        "mfccs": components["mfcc_mean"],
+        "chroma": components["chroma_mean"],
+        "mel_spectrogram": components["log_mel_mean"]
+    }
+
+
+def _extract(audio_path):
+    # Runs in a worker process; errors are returned so one bad file does not stop the others
+    try:
+        return extract_pooled_features(audio_path), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+class FeatureStore:
+    """
+    Pooled features of every homily ever extracted, saved in a single .npz file.
+
+    Rows are keyed by a hash of the audio file's contents, so a file is only decoded again
+    when it changes. Files whose size and modification time have not changed are not even
+    re-hashed. The whole store is dropped when FEATURE_PARAMS changes.
+    """
+
+    def __init__(self, path=FEATURE_STORE_FILE, params=FEATURE_PARAMS):
+        self.path = path
+        self.params = params
+        self.rows = {}
+        self.features = {name: [] for name in FEATURE_NAMES}
+        self.file_hashes = {}
+
+        if os.path.exists(path):
+            data = np.load(path)
+            if json.loads(str(data["params"])) == params:
+                for i, key in enumerate(data["keys"]):
+                    self.rows[str(key)] = i
+                for name in FEATURE_NAMES:
+                    self.features[name] = list(data[name])
+                for file_path, size, mtime, key in zip(data["file_paths"], data["file_sizes"], data["file_mtimes"], data["file_keys"]):
+                    self.file_hashes[str(file_path)] = (int(size), int(mtime), str(key))
+            else:
+                print(f"Feature parameters changed, ignoring {path}")
+
+    def key(self, audio_path):
+        stat = os.stat(audio_path)
+        cached = self.file_hashes.get(audio_path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+        key = hash_file(audio_path)
+        self.file_hashes[audio_path] = (stat.st_size, stat.st_mtime_ns, key)
+        return key
+
+    def add(self, key, features):
+        self.rows[key] = len(self.rows)
+        for name in FEATURE_NAMES:
+            self.features[name].append(features[name])
+
+    def prune(self):
+        """
+        Forgets files that no longer exist, and the features of contents no file has any more.
+        """
+        self.file_hashes = {p: entry for p, entry in self.file_hashes.items() if os.path.exists(p)}
+        keep = {entry[2] for entry in self.file_hashes.values()}
+        old_rows = self.rows
+        self.rows = {}
+        features = self.features
+        self.features = {name: [] for name in FEATURE_NAMES}
+        for key, row in old_rows.items():
+            if key in keep:
+                self.add(key, {name: features[name][row] for name in FEATURE_NAMES})
+
+    def save(self):
+        self.prune()
+        file_paths = list(self.file_hashes)
+        # np.savez adds .npz to names without it, so the temporary file keeps the extension
+        temp_path = f"{self.path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            temp_path,
+            params=json.dumps(self.params),
+            keys=np.array(list(self.rows), dtype=str),
+            file_paths=np.array(file_paths, dtype=str),
+            file_sizes=np.array([self.file_hashes[p][0] for p in file_paths], dtype=np.int64),
+            file_mtimes=np.array([self.file_hashes[p][1] for p in file_paths], dtype=np.int64),
+            file_keys=np.array([self.file_hashes[p][2] for p in file_paths], dtype=str),
+            **{name: np.array(self.features[name]) for name in FEATURE_NAMES}
+        )
+        os.replace(temp_path, self.path)
+
+    def get_features(self, audio_paths, workers=None):
+        """
+        Returns the pooled features of `audio_paths`, extracting only files that are not in the store yet.
+        New files are extracted in a pool of `workers` processes, and the store is saved afterwards.
+
+        Returns:
+            tuple: (paths, features), where `paths` are the files that could be read, in the
+                   order given, and `features` maps each feature name to an array with one row per path.
+        """
+        keys = {audio_path: self.key(audio_path) for audio_path in audio_paths}
+        missing = {}
+        for audio_path, key in keys.items():
+            if key not in self.rows:
+                missing.setdefault(key, audio_path)
+
+        if missing:
+            print(f"Extracting features from {len(missing)} new or changed files ({len(keys) - len(missing)} cached)...")
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(_extract, audio_path): key for key, audio_path in missing.items()}
+                for done_count, future in enumerate(as_completed(futures), start=1):
+                    key = futures[future]
+                    features, error = future.result()
+                    if error:
+                        print(f"Error processing {missing[key]}: {error}")
+                    else:
+                        self.add(key, features)
+                    if done_count % 50 == 0:
+                        print(f"    {done_count}/{len(missing)}")
+        self.save()
+
+        paths = [audio_path for audio_path in audio_paths if keys[audio_path] in self.rows]
+        rows = [self.rows[keys[audio_path]] for audio_path in paths]
+        return paths, {name: np.array([self.features[name][row] for row in rows]) for name in FEATURE_NAMES}
@@ -1,143 +1,177 @@
 import json
-import time
-from langchain_aws import ChatBedrock
-from langchain_ollama import ChatOllama
-from langchain_core.prompts import PromptTemplate
-from langchain.agents import AgentExecutor, create_react_agent
-from langchain.tools import tool
+import asyncio
+from analyze_transcription_deterministic import KEYWORDS_FILE
+from analyze_transcription_one_shot import parse_json_response
+from llm_engine import LLMEngine, get_chat_client
+from transcript_compaction import compact_chunks, format_chunks
+
+# The parts of the Mass, in order, as named in `detected_parts`
+MASS_PARTS = [
+    "beginning_of_the_mass", "gloria", "first_reading", "gospel", "homily",
+    "prayers_of_the_faithful", "start_of_the_eucharistic_prayer",
+    "distribution_of_communion", "end_of_mass"
+]
+# Keys of mass_keywords.json for the parts named differently there
+KEYWORD_PARTS = {
+    "beginning_of_the_mass": "beginning_of_mass",
+    "start_of_the_eucharistic_prayer": "eucharistic_prayer",
+}
+
+# Windows are long enough to hold several parts, and overlap so that a part starting near the
+# end of one window is seen with its context in the next
+WINDOW_SECONDS = 900.0
+OVERLAP_SECONDS = 120.0
+# Candidates for the same part less than this many seconds apart are the same boundary
+SAME_CANDIDATE_SECONDS = 30.0
+
+USER_TEMPLATE = "The transcript excerpt is as follows:\n{transcript}"
+
+
+def build_system_prompt(keywords_file=KEYWORDS_FILE):
+    with open(keywords_file, "r") as f:
+        mass_keywords = json.load(f)
+    keywords = {part_name: mass_keywords.get(KEYWORD_PARTS.get(part_name, part_name), []) for part_name in MASS_PARTS}
 
-def analyze_transcription(
-    transcription_data, 
-    service: str = 'bedrock',
-    model: str = None
-):
+    return f"""You are an AI assistant specialized in analyzing transcripts of Catholic Masses. You are given an excerpt of a transcript, which may start and end in the middle of the Mass.
+
+Find where any of the following parts of the Mass start within the excerpt: the beginning of the Mass, the Gloria, the first reading, the Gospel, the homily, the prayers of the faithful, the start of the Eucharistic prayer, distribution of communion, and the end of Mass. Only report parts whose start is inside the excerpt.
+
+Each line of the excerpt starts with its start time in seconds, in square brackets. Reply with a JSON object mapping part names to an object with the "time" in seconds of the line where the part starts and your "confidence" between 0 and 1, for example {{"gospel": {{"time": 812, "confidence": 0.9}}}}. The valid part names are:
+{", ".join(f'"{part_name}"' for part_name in MASS_PARTS)}
+
+Note: The transcript often mistakes periods of silence for the phrase "Thank you". Please ignore instances of "Thank you" in the transcript when analyzing the parts of the Mass.
+
+Here are some keywords that can help you identify the parts of the Mass:
+{json.dumps(keywords, indent=2)}"""
+
+
+def split_windows(chunks, window_seconds=WINDOW_SECONDS, overlap_seconds=OVERLAP_SECONDS):
     """
-    Analyzes a transcription of a Catholic Mass using an agent with tools to identify key parts.
+    Splits segments into windows of `window_seconds`, each starting `overlap_seconds` before the previous one ends.
 
-    The agent gradually views the transcript and records the parts of the Mass it identifies.
+    Returns:
+        list: (start, end, segments) tuples.
     """
-    chunks = transcription_data.get("chunks", [])
     if not chunks:
-        return "", {}
+        return []
+    step = window_seconds - overlap_seconds
+    first = chunks[0]["timestamp"][0]
+    last = chunks[-1]["timestamp"][0]
+    windows = []
+    start = first
+    while True:
+        end = start + window_seconds
+        segments = [segment for segment in chunks if start <= segment["timestamp"][0] < end]
+        if segments:
+            windows.append((start, end, segments))
+        if end > last:
+            return windows
+        start += step
+
+
+def parse_candidates(response, start, end):
+    """
+    Returns the (part_name, time, confidence) candidates in a window's reply that name a
+    valid part and fall inside the window.
+    """
+    candidates = []
+    for part_name, candidate in response.items():
+        if part_name not in MASS_PARTS:
+            continue
+        if not isinstance(candidate, dict):
+            candidate = {"time": candidate}
+        try:
+            time = float(candidate.get("time"))
+            confidence = float(candidate.get("confidence", 0.5))
+        except (TypeError, ValueError):
+            continue
+        if start <= time < end:
+            candidates.append((part_name, time, min(max(confidence, 0.0), 1.0)))
+    return candidates
 
-    detected_parts = {}
-    current_index = 0
-    chunk_size = 5
-
-    @tool
-    def view_next_part() -> str:
-        """
-        Views a portion of the transcript from a start index to an end index.
-        The transcript is a list of chunks. It is better to view in smaller chunks (e.g. 10-20 at a time).
-        """
-        nonlocal current_index
-        end_index = min(current_index + chunk_size, len(chunks))
-        start_index = current_index
-        transcript_part = ""
-        for i in range(start_index, end_index):
-            segment = chunks[i]
-            transcript_part += f'[{segment.get("timestamp", "")}] {segment.get("text", "")}\n'
-        if end_index >= len(chunks):
-            transcript_part += "End of transcript reached."
-        current_index = end_index
-        return transcript_part
-
-    @tool
-    def view_previous_part() -> str:
-        """
-        Views the previous portion of the transcript.
-        """
-        nonlocal current_index
-        current_index = max(0, current_index - chunk_size)
-        return view_next_part()
-
-    @tool
-    def record_mass_part(part_name: str, timestamp: str):
-        """Records a part of the Mass with its timestamp. Overwrites if part_name already exists."""
-        valid_parts = [
-            "beginning_of_the_mass", "gloria", "first_reading", "gospel", "homily", 
-            "prayers_of_the_faithful", "start_of_the_eucharistic_prayer", 
-            "distribution_of_communion", "end_of_mass"
-        ]
-        if part_name not in valid_parts:
-            return f"Error: Invalid part_name. Must be one of {valid_parts}"
-        
-        detected_parts[part_name] = timestamp
-        return f"Success: Recorded {part_name} at {timestamp}."
-
-    tools = [view_next_part, view_previous_part, record_mass_part]
-
-    with open("mass_keywords.json", "r") as f:
-        mass_keywords = json.load(f)
 
-    template = f"""You are an AI assistant specialized in analyzing transcripts of Catholic Masses.
+def merge_candidates(candidates):
+    """
+    Picks one start time per part from the candidates of every window.
 
-TOOLS:
-{{tools}}
+    Candidates for the same part close together (the same boundary seen from two overlapping
+    windows) are merged, keeping the most confident. Then the parts are chosen so that they
+    come in the order of the Mass with the highest total confidence: a confident Gospel is not
+    thrown out because a window mistook a reading for it earlier on.
 
-To use a tool, please use the following format:
+    Returns:
+        dict: Each part found mapped to its start time.
+    """
+    merged = []
+    for part_name, time, confidence in sorted(candidates, key=lambda c: (MASS_PARTS.index(c[0]), c[1])):
+        if merged and merged[-1][0] == part_name and time - merged[-1][1] < SAME_CANDIDATE_SECONDS:
+            if confidence > merged[-1][2]:
+                merged[-1] = (part_name, time, confidence)
+            continue
+        merged.append((part_name, time, confidence))
+
+    # best[i]: the highest total confidence of an ordered chain of parts ending with candidate i
+    best = []
+    previous = []
+    for i, (part_name, time, confidence) in enumerate(merged):
+        order = MASS_PARTS.index(part_name)
+        best.append(confidence)
+        previous.append(None)
+        for j in range(i):
+            if MASS_PARTS.index(merged[j][0]) < order and merged[j][1] < time and best[j] + confidence > best[i]:
+                best[i] = best[j] + confidence
+                previous[i] = j
 
-```
-Thought: Do I need to use a tool? Yes
-Action: the action to take, should be one of [{{tool_names}}]
-Action Input: the input to the action
-Observation: the result of the action
-```
+    detected_parts = {}
+    i = max(range(len(merged)), key=lambda k: best[k], default=None)
+    while i is not None:
+        detected_parts[merged[i][0]] = merged[i][1]
+        i = previous[i]
+    return {part_name: detected_parts[part_name] for part_name in MASS_PARTS if part_name in detected_parts}
 
-Your task is to identify the following parts of the Mass from the provided transcript: the beginning of the Mass, the Gloria, the first reading, the Gospel, the homily, the prayers of the faithful, the start of the Eucharistic prayer, distribution of communion, and the end of Mass. For each identified part, provide the approximate start time based on the transcript segments.
 
-Here are the valid `part_name` values for `record_mass_part`:
-"beginning_of_the_mass", "gloria", "first_reading", "gospel", "homily", "prayers_of_the_faithful", "start_of_the_eucharistic_prayer", "distribution_of_communion", "end_of_mass"
+async def analyze_transcription_async(transcription_data, engine, window_seconds=WINDOW_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    """
+    Analyzes a transcription of a Catholic Mass in large overlapping windows, all sent to the
+    model at once, and merges the candidate boundaries they return (see `merge_candidates`).
+    """
+    chunks = compact_chunks(transcription_data.get("chunks", []))
+    windows = split_windows(chunks, window_seconds, overlap_seconds)
+    if not windows:
+        return {}
+
+    system_prompt = build_system_prompt()
+    responses = await asyncio.gather(
+        *(engine.complete(system_prompt, format_chunks(segments), USER_TEMPLATE) for _, _, segments in windows),
+        return_exceptions=True
+    )
+
+    candidates = []
+    for (start, end, _), response in zip(windows, responses):
+        if isinstance(response, Exception):
+            print(f"Could not analyze the window from {start:.0f}s to {end:.0f}s: {response}")
+            continue
+        try:
+            candidates.extend(parse_candidates(parse_json_response(response), start, end))
+        except json.JSONDecodeError:
+            continue
+    return merge_candidates(candidates)
 
-Note: The transcript often mistakes periods of silence for the phrase "Thank you". Please ignore instances of "Thank you" in the transcript when analyzing the parts of the Mass.
 
-Here are some keywords that can help you identify the parts of the Mass:
-{{{json.dumps(mass_keywords, indent=2)}}}
-
-Your workflow should be:
-1. Use the `view_next_part` tool to navigate through the transcript chunk by chunk.
-2. If you need to revisit a previous section, you can use the `view_previous_part` tool.
-3. When you identify a part of the Mass, use `record_mass_part` with the correct `part_name` and the timestamp from the transcript. The timestamp is the first element in each line, e.g., `[('0.0', '2.5')]`.
-4. Continue this process until you have analyzed the entire transcript. The `view_next_part` tool will indicate when you have reached the end.
-5. Once you have viewed the whole transcript and recorded all identifiable parts, you are done. The final result is the accumulated JSON object of recorded parts.
-
-Begin!
-
-Input: {{input}}
-Agent Scratchpad: {{agent_scratchpad}}
-"""
-
-    prompt = PromptTemplate.from_template(template)
-
-    if service == 'bedrock':
-        model_id = model or "anthropic.claude-3-sonnet-20240229-v1:0"
-        llm = ChatBedrock(model_id=model_id, model_kwargs={ "temperature": 0.0 })
-    elif service == 'ollama':
-        model_id = model or "gemma3:12b"
-        llm = ChatOllama(model=model_id, temperature=0.0)
-    else:
-        raise ValueError(f"Unsupported service: {service}")
-
-    agent = create_react_agent(llm, tools, prompt)
-    agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True, handle_parsing_errors=True)
-
-    retries = 0
-    max_retries = 7
-    while retries < max_retries:
-        try:
-            agent_executor.invoke({"input": "Analyze the transcript to find the parts of the Mass."})
-            break
-        except Exception as e:
-            if "throttling" in str(e).lower() and retries < max_retries - 1:
-                retries += 1
-                print(f"Throttled {retries} times. Retrying in {2 ** retries} seconds...")
-                time.sleep(2 ** retries)
-                continue
-            print(f"An error occurred during agent execution: {e}")
-            break 
-
-    full_text = ""
-    for segment in transcription_data["chunks"]:
-        full_text += str(segment.get("timestamp", "")) + " " + segment.get("text", "") + " "
-
-    return detected_parts
\ No newline at end of file
+def analyze_transcription(
+    transcription_data,
+    service: str = 'bedrock',
+    model: str = None,
+    engine: LLMEngine = None
+):
+    """
+    Analyzes a transcription of a Catholic Mass with an LLM to identify key parts.
+
+    The transcript is split into windows of WINDOW_SECONDS which are analyzed in parallel,
+    independent calls, instead of walking through it a few segments at a time.
+
+    Returns:
+        dict: The detected parts of the Mass and their start times in seconds.
+    """
+    engine = engine or LLMEngine(get_chat_client(service, model, temperature=0.0, json_format=True))
+    return asyncio.run(analyze_transcription_async(transcription_data, engine))
@@ -1,11 +1,105 @@
+import os
 import json
 import sys
+from bisect import bisect_right
+from keyword_matcher import KeywordAutomaton, normalize_text
+from transcript_store import TRANSCRIPT_SUFFIX, load_transcript
 
-def analyze_transcription(transcription_data):
+KEYWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mass_keywords.json")
+
+MASS_PARTS_ORDERED = [
+    "beginning_of_mass",
+    "gloria",
+    "first_reading",
+    "gospel",
+    "homily",
+    "creed",
+    "prayers_of_the_faithful",
+    "eucharistic_prayer",
+    "distribution_of_communion",
+    "end_of_mass"
+]
+
+_automaton_cache = {}
+
+
+def load_keyword_automaton(keywords_file=KEYWORDS_FILE):
+    """
+    Returns the keyword automaton for a keywords file, rebuilding it only when the file changes.
+    """
+    cache_key = (keywords_file, os.stat(keywords_file).st_mtime_ns)
+    automaton = _automaton_cache.get(cache_key)
+    if automaton is None:
+        with open(keywords_file, "r") as f:
+            mass_keywords = json.load(f)
+        automaton = KeywordAutomaton(
+            (keyword, part_name)
+            for part_name in MASS_PARTS_ORDERED
+            for keyword in mass_keywords.get(part_name, [])
+        )
+        _automaton_cache.clear()
+        _automaton_cache[cache_key] = automaton
+    return automaton
+
+
+def find_keywords(chunks, keywords_file=KEYWORDS_FILE):
+    """
+    Matches every keyword against a transcript in a single pass.
+
+    The normalized segment texts are joined into one stream, separated by spaces, so keywords
+    split across two segments are found too.
+
+    Returns:
+        tuple: (stream, offsets, matches), where `offsets` holds the position in `stream` where
+               each segment starts and `matches` the (start, end, part_name) of every match.
+    """
+    automaton = load_keyword_automaton(keywords_file)
+    texts = [normalize_text(segment.get("text", "")) for segment in chunks]
+    offsets = []
+    offset = 0
+    for text in texts:
+        offsets.append(offset)
+        offset += len(text) + 1
+    stream = " ".join(texts)
+    return stream, offsets, list(automaton.find(stream))
+
+
+def find_keyword_segments(chunks, keywords_file=KEYWORDS_FILE):
+    """
+    Finds the segments whose text (together with the previous segment's text as context)
+    contains a keyword of each part of the Mass.
+
+    Args:
+        chunks (list): The transcript segments, each a dictionary with "timestamp" and "text".
+
+    Returns:
+        dict: Each part of the Mass mapped to the sorted indices of the segments that match it.
+    """
+    _, offsets, keyword_matches = find_keywords(chunks, keywords_file)
+
+    # Segment ii is searched with the previous segment as context, so a match is found in
+    # segment ii if it ends in segment ii and starts in segment ii or ii - 1
+    matches = {part_name: [] for part_name in MASS_PARTS_ORDERED}
+    for start, end, part_name in keyword_matches:
+        first_segment = bisect_right(offsets, start) - 1
+        last_segment = bisect_right(offsets, end - 1) - 1
+        if last_segment == first_segment:
+            matches[part_name].append(last_segment)
+            if last_segment + 1 < len(chunks):
+                matches[part_name].append(last_segment + 1)
+        elif last_segment == first_segment + 1:
+            matches[part_name].append(last_segment)
+    return {part_name: sorted(set(segments)) for part_name, segments in matches.items()}
+
+
+def analyze_transcription(transcription_data, keywords_file=KEYWORDS_FILE):
     """
     Analyzes a transcription of a Catholic Mass to identify different parts of the Mass
     using a deterministic algorithm based on keywords.
 
+    Each part starts at the first segment, after the start of the last detected part, whose text
+    (together with the previous segment's text as context) contains one of the part's keywords.
+
     Args:
         transcription_data (dict): A dictionary containing the transcription, with a key
                                    "chunks" that holds a list of segments. Each segment
@@ -14,35 +108,17 @@ def analyze_transcription(transcription_data):
     Returns:
         dict: A dictionary where keys are the parts of the Mass and values are the start times.
     """
-    with open("mass_keywords.json", "r") as f:
-        mass_keywords = json.load(f)
-
-    mass_parts_ordered = [
-        "beginning_of_mass",
-        "gloria",
-        "first_reading",
-        "gospel",
-        "homily",
-        "creed",
-        "prayers_of_the_faithful",
-        "eucharistic_prayer",
-        "distribution_of_communion",
-        "end_of_mass"
-    ]
+    chunks = transcription_data["chunks"]
+    matches = find_keyword_segments(chunks, keywords_file)
 
     detected_parts = {}
     last_timestamp = -1
 
-    for part_name in mass_parts_ordered:
-        keywords = mass_keywords.get(part_name, [])
-        
-        found_part = False
-        for ii in range(len(transcription_data["chunks"])):
-            segment = transcription_data["chunks"][ii]
-
+    for part_name in MASS_PARTS_ORDERED:
+        for ii in matches[part_name]:
             # The timestamp is a list [start, end]
-            timestamp_start = segment.get("timestamp", [0, None])[0]
-            
+            timestamp_start = chunks[ii].get("timestamp", [0, None])[0]
+
             if timestamp_start is None:
                 continue
 
@@ -50,35 +126,23 @@ def analyze_transcription(transcription_data):
             if timestamp_start <= last_timestamp:
                 continue
 
-            text = segment.get("text", "").lower()
-
-            # Add context to current segment
-            if ii > 0:
-                prior_text = transcription_data["chunks"][ii - 1].get("text", "").lower()
-                text = prior_text + " " + text
-
-            # Replace all >1 spaces with one space
-            text = " ".join(text.split())
-            
-            for keyword in keywords:
-                if keyword.lower() in text:
-                    detected_parts[part_name] = timestamp_start
-                    last_timestamp = timestamp_start
-                    found_part = True
-                    break
-            if found_part:
-                break
+            detected_parts[part_name] = timestamp_start
+            last_timestamp = timestamp_start
+            break
 
     return detected_parts
 
 if __name__ == '__main__':
     if len(sys.argv) > 1:
         transcription_file = sys.argv[1]
-        with open(transcription_file, 'r') as f:
-            # The transcription from whisperx is a json file with a 'chunks' key
-            data = json.load(f)
-        
-        analysis = analyze_transcription_deterministic(data)
+        if transcription_file.endswith(TRANSCRIPT_SUFFIX):
+            data = load_transcript(transcription_file)
+        else:
+            with open(transcription_file, 'r') as f:
+                # The transcription from whisperx is a json file with a 'chunks' key
+                data = json.load(f)
+
+        analysis = analyze_transcription(data)
         print(json.dumps(analysis, indent=2))
     else:
-        print("Usage: python analyze_transcription_deterministic.py <path_to_transcription.json>")
+        print(f"Usage: python analyze_transcription_deterministic.py <path_to_transcription.json or _transcription{TRANSCRIPT_SUFFIX}>")
@@ -0,0 +1,197 @@
+import json
+import asyncio
+from analyze_transcription_deterministic import KEYWORDS_FILE, MASS_PARTS_ORDERED, analyze_transcription as analyze_deterministic
+from analyze_transcription_one_shot import parse_json_response
+from transcript_compaction import prepare_transcript
+
+# Bump the version whenever the checks or the prompt change in a way that changes the output
+HYBRID_VERSION = 1
+
+# Parts that are not said at every Mass (weekday Masses have neither)
+OPTIONAL_PARTS = {"gloria", "creed"}
+
+# Plausible (min, max) seconds between the starts of two parts that follow each other,
+# a wide margin around what the keyword analyzer finds in most of the archive
+PART_GAPS = {
+    ("beginning_of_mass", "gloria"): (15, 420),
+    ("beginning_of_mass", "first_reading"): (30, 480),
+    ("gloria", "first_reading"): (30, 360),
+    ("first_reading", "gospel"): (45, 720),
+    ("gospel", "homily"): (15, 300),
+    ("homily", "creed"): (90, 1800),
+    ("homily", "prayers_of_the_faithful"): (90, 1800),
+    ("creed", "prayers_of_the_faithful"): (30, 240),
+    ("prayers_of_the_faithful", "eucharistic_prayer"): (60, 600),
+    ("eucharistic_prayer", "distribution_of_communion"): (180, 900),
+    ("distribution_of_communion", "end_of_mass"): (120, 1200),
+}
+
+PART_DESCRIPTIONS = {
+    "beginning_of_mass": "the Sign of the Cross and greeting that open the Mass",
+    "gloria": "the Gloria (\"Glory to God in the highest\")",
+    "first_reading": "the first reading, usually announced as \"A reading from the book of ...\"",
+    "gospel": "the Gospel, announced as \"A reading from the holy Gospel according to ...\"",
+    "homily": "the homily, the priest's sermon after the Gospel",
+    "creed": "the Creed (\"I believe in one God\")",
+    "prayers_of_the_faithful": "the prayers of the faithful (universal prayer), with responses like \"Lord, hear our prayer\"",
+    "eucharistic_prayer": "the start of the Eucharistic prayer (\"The Lord be with you ... Lift up your hearts\")",
+    "distribution_of_communion": "the distribution of communion (\"Behold the Lamb of God ... Lord, I am not worthy\")",
+    "end_of_mass": "the final blessing and dismissal (\"Go forth, the Mass is ended\")",
+}
+
+USER_TEMPLATE = "The transcript excerpt is as follows:\n{transcript}"
+
+
+def find_suspect_parts(mass_parts):
+    """
+    Checks the parts found by the keyword analyzer.
+
+    A part is suspect if it is missing (and said at every Mass), if it starts before a part that
+    should come before it, or if the gap between it and the part before it is implausible, in
+    which case both parts are suspect.
+
+    Returns:
+        list: The suspect parts, in the order of the Mass.
+    """
+    suspect = {part_name for part_name in MASS_PARTS_ORDERED if part_name not in mass_parts and part_name not in OPTIONAL_PARTS}
+    present = [part_name for part_name in MASS_PARTS_ORDERED if mass_parts.get(part_name) is not None]
+    for previous, part_name in zip(present, present[1:]):
+        gap = mass_parts[part_name] - mass_parts[previous]
+        low, high = PART_GAPS.get((previous, part_name), (0, float("inf")))
+        if gap <= 0:
+            suspect.add(part_name)
+        elif not low <= gap <= high:
+            suspect.update((previous, part_name))
+    return [part_name for part_name in MASS_PARTS_ORDERED if part_name in suspect]
+
+
+def suspect_windows(mass_parts, suspect, transcript_end):
+    """
+    Groups consecutive suspect parts, each group with the stretch of the transcript it must lie
+    in: from the start of the trusted part before it to the start of the trusted part after it.
+
+    Returns:
+        list: (parts, start, end) tuples.
+    """
+    windows = []
+    start = 0.0
+    group = []
+    for part_name in MASS_PARTS_ORDERED:
+        if part_name in suspect:
+            group.append(part_name)
+        elif mass_parts.get(part_name) is not None:
+            if group:
+                windows.append((group, start, mass_parts[part_name]))
+                group = []
+            start = mass_parts[part_name]
+    if group:
+        windows.append((group, start, transcript_end))
+    return windows
+
+
+def build_system_prompt(part_names, keywords_file=KEYWORDS_FILE):
+    with open(keywords_file, "r") as f:
+        mass_keywords = json.load(f)
+    parts = "\n".join(f"- \"{part_name}\": {PART_DESCRIPTIONS[part_name]}" for part_name in part_names)
+    keywords = {part_name: mass_keywords.get(part_name, []) for part_name in part_names}
+
+    return f"""You are an AI assistant specialized in analyzing transcripts of Catholic Masses. You are given an excerpt of a transcript. Find where each of the following parts of the Mass starts in it:
+{parts}
+
+Each line of the excerpt starts with its start time in seconds, in square brackets. Reply with a JSON object mapping each of the part names above to the start time in seconds of the line where that part begins, or to null if the part is not in the excerpt. The parts always come in the order listed.
+
+Note: The transcript often mistakes periods of silence for the phrase "Thank you". Please ignore instances of "Thank you" in the transcript.
+
+Here are some keywords that can help you identify these parts:
+{json.dumps(keywords, indent=2)}"""
+
+
+async def resolve_window(transcription_data, part_names, start, end, engine):
+    """
+    Asks the model where `part_names` start between `start` and `end`.
+
+    Returns:
+        dict: The answer for each part: a start time within the window, None if the model says
+              the part is not there, and left out if the answer is unusable.
+    """
+    chunks = [
+        segment for segment in transcription_data["chunks"]
+        if segment.get("timestamp", (None,))[0] is not None and start <= segment["timestamp"][0] <= end
+    ]
+    transcript = prepare_transcript({"chunks": chunks})
+    if not transcript:
+        return {}
+    response = parse_json_response(await engine.complete(build_system_prompt(part_names), transcript, USER_TEMPLATE))
+
+    answers = {}
+    last = start
+    for part_name in part_names:
+        if part_name not in response:
+            continue
+        value = response[part_name]
+        if value is None:
+            answers[part_name] = None
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            continue
+        if last <= value <= end:
+            answers[part_name] = value
+            last = value
+    return answers
+
+
+async def analyze_transcription_async(transcription_data, engine, keywords_file=KEYWORDS_FILE):
+    """
+    Analyzes a transcription with the keyword analyzer, and asks an LLM only about the parts
+    that are missing or suspect (see `find_suspect_parts`). Each group of suspect parts is sent
+    with only the stretch of transcript between the trusted parts around it, and the groups are
+    sent concurrently.
+
+    A part the model places inside its window replaces the keyword analyzer's time. A part the
+    model says is not there is dropped. Otherwise the keyword analyzer's time is kept.
+
+    Returns:
+        dict: The parts of the Mass and their start times, in the same format as the keyword analyzer.
+    """
+    mass_parts = analyze_deterministic(transcription_data, keywords_file)
+    suspect = find_suspect_parts(mass_parts)
+    if not suspect:
+        return mass_parts
+
+    chunks = transcription_data["chunks"]
+    transcript_end = max((segment["timestamp"][1] or segment["timestamp"][0] for segment in chunks if segment["timestamp"][0] is not None), default=0.0)
+    windows = suspect_windows(mass_parts, suspect, transcript_end)
+    print(f"Asking the LLM about {', '.join(suspect)}...")
+    results = await asyncio.gather(
+        *(resolve_window(transcription_data, part_names, start, end, engine) for part_names, start, end in windows),
+        return_exceptions=True
+    )
+
+    resolved = dict(mass_parts)
+    for (part_names, _, _), answers in zip(windows, results):
+        if isinstance(answers, Exception):
+            print(f"Could not resolve {', '.join(part_names)}: {answers}")
+            continue
+        for part_name, value in answers.items():
+            if value is None:
+                resolved.pop(part_name, None)
+            else:
+                resolved[part_name] = value
+
+    # A kept keyword time can end up out of order next to the model's answers; drop it then
+    ordered = {}
+    last = -1
+    for part_name in MASS_PARTS_ORDERED:
+        if resolved.get(part_name) is not None and resolved[part_name] > last:
+            ordered[part_name] = resolved[part_name]
+            last = resolved[part_name]
+    return ordered
+
+
+def analyze_transcription(transcription_data, engine, keywords_file=KEYWORDS_FILE):
+    """
+    Blocking version of `analyze_transcription_async`.
+    """
+    return asyncio.run(analyze_transcription_async(transcription_data, engine, keywords_file))
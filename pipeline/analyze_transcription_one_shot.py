@@ -1,71 +1,119 @@
-from langchain_aws.llms import BedrockLLM
-from langchain_aws import ChatBedrock
-from langchain_ollama import ChatOllama
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+import re
+import json
+import asyncio
+from analyze_transcription_deterministic import KEYWORDS_FILE
+from llm_engine import LLMEngine, get_chat_client
+from transcript_compaction import DEFAULT_WINDOW_CHARS, OMITTED_MARKER, estimate_tokens, prepare_transcript
 
-def analyze_transcription(
-    transcription_data, 
-    service: str = 'bedrock',
-    model: str = None
-):
-    full_text = ""
-    for segment in transcription_data["chunks"]:
-        full_text += str(segment.get("timestamp", "")) + " " + segment.get("text", "") + " "
+USER_TEMPLATE = "The transcript is as follows:\n{transcript}"
 
-    with open("mass_keywords.json", "r") as f:
+
+def build_system_prompt(keywords_file=KEYWORDS_FILE):
+    with open(keywords_file, "r") as f:
         mass_keywords = json.load(f)
 
-    system_prompt = f"""You are an AI assistant specialized in analyzing transcripts of Catholic Masses. Your task is to identify the following parts of the Mass from the provided transcript: the beginning of the Mass, the Gloria, the first reading, the Gospel, the homily, the prayers of the faithful, the start of the Eucharistic prayer, distribution of communion, and the end of Mass. For each identified part, provide the approximate start time based on the transcript segments. If a part is not clearly identifiable, do not include it in your output. Please provide the output in a structured JSON format.
+    return f"""You are an AI assistant specialized in analyzing transcripts of Catholic Masses. Your task is to identify the following parts of the Mass from the provided transcript: the beginning of the Mass, the Gloria, the first reading, the Gospel, the homily, the prayers of the faithful, the start of the Eucharistic prayer, distribution of communion, and the end of Mass. For each identified part, provide the approximate start time based on the transcript segments. If a part is not clearly identifiable, do not include it in your output. Please provide the output in a structured JSON format.
+
+Each line of the transcript starts with its start time in seconds, in square brackets. Give the start times in seconds. "{OMITTED_MARKER}" marks text that was left out of the transcript.
 
 Note: The transcript often mistakes periods of silence for the phrase "Thank you". Please ignore instances of "Thank you" in the transcript when analyzing the parts of the Mass.
 
 Here are some keywords that can help you identify the parts of the Mass:
-{"{" + json.dumps(mass_keywords, indent=2) + "}"}"""
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", system_prompt),
-        ("human", "The transcript is as follows:\n{transcript}")
-    ])
-
-    if service == 'bedrock':
-        model_id = model or "anthropic.claude-3-sonnet-20240229-v1:0"
-        llm = ChatBedrock(model_id=model_id)
-    elif service == 'ollama':
-        model_id = model or "gemma3:12b"
-        llm = ChatOllama(model=model_id, format="json")
-    else:
-        raise ValueError(f"Unsupported service: {service}")
-
-    chain = prompt | llm
-
-
-    retries = 0
-    max_retries = 7
-    while retries < max_retries:
-        try:
-            llm_output = chain.invoke({"transcript": full_text.strip()})
-            break
-        except Exception as e:
-            if "throttling" in str(e).lower() and retries < max_retries - 1:
-                retries += 1
-                print(f"Throttled {retries} times. Retrying in {2 ** retries} seconds...")
-                time.sleep(2 ** retries)  # Exponential backoff
-                continue
-            raise Exception("Max retries exceeded")
+{json.dumps(mass_keywords, indent=2)}"""
+
+
+def parse_json_response(llm_output):
     # Extract JSON from the LLM's output
-    json_match = re.search(r"\{.*\}", llm_output.content, re.DOTALL)
-    if json_match:
-        json_string = json_match.group(0)
-    else:
-        # If no code block, try to parse the whole output as JSON
-        json_string = llm_output
+    json_match = re.search(r"\{.*\}", llm_output, re.DOTALL)
+    json_string = json_match.group(0) if json_match else llm_output
 
     try:
-        detected_parts = json.loads(json_string)
+        return json.loads(json_string)
     except json.JSONDecodeError as e:
         print(f"Error decoding JSON: {e}")
         print(f"Attempted to decode: {json_string}")
         raise e
 
-    return detected_parts
\ No newline at end of file
+
+async def analyze_transcription_async(transcription_data, engine, system_prompt=None, use_keyword_windows=False):
+    """
+    Asks the engine's model for the start time of every part of the Mass in one request.
+
+    The transcript is compacted first (see `prepare_transcript`). With `use_keyword_windows`,
+    only the stretches around keyword matches are sent.
+    """
+    system_prompt = system_prompt or build_system_prompt()
+    transcript = prepare_transcript(transcription_data, use_keyword_windows)
+    response = await engine.complete(system_prompt, transcript, USER_TEMPLATE)
+    return parse_json_response(response)
+
+
+async def analyze_transcriptions_async(transcriptions, engine, use_keyword_windows=False):
+    """
+    Analyzes many transcriptions concurrently, within the engine's concurrency and rate limits.
+
+    Returns:
+        list: The detected parts of each transcription, in order, or the exception it failed with.
+    """
+    system_prompt = build_system_prompt()
+    return await asyncio.gather(
+        *(analyze_transcription_async(transcription_data, engine, system_prompt, use_keyword_windows) for transcription_data in transcriptions),
+        return_exceptions=True
+    )
+
+
+def analyze_transcription(
+    transcription_data,
+    service: str = 'bedrock',
+    model: str = None,
+    engine: LLMEngine = None,
+    use_keyword_windows: bool = False
+):
+    engine = engine or LLMEngine(get_chat_client(service, model, json_format=True))
+    return asyncio.run(analyze_transcription_async(transcription_data, engine, use_keyword_windows=use_keyword_windows))
+
+
+def analyze_transcriptions(transcriptions, engine, use_keyword_windows=False):
+    """
+    Blocking version of `analyze_transcriptions_async`.
+    """
+    return asyncio.run(analyze_transcriptions_async(transcriptions, engine, use_keyword_windows))
+
+
+if __name__ == "__main__":
+    import os
+    import argparse
+    from llm_engine import add_llm_arguments, engine_from_args
+    from stage_cache import StageCache, DEFAULT_CACHE_DIR
+    from transcript_store import TRANSCRIPT_SUFFIX, load_transcript
+
+    parser = argparse.ArgumentParser(description="Find the parts of the Mass in transcriptions with an LLM, one request per transcription.")
+    parser.add_argument("transcription_files", nargs="+", help=f"_transcription{TRANSCRIPT_SUFFIX} or .json files.")
+    parser.add_argument("--service", choices=['bedrock', 'ollama'], default='bedrock', help="The service to use for analysis.")
+    parser.add_argument("--model", help="The model to use for analysis.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the stage cache, where responses are kept.")
+    parser.add_argument("--keyword-windows", action="store_true", help=f"Only send the {DEFAULT_WINDOW_CHARS} characters of the transcript on each side of a keyword match.")
+    add_llm_arguments(parser)
+    args = parser.parse_args()
+
+    transcriptions = []
+    for transcription_file in args.transcription_files:
+        if transcription_file.endswith(TRANSCRIPT_SUFFIX):
+            transcriptions.append(load_transcript(transcription_file))
+        else:
+            with open(transcription_file, "r") as f:
+                transcriptions.append(json.load(f))
+
+    engine = engine_from_args(args, args.service, args.model, StageCache(args.cache_dir), json_format=True)
+    results = analyze_transcriptions(transcriptions, engine, args.keyword_windows)
+    output = {}
+    for transcription_file, result in zip(args.transcription_files, results):
+        if isinstance(result, Exception):
+            print(f"Error analyzing {transcription_file}: {result}")
+        else:
+            output[os.path.abspath(transcription_file)] = result
+    print(json.dumps(output, indent=2))
+    print(f"{engine.stats['requests']} requests ({engine.stats['retries']} retries), {engine.stats['cached']} cached responses.")
+    raw_tokens = sum(estimate_tokens(" ".join(chunk["text"] for chunk in data["chunks"])) for data in transcriptions)
+    sent_tokens = sum(estimate_tokens(prepare_transcript(data, args.keyword_windows)) for data in transcriptions)
+    print(f"Transcripts of about {raw_tokens // len(transcriptions)} tokens each were sent as about {sent_tokens // len(transcriptions)}.")
@@ -0,0 +1,183 @@
+from dataclasses import dataclass
+import numpy as np
+import librosa
+from pydub import AudioSegment
+
+SPEECH_SAMPLE_RATE = 16000
+
+# Bump when waveform_peaks changes its output
+PEAKS_VERSION = 1
+# The same 100ms windows find_cut_time measures the RMS over
+PEAKS_WINDOW_SECONDS = 0.1
+
+
+@dataclass
+class DecodedAudio:
+    """
+    A recording decoded once and shared by every stage of the pipeline.
+
+    Attributes:
+        segment (AudioSegment): The audio at its original sample rate and channel layout.
+                                Used for anything that is written back out (e.g. the homily).
+        speech (numpy.ndarray): The same audio as a mono 16kHz float32 array in [-1, 1].
+                                Used for transcription and fingerprinting.
+    """
+    segment: AudioSegment
+    speech: np.ndarray
+    sample_rate: int = SPEECH_SAMPLE_RATE
+
+    @property
+    def duration_seconds(self):
+        return len(self.speech) / self.sample_rate
+
+    def mono_samples(self):
+        """
+        Returns the original-rate samples averaged across channels, in the integer
+        amplitude scale of the source (e.g. +/-32768 for 16-bit audio).
+        """
+        samples = np.array(self.segment.get_array_of_samples(), dtype=np.float32)
+        if self.segment.channels > 1:
+            samples = samples.reshape((-1, self.segment.channels)).mean(axis=1)
+        return samples
+
+    def slice(self, start_seconds=None, end_seconds=None):
+        """
+        Returns a view of the audio between `start_seconds` and `end_seconds`.
+        Either bound may be None to leave that side open.
+        """
+        start_ms = None if start_seconds is None else float(start_seconds) * 1000
+        end_ms = None if end_seconds is None else float(end_seconds) * 1000
+        start_index = None if start_seconds is None else int(float(start_seconds) * self.sample_rate)
+        end_index = None if end_seconds is None else int(float(end_seconds) * self.sample_rate)
+        return DecodedAudio(
+            segment=self.segment[start_ms:end_ms],
+            speech=self.speech[start_index:end_index],
+            sample_rate=self.sample_rate
+        )
+
+    def trim(self, end_seconds):
+        """
+        Returns the audio cut at `end_seconds`, or the audio unchanged if `end_seconds` is None.
+        """
+        if end_seconds is None:
+            return self
+        return self.slice(end_seconds=end_seconds)
+
+    def export(self, output_file, format="mp3"):
+        self.segment.export(output_file, format=format)
+
+
+def to_speech(segment, sample_rate=SPEECH_SAMPLE_RATE):
+    """
+    Converts an AudioSegment to a mono float32 array resampled to `sample_rate`.
+    """
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    if segment.channels > 1:
+        samples = samples.reshape((-1, segment.channels)).mean(axis=1)
+    samples /= float(1 << (8 * segment.sample_width - 1))
+    if segment.frame_rate != sample_rate:
+        samples = librosa.resample(samples, orig_sr=segment.frame_rate, target_sr=sample_rate)
+    return samples.astype(np.float32, copy=False)
+
+
+def load_audio(file_path, sample_rate=SPEECH_SAMPLE_RATE):
+    """
+    Decodes an audio file once into a DecodedAudio.
+
+    Args:
+        file_path (str): The path to the recording (e.g. an MP3 from s3_downloads).
+        sample_rate (int): The sample rate of the speech buffer.
+
+    Returns:
+        DecodedAudio: The decoded recording.
+    """
+    segment = AudioSegment.from_file(file_path)
+    return DecodedAudio(segment=segment, speech=to_speech(segment, sample_rate), sample_rate=sample_rate)
+
+
+def windowed_rms(samples, window_size):
+    """
+    Computes the RMS of consecutive, non-overlapping windows of `window_size` samples.
+    A trailing partial window is dropped.
+
+    Returns:
+        numpy.ndarray: One RMS value per window.
+    """
+    n_windows = len(samples) // window_size
+    if n_windows == 0:
+        return np.zeros(0, dtype=np.float32)
+    windows = np.asarray(samples)[:n_windows * window_size].reshape((n_windows, window_size))
+    sum_of_squares = np.einsum('ij,ij->i', windows, windows, dtype=np.float64)
+    return np.sqrt(sum_of_squares / window_size).astype(np.float32)
+
+
+def find_runs(mask):
+    """
+    Finds the runs of True values in a boolean array.
+
+    Returns:
+        tuple: (starts, lengths) arrays with the first index and length of each run.
+    """
+    padded = np.concatenate(([0], np.asarray(mask, dtype=np.int8), [0]))
+    edges = np.diff(padded)
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return starts, ends - starts
+
+
+def find_first_run(mask, min_length):
+    """
+    Returns the start index of the first run of at least `min_length` True values, or None.
+    """
+    starts, lengths = find_runs(mask)
+    long_runs = np.flatnonzero(lengths >= min_length)
+    if len(long_runs) == 0:
+        return None
+    return int(starts[long_runs[0]])
+
+
+def peak_envelope(samples, n_buckets):
+    """
+    Decimates a signal to at most `n_buckets` (min, max) pairs, preserving its visible peaks.
+
+    Returns:
+        tuple: (mins, maxs) arrays, one value per bucket.
+    """
+    samples = np.asarray(samples)
+    bucket_size = max(1, int(np.ceil(len(samples) / n_buckets)))
+    n_full = len(samples) // bucket_size
+    buckets = samples[:n_full * bucket_size].reshape((n_full, bucket_size))
+    mins, maxs = buckets.min(axis=1), buckets.max(axis=1)
+    if n_full * bucket_size < len(samples):
+        tail = samples[n_full * bucket_size:]
+        mins = np.append(mins, tail.min())
+        maxs = np.append(maxs, tail.max())
+    return mins, maxs
+
+
+def waveform_peaks(audio, window_seconds=PEAKS_WINDOW_SECONDS):
+    """
+    Summarizes audio for drawing its waveform without decoding it: the RMS and the peak amplitude
+    of each window of `window_seconds`, both scaled to 0-255 relative to the loudest peak.
+
+    Args:
+        audio (DecodedAudio): The audio, e.g. the homily.
+
+    Returns:
+        dict: The "version", "window_seconds", "duration" in seconds, and the "rms" and "peaks" lists.
+    """
+    samples = audio.speech
+    window_size = max(1, int(round(audio.sample_rate * window_seconds)))
+    rms = windowed_rms(samples, window_size)
+    peaks = np.zeros(0, dtype=np.float32)
+    if len(rms):
+        # One bucket per RMS window, so the two lists line up
+        _, peaks = peak_envelope(np.abs(samples[:len(rms) * window_size]), len(rms))
+    scale = 255 / max(float(peaks.max()) if len(peaks) else 0, 1e-6)
+    return {
+        "version": PEAKS_VERSION,
+        "window_seconds": window_size / audio.sample_rate,
+        "duration": round(audio.duration_seconds, 2),
+        "rms": np.minimum(np.round(rms * scale), 255).astype(int).tolist(),
+        "peaks": np.minimum(np.round(peaks * scale), 255).astype(int).tolist(),
+    }
@@ -0,0 +1,259 @@
+import os
+import json
+import asyncio
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing.managers import BaseManager
+from pipeline import main as pipeline_main
+from transcriber import DEFAULT_MODEL_ID, WhisperTranscriber, set_cpu_threads
+from results import RESULTS_LOG, ResultsLog
+from mass_database import get_database
+from llm_engine import get_engine
+from stage_cache import StageCache
+
+MANIFEST_VERSION = 1
+
+
+class JobManifest:
+    """
+    A JSON file recording, for every recording in a batch, its overall status
+    ("pending", "done" or "failed"), the status of each pipeline stage and the last error.
+    It is rewritten after every file so an interrupted batch can resume where it stopped.
+    The analysis results themselves go to a ResultsLog.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.jobs = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == MANIFEST_VERSION:
+                self.jobs = data.get("jobs", {})
+            else:
+                print(f"Ignoring manifest {path} with unsupported version {data.get('version')}")
+
+    def add(self, input_file):
+        self.jobs.setdefault(input_file, {"status": "pending", "stages": {}, "error": None})
+
+    def reset(self):
+        """
+        Marks every job as pending again.
+        """
+        for job in self.jobs.values():
+            job["status"] = "pending"
+
+    def pending(self):
+        return [input_file for input_file, job in self.jobs.items() if job["status"] != "done"]
+
+    def update(self, input_file, outcome):
+        job = self.jobs[input_file]
+        job.update(outcome)
+        job["updated"] = datetime.now().isoformat(timespec="seconds")
+
+    def pop_results(self):
+        """
+        Removes and returns the results stored in manifests written by older versions.
+        """
+        return [job.pop("result") for job in self.jobs.values() if job.get("result")]
+
+    def save(self):
+        # Write to a temporary file first so that a crash never leaves a truncated manifest
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "jobs": self.jobs}, f)
+        os.replace(temp_path, self.path)
+
+
+class ModelLane:
+    """
+    Runs the expensive model stages for every pipeline worker in one process.
+
+    The Whisper model is loaded once, and at most `asr_slots` transcriptions run at a time
+    no matter how many workers are decoding, trimming and fingerprinting in parallel.
+    With an LLM `service`, the lane also hosts the one LLMEngine of the batch, so its
+    concurrency cap, rate limit and retries (set by `llm_options`) hold across every worker.
+    """
+
+    def __init__(self, model_id=DEFAULT_MODEL_ID, asr_slots=1, num_threads=None, service=None, model=None, cache=None, llm_options=None):
+        if num_threads is not None:
+            set_cpu_threads(num_threads)
+        self._transcriber = WhisperTranscriber(model_id)
+        self._asr_slots = threading.BoundedSemaphore(asr_slots)
+        self._llm_engine = None
+        self._llm_loop = None
+        if service is not None:
+            self._llm_engine = get_engine(service, model, cache if cache is not None else StageCache(), json_format=True, **(llm_options or {}))
+            # The engine's semaphore belongs to one event loop, so every request runs on this one
+            self._llm_loop = asyncio.new_event_loop()
+            threading.Thread(target=self._llm_loop.run_forever, name="llm", daemon=True).start()
+
+    def model_id(self):
+        return self._transcriber.model_id
+
+    def warm_up(self):
+        self._transcriber.warm_up()
+
+    def transcribe_speech(self, speech, sample_rate, options=None):
+        with self._asr_slots:
+            return self._transcriber.transcribe_speech(speech, sample_rate, options)
+
+    def llm_model_id(self):
+        return self._llm_engine.model_id if self._llm_engine is not None else None
+
+    def complete_prompt(self, system_prompt, transcript, user_template="{transcript}"):
+        """
+        Returns the reply of the lane's LLMEngine (see LLMEngine.complete). Each worker's call is
+        served in its own manager thread and waits here for the engine's shared limits.
+        """
+        if self._llm_engine is None:
+            raise RuntimeError("The model lane was started without an LLM service")
+        future = asyncio.run_coroutine_threadsafe(self._llm_engine.complete(system_prompt, transcript, user_template), self._llm_loop)
+        return future.result()
+
+
+class LaneManager(BaseManager):
+    pass
+
+
+LaneManager.register("ModelLane", ModelLane)
+
+
+class LaneTranscriber:
+    """
+    A transcriber for pipeline workers that forwards the speech buffer to the shared ModelLane.
+    Only the 16kHz speech array is sent, not the original-rate audio.
+    """
+
+    def __init__(self, lane, model_id=DEFAULT_MODEL_ID):
+        self.lane = lane
+        self.model_id = model_id
+
+    def transcribe(self, audio, options=None):
+        return self.lane.transcribe_speech(audio.speech, audio.sample_rate, options)
+
+
+class LaneLLMEngine:
+    """
+    An LLM engine for pipeline workers that forwards prompts to the LLMEngine of the shared ModelLane.
+    Each request waits in a thread, so a worker can still have several windows in flight at once.
+    """
+
+    def __init__(self, lane, model_id):
+        self.lane = lane
+        self.model_id = model_id
+
+    async def complete(self, system_prompt, transcript, user_template="{transcript}"):
+        return await asyncio.to_thread(self.lane.complete_prompt, system_prompt, transcript, user_template)
+
+
+def process_file(input_file, service, model, lane, transcription_options=None, cache=None, analysis="deterministic", llm_options=None,
+                 database=None, previews=False):
+    """
+    Runs the pipeline on one recording inside a worker process.
+    Any error is caught and reported, so that one bad file does not stop the batch.
+    Hybrid analysis sends its prompts to the lane's LLMEngine, shared by every worker.
+    The stage that failed is recorded in the catalog `database` as well as returned.
+
+    Returns:
+        dict: The job outcome with "status", "stages", "error" and "result".
+    """
+    stages = {}
+    try:
+        llm_model_id = lane.llm_model_id() if analysis == "hybrid" else None
+        result = pipeline_main(
+            input_file, service, model,
+            transcriber=LaneTranscriber(lane, lane.model_id()),
+            transcription_options=transcription_options,
+            stages=stages,
+            cache=cache,
+            analysis=analysis,
+            llm_options=llm_options,
+            database=database,
+            previews=previews,
+            llm_engine=LaneLLMEngine(lane, llm_model_id) if llm_model_id else None
+        )
+    except Exception as e:
+        traceback.print_exc()
+        for stage, status in stages.items():
+            if status == "running":
+                stages[stage] = "failed"
+        try:
+            (database or get_database()).save_run(input_file, stages=stages)
+        except Exception as db_error:
+            print(f"Could not record the failed stages of {input_file}: {db_error}")
+        return {"status": "failed", "stages": stages, "error": f"{type(e).__name__}: {e}", "result": None}
+
+    if result is None:
+        return {"status": "failed", "stages": stages, "error": "Pipeline did not produce a result", "result": None}
+    return {"status": "done", "stages": stages, "error": None, "result": result.to_dict()}
+
+
+def run_batch(input_files, manifest_path, service, model, workers=None, asr_slots=1,
+              model_id=DEFAULT_MODEL_ID, num_threads=None, transcription_options=None, cache=None, warm_up=False, rerun=False,
+              results_path=RESULTS_LOG, analysis="deterministic", llm_options=None, database=None, previews=False):
+    """
+    Runs the pipeline over many recordings.
+
+    Recordings are processed by a pool of `workers` processes, which do the CPU stages
+    (decoding, trimming, homily extraction and fingerprinting). Transcription goes through a
+    single ModelLane process with `asr_slots` concurrent slots. Files already marked done in
+    the manifest are skipped, so re-running an interrupted batch resumes it. With `rerun`,
+    every file goes through the pipeline again and the stage cache decides what is recomputed.
+    Each result is appended to the ResultsLog at `results_path` as soon as its file is done.
+    `analysis` and `llm_options` select the analyzer, as in pipeline.main. The LLM requests of every
+    worker go through the ModelLane's one engine, so its concurrency and rate limits apply to the whole batch.
+    Every run is also recorded in the catalog `database` (the default MassDatabase if None).
+    With `previews`, each worker also makes the homily's previews for the annotation tool.
+
+    Returns:
+        JobManifest: The manifest, with the outcome of every file.
+    """
+    manifest = JobManifest(manifest_path)
+    results_log = ResultsLog(results_path)
+    for result in manifest.pop_results():
+        results_log.append(result)
+    for input_file in input_files:
+        manifest.add(input_file)
+    if rerun:
+        manifest.reset()
+    manifest.save()
+
+    pending = manifest.pending()
+    print(f"{len(input_files) - len(pending)} files already done, {len(pending)} to process.")
+    if not pending:
+        return manifest
+
+    with LaneManager() as manager:
+        if analysis == "hybrid":
+            lane = manager.ModelLane(model_id, asr_slots, num_threads, service, model, cache, llm_options)
+        else:
+            lane = manager.ModelLane(model_id, asr_slots, num_threads)
+        if warm_up:
+            print("Warming up transcription model...")
+            lane.warm_up()
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(process_file, input_file, service, model, lane, transcription_options, cache, analysis, llm_options, database, previews): input_file
+                for input_file in pending
+            }
+            for done_count, future in enumerate(as_completed(futures), start=1):
+                input_file = futures[future]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    # The worker process itself died (e.g. it ran out of memory)
+                    outcome = {"status": "failed", "error": f"{type(e).__name__}: {e}", "result": None}
+                result = outcome.pop("result")
+                if result is not None:
+                    results_log.append(result)
+                manifest.update(input_file, outcome)
+                manifest.save()
+                print(f"[{done_count}/{len(pending)}] {input_file}: {outcome['status']}")
+                if outcome["error"]:
+                    print(f"    {outcome['error']}")
+
+    return manifest
@@ -0,0 +1,324 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List
+import numpy as np
+import librosa
+import soundfile as sf
+import soxr
+
+# Bump the version whenever the fingerprint's layout or computation changes.
+# Version 1 was the 13 MFCC means alone, version 2 clipped the log-mel spectrogram
+# 80dB below the loudest frame of the whole homily, which cannot be streamed.
+FINGERPRINT_VERSION = 3
+FINGERPRINT_SAMPLE_RATE = 16000
+N_FFT = 512
+HOP_LENGTH = 160
+N_MELS = 64
+N_MFCC = 20
+N_CHROMA = 12
+# Width of the MFCC delta window, as in librosa.feature.delta
+DELTA_WIDTH = 9
+# Length of the per-segment sub-fingerprints
+SEGMENT_SECONDS = 30.0
+# Audio read from a file at a time when streaming
+BLOCK_SECONDS = 10.0
+
+# The per-frame features, in the order they appear in the fingerprint. The fingerprint is the
+# mean of every feature over time, followed by the standard deviation of every feature.
+FRAME_FEATURES = [
+    ("mfcc", N_MFCC),
+    ("mfcc_delta", N_MFCC),
+    ("chroma", N_CHROMA),
+    ("log_mel", N_MELS),
+]
+FRAME_FEATURE_SIZE = sum(size for _, size in FRAME_FEATURES)
+FINGERPRINT_SIZE = 2 * FRAME_FEATURE_SIZE
+MIN_FRAMES = DELTA_WIDTH
+
+
+def frame_features(y, sr=FINGERPRINT_SAMPLE_RATE):
+    """
+    Computes the per-frame voice features of a whole signal from a single STFT.
+
+    The power spectrogram is computed once. The mel spectrogram, MFCCs and chroma are all
+    derived from it, instead of each running its own STFT over the signal. This holds every
+    feature of every frame in memory; `FingerprintAccumulator` computes the same features
+    block by block when only the fingerprint is needed.
+
+    Args:
+        y (numpy.ndarray): The mono audio signal.
+        sr (int): The sample rate of `y`. Other rates are resampled to 16kHz first.
+
+    Returns:
+        dict: Each name in FRAME_FEATURES mapped to a (size, frames) matrix, or None if the
+              signal is too short.
+    """
+    if sr != FINGERPRINT_SAMPLE_RATE:
+        y = librosa.resample(y, orig_sr=sr, target_sr=FINGERPRINT_SAMPLE_RATE)
+    y = np.asarray(y, dtype=np.float32)
+    if len(y) < N_FFT:
+        return None
+
+    power = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)) ** 2
+    if power.shape[1] < MIN_FRAMES:
+        return None
+
+    mel = librosa.feature.melspectrogram(S=power, sr=FINGERPRINT_SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS)
+    log_mel = librosa.power_to_db(mel, top_db=None)
+    mfcc = librosa.feature.mfcc(S=log_mel, n_mfcc=N_MFCC)
+    return {
+        "mfcc": mfcc,
+        "mfcc_delta": librosa.feature.delta(mfcc, width=DELTA_WIDTH),
+        # tuning=0 skips the pitch tuning estimate, which would be another pass over the spectrogram
+        "chroma": librosa.feature.chroma_stft(S=power, sr=FINGERPRINT_SAMPLE_RATE, n_fft=N_FFT, n_chroma=N_CHROMA, tuning=0.0),
+        "log_mel": log_mel,
+    }
+
+
+def pool_frame_features(features):
+    """
+    Returns the fingerprint of a set of frame features: every feature's mean over time, then every feature's standard deviation.
+    """
+    frames = np.concatenate([features[name] for name, _ in FRAME_FEATURES], axis=0)
+    return np.concatenate([frames.mean(axis=1), frames.std(axis=1)]).astype(np.float32)
+
+
+def fingerprint_components(fingerprint):
+    """
+    Splits a fingerprint into its parts, e.g. "mfcc_mean" or "log_mel_std".
+    """
+    components = {}
+    offset = 0
+    for statistic in ("mean", "std"):
+        for name, size in FRAME_FEATURES:
+            components[f"{name}_{statistic}"] = fingerprint[offset:offset + size]
+            offset += size
+    return components
+
+
+class RunningMoments:
+    """
+    The running mean and variance of a stream of vectors, updated a block of rows at a time
+    (Chan et al.'s parallel algorithm, which stays accurate over long streams).
+    """
+
+    def __init__(self, size):
+        self.count = 0
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    def update(self, rows):
+        if len(rows) == 0:
+            return
+        rows = np.asarray(rows, dtype=np.float64)
+        count = len(rows)
+        mean = rows.mean(axis=0)
+        m2 = ((rows - mean) ** 2).sum(axis=0)
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def fingerprint(self):
+        return np.concatenate([self.mean, np.sqrt(self.m2 / self.count)]).astype(np.float32)
+
+
+@lru_cache(maxsize=None)
+def _filters():
+    window = librosa.filters.get_window("hann", N_FFT, fftbins=True).astype(np.float32)
+    mel_basis = librosa.filters.mel(sr=FINGERPRINT_SAMPLE_RATE, n_fft=N_FFT, n_mels=N_MELS)
+    chroma_basis = librosa.filters.chroma(sr=FINGERPRINT_SAMPLE_RATE, n_fft=N_FFT, tuning=0.0, n_chroma=N_CHROMA)
+    half = DELTA_WIDTH // 2
+    delta_weights = np.arange(-half, half + 1, dtype=np.float64)
+    return window, mel_basis, chroma_basis, delta_weights / (delta_weights ** 2).sum()
+
+
+@dataclass
+class VoiceFingerprint:
+    """
+    A voice fingerprint, and the sub-fingerprints of consecutive segments of the same audio.
+
+    Each segment is a dict with its "start" and "end" in seconds and its "fingerprint".
+    A segment whose sub-fingerprint is far from the others is where a different speaker may have taken over.
+    """
+    fingerprint: np.ndarray
+    segments: List[dict] = field(default_factory=list)
+
+
+class FingerprintAccumulator:
+    """
+    Computes a voice fingerprint from audio fed to it in blocks of any size.
+
+    Only the running moments of the frame features are kept, so memory does not grow with the
+    length of the audio. The features are the same as `frame_features`: frames are cut exactly
+    as a centered librosa STFT would cut them, across block boundaries, and the MFCC deltas of
+    the first and last frames are computed as librosa.feature.delta does.
+    """
+
+    def __init__(self, sr=FINGERPRINT_SAMPLE_RATE, segment_seconds=SEGMENT_SECONDS):
+        self._resampler = None
+        if sr != FINGERPRINT_SAMPLE_RATE:
+            self._resampler = soxr.ResampleStream(sr, FINGERPRINT_SAMPLE_RATE, 1, dtype="float32")
+        self.segment_frames = max(1, int(round(segment_seconds * FINGERPRINT_SAMPLE_RATE / HOP_LENGTH)))
+
+        # Samples not yet framed; starts with the zero padding of a centered STFT
+        self._samples = np.zeros(N_FFT // 2, dtype=np.float32)
+        self._frames = 0
+        # MFCCs of the frames from _history_start on, for the deltas
+        self._mfcc_history = np.zeros((0, N_MFCC))
+        self._history_start = 0
+        # Features of the frames from _pending_start on, waiting for the MFCCs they need for their deltas
+        self._pending = np.zeros((0, N_MFCC + N_CHROMA + N_MELS))
+        self._pending_start = 0
+
+        self._moments = RunningMoments(FRAME_FEATURE_SIZE)
+        self._segment_moments = {}
+
+    def add(self, samples):
+        """
+        Adds the next block of mono samples, at the sample rate given to the constructor.
+        """
+        samples = np.asarray(samples, dtype=np.float32)
+        if self._resampler is not None:
+            samples = self._resampler.resample_chunk(samples)
+        self._samples = np.concatenate([self._samples, samples])
+        self._frame()
+        self._pool(final=False)
+
+    def _frame(self):
+        n_frames = 0 if len(self._samples) < N_FFT else 1 + (len(self._samples) - N_FFT) // HOP_LENGTH
+        if n_frames == 0:
+            return
+        window, mel_basis, chroma_basis, _ = _filters()
+        frames = np.lib.stride_tricks.sliding_window_view(self._samples, N_FFT)[::HOP_LENGTH][:n_frames]
+        power = np.abs(np.fft.rfft(frames * window, axis=1)) ** 2
+        self._samples = self._samples[n_frames * HOP_LENGTH:]
+
+        log_mel = librosa.power_to_db(power @ mel_basis.T, top_db=None)
+        mfcc = librosa.feature.mfcc(S=log_mel.T, n_mfcc=N_MFCC).T
+        chroma = librosa.util.normalize(power @ chroma_basis.T, norm=np.inf, axis=1)
+
+        self._frames += n_frames
+        self._mfcc_history = np.concatenate([self._mfcc_history, mfcc])
+        self._pending = np.concatenate([self._pending, np.concatenate([mfcc, chroma, log_mel], axis=1)])
+
+    def _pool(self, final):
+        half = DELTA_WIDTH // 2
+        total = self._frames
+        # A frame's delta needs the MFCCs of the `half` frames after it, or after the first full window
+        ready_end = total if final else max(0, total - half)
+        if total < DELTA_WIDTH or ready_end <= self._pending_start:
+            return
+
+        _, _, _, delta_weights = _filters()
+        indices = np.arange(self._pending_start, ready_end)
+        # Frames too close to either end use the delta of the nearest full window, like librosa's "interp" mode
+        centers = np.clip(indices, half, total - half - 1 if final else None) - self._history_start
+        windows = np.lib.stride_tricks.sliding_window_view(self._mfcc_history, DELTA_WIDTH, axis=0)
+        deltas = windows[centers - half] @ delta_weights
+
+        ready = self._pending[:len(indices)]
+        rows = np.concatenate([ready[:, :N_MFCC], deltas, ready[:, N_MFCC:]], axis=1)
+        self._moments.update(rows)
+        segment_ids = indices // self.segment_frames
+        for segment_id in np.unique(segment_ids):
+            moments = self._segment_moments.setdefault(int(segment_id), RunningMoments(FRAME_FEATURE_SIZE))
+            moments.update(rows[segment_ids == segment_id])
+
+        self._pending = self._pending[len(indices):]
+        self._pending_start = ready_end
+        keep_from = max(0, ready_end - DELTA_WIDTH)
+        self._mfcc_history = self._mfcc_history[keep_from - self._history_start:]
+        self._history_start = keep_from
+
+    def finish(self):
+        """
+        Flushes the end of the audio.
+
+        Returns:
+            VoiceFingerprint: The fingerprint and segment sub-fingerprints, or None if the audio is too short.
+        """
+        tail = self._resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True) if self._resampler else np.zeros(0, dtype=np.float32)
+        # The zero padding at the end of a centered STFT
+        self._samples = np.concatenate([self._samples, tail, np.zeros(N_FFT // 2, dtype=np.float32)])
+        self._frame()
+        if self._frames < MIN_FRAMES:
+            return None
+        self._pool(final=True)
+
+        frame_seconds = HOP_LENGTH / FINGERPRINT_SAMPLE_RATE
+        segments = []
+        for segment_id, moments in sorted(self._segment_moments.items()):
+            start_frame = segment_id * self.segment_frames
+            end_frame = start_frame + moments.count
+            segments.append({
+                "start": round(start_frame * frame_seconds, 2),
+                "end": round(end_frame * frame_seconds, 2),
+                "fingerprint": moments.fingerprint()
+            })
+        return VoiceFingerprint(fingerprint=self._moments.fingerprint(), segments=segments)
+
+
+def compute_voice_fingerprint(y, sr=FINGERPRINT_SAMPLE_RATE, segment_seconds=SEGMENT_SECONDS):
+    """
+    Computes the fingerprint and segment sub-fingerprints of a signal already in memory.
+
+    Returns:
+        VoiceFingerprint: The result, or None if the signal is too short.
+    """
+    accumulator = FingerprintAccumulator(sr, segment_seconds)
+    block_size = int(BLOCK_SECONDS * sr)
+    for start in range(0, len(y), block_size):
+        accumulator.add(y[start:start + block_size])
+    return accumulator.finish()
+
+
+def stream_voice_fingerprint(path, segment_seconds=SEGMENT_SECONDS, block_seconds=BLOCK_SECONDS):
+    """
+    Computes the fingerprint and segment sub-fingerprints of an audio file, reading it a block at a time.
+
+    Memory use is the same for a five-minute and a fifty-minute homily. Files soundfile cannot
+    read are decoded whole with librosa instead.
+
+    Returns:
+        VoiceFingerprint: The result, or None if the audio is too short.
+    """
+    try:
+        info = sf.info(path)
+    except RuntimeError:
+        y, sr = librosa.load(path, sr=FINGERPRINT_SAMPLE_RATE)
+        return compute_voice_fingerprint(y, sr, segment_seconds)
+
+    accumulator = FingerprintAccumulator(info.samplerate, segment_seconds)
+    for block in sf.blocks(path, blocksize=int(block_seconds * info.samplerate), dtype="float32", always_2d=True):
+        accumulator.add(block.mean(axis=1))
+    return accumulator.finish()
+
+
+def create_voice_fingerprint(y, sr=FINGERPRINT_SAMPLE_RATE):
+    """
+    Creates a voice fingerprint from an audio signal.
+
+    The fingerprint holds the mean and standard deviation over time of 20 MFCCs, their deltas,
+    12 chroma bins and 64 log-mel bands, all computed from one STFT. Its layout is identified
+    by FINGERPRINT_VERSION.
+
+    Args:
+        y (numpy.ndarray): The mono audio signal (e.g. the `speech` buffer of a DecodedAudio).
+        sr (int): The sample rate of `y`. 16kHz is a standard for speech.
+
+    Returns:
+        numpy.ndarray: A float32 vector of FINGERPRINT_SIZE values.
+                       Returns None if the fingerprint cannot be computed.
+    """
+    try:
+        result = compute_voice_fingerprint(y, sr)
+        if result is None:
+            print("Audio is too short for a voice fingerprint.")
+            return None
+        return result.fingerprint
+
+    except Exception as e:
+        print(f"Error creating voice fingerprint: {e}")
+        return None
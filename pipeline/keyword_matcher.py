@@ -0,0 +1,80 @@
+from collections import deque
+
+
+def normalize_text(text):
+    """
+    Lowercases text and collapses runs of whitespace into single spaces.
+    """
+    return " ".join(text.lower().split())
+
+
+class KeywordAutomaton:
+    """
+    An Aho-Corasick automaton that finds every occurrence of many phrases in one pass over a text.
+
+    Each phrase is registered with a value (e.g. the Mass part it identifies). Phrases are
+    normalized with `normalize_text`, so the text being searched should be normalized the same way.
+    """
+
+    def __init__(self, phrases):
+        """
+        Args:
+            phrases (iterable): (phrase, value) pairs.
+        """
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [()]
+
+        for phrase, value in phrases:
+            phrase = normalize_text(phrase)
+            if not phrase:
+                continue
+            state = 0
+            for char in phrase:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._outputs.append(())
+                    self._goto[state][char] = next_state
+                state = next_state
+            self._outputs[state] += ((len(phrase), value),)
+
+        # Breadth-first, so that every state's failure link is final before its children need it
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._outputs[next_state] += self._outputs[self._fail[next_state]]
+
+        # Fold the failure links into the transitions, so that matching is one dict lookup per character.
+        # A state's failure target is always shallower, so it is complete by the time it is needed.
+        self._delta = [dict(self._goto[0])]
+        self._delta.extend({} for _ in range(len(self._goto) - 1))
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self._delta[state] = {**self._delta[self._fail[state]], **self._goto[state]}
+            queue.extend(self._goto[state].values())
+
+    def find(self, text):
+        """
+        Finds every phrase occurrence in `text`.
+
+        Yields:
+            tuple: (start, end, value) for each match, with `end` exclusive, in order of `end`.
+        """
+        delta = self._delta
+        outputs = self._outputs
+        state = 0
+        for position, char in enumerate(text):
+            state = delta[state].get(char, 0)
+            if outputs[state]:
+                for length, value in outputs[state]:
+                    yield position + 1 - length, position + 1, value
@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from stage_cache import stage_key
+
+# Bump the version whenever the way responses are requested changes in a way that changes them
+LLM_CACHE_VERSION = 1
+DEFAULT_MODELS = {
+    "bedrock": "anthropic.claude-3-sonnet-20240229-v1:0",
+    "ollama": "gemma3:12b",
+}
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_REQUESTS_PER_SECOND = 1.0
+DEFAULT_MAX_RETRIES = 6
+
+
+class ThrottlingError(Exception):
+    """
+    Raised by a client when the service asks it to slow down.
+    """
+
+
+def is_throttling(error):
+    """
+    Returns whether an exception means the request was throttled and can be retried.
+    Bedrock raises a ThrottlingException, other services answer with HTTP 429.
+    """
+    if isinstance(error, ThrottlingError):
+        return True
+    message = str(error).lower()
+    return "throttl" in message or "too many requests" in message or "rate exceeded" in message
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=60.0):
+    """
+    Returns how long to wait before retry number `attempt` (counting from 0).
+
+    The delay is drawn uniformly between 0 and an exponentially growing cap ("full jitter"),
+    so requests throttled at the same moment do not all retry at the same moment.
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TokenBucket:
+    """
+    Limits requests to `rate` per second on average, allowing bursts of up to `capacity`.
+
+    A request that finds the bucket empty reserves the next token and sleeps until it is
+    due, so waiting requests are released in order at the configured rate.
+    """
+
+    def __init__(self, rate=DEFAULT_REQUESTS_PER_SECOND, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Takes a token and returns how many seconds to wait before using it.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class ChatClient:
+    """
+    A LangChain chat model for a service, created once and shared by every request.
+    """
+
+    def __init__(self, service="bedrock", model=None, temperature=None, json_format=False):
+        if service not in DEFAULT_MODELS:
+            raise ValueError(f"Unsupported service: {service}")
+        self.service = service
+        self.model = model or DEFAULT_MODELS[service]
+        self.model_id = f"{service}:{self.model}"
+
+        if service == "bedrock":
+            from langchain_aws import ChatBedrock
+            model_kwargs = {"temperature": temperature} if temperature is not None else {}
+            self.llm = ChatBedrock(model_id=self.model, model_kwargs=model_kwargs)
+        else:
+            from langchain_ollama import ChatOllama
+            kwargs = {"format": "json"} if json_format else {}
+            if temperature is not None:
+                kwargs["temperature"] = temperature
+            self.llm = ChatOllama(model=self.model, **kwargs)
+
+    async def complete(self, system_prompt, user_message):
+        from langchain_core.messages import HumanMessage, SystemMessage
+        response = await self.llm.ainvoke([SystemMessage(content=system_prompt), HumanMessage(content=user_message)])
+        return response.content
+
+
+class StubLLM:
+    """
+    A local stand-in for a chat model, for exercising the engine without a service.
+
+    Replies with `respond(system_prompt, user_message)` (an empty JSON object by default)
+    after `latency` seconds, and raises a ThrottlingError for a `throttle_rate` fraction of requests.
+    """
+
+    def __init__(self, respond=None, latency=0.0, throttle_rate=0.0, seed=0, model_id="stub"):
+        self.respond = respond or (lambda system_prompt, user_message: "{}")
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.model_id = model_id
+        self.calls = 0
+        self.throttled = 0
+        self._random = random.Random(seed)
+
+    async def complete(self, system_prompt, user_message):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self._random.random() < self.throttle_rate:
+            self.throttled += 1
+            raise ThrottlingError("ThrottlingException: Rate exceeded")
+        return self.respond(system_prompt, user_message)
+
+
+class LLMEngine:
+    """
+    Sends prompts to a shared chat client concurrently, without exceeding the service's limits.
+
+    At most `max_concurrency` requests are in flight, and a token bucket spaces them to
+    `requests_per_second`. Throttled requests are retried up to `max_retries` times after the first
+    attempt, each after a jittered backoff during which they give up their slot, so other requests
+    keep going. Responses are stored in a StageCache, keyed by the model, the prompt and the
+    transcript, so only transcripts that changed are sent again. Empty responses are never stored.
+    """
+
+    def __init__(self, client, cache=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 requests_per_second=DEFAULT_REQUESTS_PER_SECOND, burst=None,
+                 max_retries=DEFAULT_MAX_RETRIES, base_delay=1.0, max_delay=60.0):
+        self.client = client
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucket(requests_per_second, burst)
+        if max_retries < 0:
+            raise ValueError(f"max_retries must be at least 0, not {max_retries}")
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "cached": 0, "retries": 0}
+        self._semaphores = {}
+
+    @property
+    def model_id(self):
+        return self.client.model_id
+
+    def _semaphore(self):
+        # asyncio primitives belong to one event loop, and the sync helpers start a new loop per call
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            self._semaphores = {loop: asyncio.Semaphore(self.max_concurrency)}
+            semaphore = self._semaphores[loop]
+        return semaphore
+
+    def cache_key(self, system_prompt, transcript, user_template):
+        return stage_key(
+            "llm", LLM_CACHE_VERSION,
+            model=self.client.model_id,
+            prompt=hash_text(system_prompt + "\0" + user_template),
+            transcript=hash_text(transcript)
+        )
+
+    async def complete(self, system_prompt, transcript, user_template="{transcript}"):
+        """
+        Returns the model's reply to a prompt about a transcript.
+
+        Args:
+            system_prompt (str): The instructions, the same for every transcript.
+            transcript (str): The transcript text.
+            user_template (str): The user message, with "{transcript}" where the transcript goes.
+
+        Returns:
+            str: The reply, from the cache if this prompt was already sent for this transcript.
+        """
+        key = self.cache_key(system_prompt, transcript, user_template)
+        if self.cache is not None:
+            cached = self.cache.get_json(key)
+            # Earlier versions could store an empty response, which is never worth reusing
+            if cached is not None and cached.get("response"):
+                self.stats["cached"] += 1
+                return cached["response"]
+
+        response = await self._request(system_prompt, user_template.replace("{transcript}", transcript))
+        if self.cache is not None and response:
+            self.cache.put_json(key, {"model": self.client.model_id, "response": response})
+        return response
+
+    async def _request(self, system_prompt, user_message):
+        for attempt in range(self.max_retries + 1):
+            async with self._semaphore():
+                await self.rate_limiter.acquire()
+                self.stats["requests"] += 1
+                try:
+                    return await self.client.complete(system_prompt, user_message)
+                except Exception as e:
+                    if not is_throttling(e) or attempt == self.max_retries:
+                        raise
+            self.stats["retries"] += 1
+            delay = backoff_delay(attempt, self.base_delay, self.max_delay)
+            print(f"Throttled {attempt + 1} times. Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+
+    def complete_sync(self, system_prompt, transcript, user_template="{transcript}"):
+        """
+        Blocking version of `complete`, for callers that are not running an event loop.
+        """
+        return asyncio.run(self.complete(system_prompt, transcript, user_template))
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_chat_client(service="bedrock", model=None, temperature=None, json_format=False):
+    """
+    Returns the process-wide chat client for a service and model, creating it on first use.
+    """
+    key = (service, model or DEFAULT_MODELS.get(service), temperature, json_format)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = ChatClient(service, model, temperature, json_format)
+        return _clients[key]
+
+
+def add_llm_arguments(parser):
+    group = parser.add_argument_group("LLM analysis")
+    group.add_argument("--llm-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY, help="The most LLM requests in flight at once.")
+    group.add_argument("--llm-rate", type=float, default=DEFAULT_REQUESTS_PER_SECOND, help="The most LLM requests started per second, on average (0 for no limit).")
+    group.add_argument("--llm-burst", type=float, help="How many LLM requests may start at once after a pause. Defaults to the rate.")
+    group.add_argument("--llm-retries", type=int, default=DEFAULT_MAX_RETRIES, help="How many times a throttled request is retried after its first attempt before giving up.")
+    group.add_argument("--stub-llm", action="store_true", help="Answer every request with a local stub instead of calling the service.")
+
+
+def llm_options_from_args(args):
+    return {
+        "max_concurrency": args.llm_concurrency,
+        "requests_per_second": args.llm_rate,
+        "burst": args.llm_burst,
+        "max_retries": args.llm_retries,
+        "stub": args.stub_llm,
+    }
+
+
+def create_engine(service, model, cache=None, temperature=None, json_format=False, stub=False, **options):
+    """
+    Creates an engine for a service and model. `options` are passed on to LLMEngine.
+    """
+    client = StubLLM() if stub else get_chat_client(service, model, temperature, json_format)
+    return LLMEngine(client, cache, **options)
+
+
+def engine_from_args(args, service, model, cache=None, temperature=None, json_format=False):
+    return create_engine(service, model, cache, temperature, json_format, **llm_options_from_args(args))
+
+
+_engines = {}
+
+
+def get_engine(service, model, cache=None, json_format=False, **options):
+    """
+    Returns the process-wide engine for a service, model and options, creating it on first use,
+    so the rate limit holds across every file a process analyzes.
+    """
+    key = (service, model, getattr(cache, "root", None), json_format, tuple(sorted(options.items())))
+    with _clients_lock:
+        engine = _engines.get(key)
+    if engine is None:
+        engine = create_engine(service, model, cache, json_format=json_format, **options)
+        with _clients_lock:
+            engine = _engines.setdefault(key, engine)
+    return engine
@@ -0,0 +1,516 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+DEFAULT_DATABASE = os.environ.get(
+    "MASS_ANALYSIS_DATABASE",
+    os.path.join(os.path.expanduser("~"), ".local", "share", "mass_analysis", "catalog.sqlite")
+)
+# Bump when the schema changes; older databases are migrated in `_create_schema`
+SCHEMA_VERSION = 2
+
+RECORDING_SUFFIX = ".mp3"
+# Files the pipeline writes next to a recording, which are not recordings themselves
+DERIVED_AUDIO_MARKERS = ("_cut", "_homily")
+
+PATH_PATTERN = re.compile(r'(\d{4})/(\d{1,2})/(\d{1,2})(?:/([^/]+)/)?')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS masses (
+    base_name TEXT PRIMARY KEY,
+    audio_file TEXT NOT NULL,
+    date TEXT,
+    location TEXT,
+    mass_time TEXT,
+    is_sunday INTEGER,
+    mass_parts TEXT,
+    homily_audio TEXT,
+    predicted_priest TEXT,
+    prediction_confidence REAL,
+    annotated_priest TEXT,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS masses_date ON masses (date);
+CREATE INDEX IF NOT EXISTS masses_location ON masses (location, date);
+CREATE INDEX IF NOT EXISTS masses_priest ON masses (COALESCE(annotated_priest, predicted_priest), date);
+CREATE INDEX IF NOT EXISTS masses_revision ON masses (revision);
+CREATE UNIQUE INDEX IF NOT EXISTS masses_audio_file ON masses (audio_file);
+
+CREATE TABLE IF NOT EXISTS stages (
+    base_name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (base_name, stage)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS fingerprints (
+    base_name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    fingerprint BLOB NOT NULL,
+    segment_times TEXT,
+    segment_fingerprints BLOB
+);
+CREATE INDEX IF NOT EXISTS fingerprints_version ON fingerprints (version);
+
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    children TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+# The columns of `masses` callers may set
+MASS_FIELDS = (
+    "date", "location", "mass_time", "is_sunday", "mass_parts", "homily_audio",
+    "predicted_priest", "prediction_confidence", "annotated_priest"
+)
+
+
+def parse_recording_path(path):
+    """
+    Returns the (ISO date, location) of a recording from its path, like '2025/6/30/GoH/14-01-27.mp3'.
+    Either is None if the path does not have it.
+    """
+    match = PATH_PATTERN.search(path)
+    if not match:
+        return None, None
+    year, month, day = (int(part) for part in match.group(1, 2, 3))
+    return f"{year:04d}-{month:02d}-{day:02d}", match.group(4)
+
+
+def recording_key(base_name):
+    """
+    Returns the key a recording is stored under: the real path of its base name (its path without the extension).
+    """
+    return os.path.realpath(base_name)
+
+
+def is_recording(file_name):
+    return file_name.endswith(RECORDING_SUFFIX) and not any(marker in file_name for marker in DERIVED_AUDIO_MARKERS)
+
+
+def _prefix_range(directory):
+    # Paths under a directory sort between "<directory>/" and "<directory>0" ("0" follows "/"),
+    # so they can be found with a range scan of an index instead of a LIKE over every row
+    directory = os.path.realpath(directory).rstrip(os.sep)
+    return directory + os.sep, directory + chr(ord(os.sep) + 1)
+
+
+def _row(row):
+    mass = dict(row)
+    if mass.get("mass_parts") is not None:
+        mass["mass_parts"] = json.loads(mass["mass_parts"])
+    if mass.get("is_sunday") is not None:
+        mass["is_sunday"] = bool(mass["is_sunday"])
+    mass["priest"] = mass.get("annotated_priest") or mass.get("predicted_priest")
+    return mass
+
+
+class MassDatabase:
+    """
+    A SQLite catalog of every recording: its metadata, the status of each pipeline stage, the
+    Mass parts found, its voice fingerprint and its priest, predicted and annotated.
+
+    The database is in WAL mode, so the pipeline's workers, the annotation server and the
+    analysis scripts can read it while one of them writes. Each thread gets its own connection.
+    Every write to a Mass bumps its `revision`, so readers can fetch only what changed since
+    they last looked (see `changed_since`).
+    """
+
+    def __init__(self, path=DEFAULT_DATABASE):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._create_schema()
+
+    # Only the path is pickled, so a database can be handed to worker processes, which open their own connections
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.path = state["path"]
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Transactions are started explicitly, see `transaction`
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _create_schema(self):
+        with self.transaction() as db:
+            version = db.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise RuntimeError(f"{self.path} was created by a newer version (schema {version}).")
+            if version < 2:
+                # Schema 1 did not remember the child directories, so the next sync lists everything once
+                db.execute("DROP TABLE IF EXISTS directories")
+            # executescript would commit the transaction, so statements are run one at a time
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    db.execute(statement)
+            db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextmanager
+    def transaction(self):
+        """
+        Runs the statements in the block as one transaction, holding the write lock from the start
+        so two writers never have to abort each other.
+        """
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def _next_revision(self, db):
+        return db.execute("SELECT COALESCE(MAX(revision), 0) + 1 FROM masses").fetchone()[0]
+
+    def _add_recording(self, db, audio_file):
+        base_name = recording_key(os.path.splitext(audio_file)[0])
+        date, location = parse_recording_path(audio_file)
+        db.execute(
+            "INSERT INTO masses (base_name, audio_file, date, location, revision) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (base_name) DO NOTHING",
+            (base_name, os.path.realpath(audio_file), date, location, self._next_revision(db))
+        )
+        return base_name
+
+    def _update_mass(self, db, base_name, **fields):
+        unknown = set(fields) - set(MASS_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        if "mass_parts" in fields and fields["mass_parts"] is not None:
+            fields["mass_parts"] = json.dumps(fields["mass_parts"])
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        cursor = db.execute(
+            f"UPDATE masses SET {assignments}, revision = ? WHERE base_name = ?",
+            (*fields.values(), self._next_revision(db), recording_key(base_name))
+        )
+        return cursor.rowcount > 0
+
+    def _set_stages(self, db, base_name, stages):
+        now = time.time()
+        db.executemany(
+            "INSERT INTO stages (base_name, stage, status, updated) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (base_name, stage) DO UPDATE SET status = excluded.status, updated = excluded.updated",
+            [(recording_key(base_name), stage, status, now) for stage, status in stages.items()]
+        )
+
+    def _set_fingerprint(self, db, base_name, version, fingerprint, segments=None):
+        segment_times = segment_fingerprints = None
+        if segments:
+            segment_times = json.dumps([[segment["start"], segment["end"]] for segment in segments])
+            segment_fingerprints = np.asarray([segment["fingerprint"] for segment in segments], dtype=np.float32).tobytes()
+        db.execute(
+            "INSERT OR REPLACE INTO fingerprints (base_name, version, fingerprint, segment_times, segment_fingerprints) VALUES (?, ?, ?, ?, ?)",
+            (recording_key(base_name), version, np.asarray(fingerprint, dtype=np.float32).tobytes(), segment_times, segment_fingerprints)
+        )
+
+    def add_recordings(self, audio_files):
+        """
+        Adds recordings that are not in the catalog yet.
+
+        Returns:
+            list: The base names of the recordings.
+        """
+        with self.transaction() as db:
+            return [self._add_recording(db, audio_file) for audio_file in audio_files]
+
+    def save_run(self, audio_file, stages=None, fingerprint=None, fingerprint_version=None, segments=None, **fields):
+        """
+        Records what a pipeline run produced for a recording, all in one transaction.
+
+        Args:
+            audio_file (str): The recording.
+            stages (dict): The status of each stage.
+            fingerprint (list): The homily's voice fingerprint, with its `fingerprint_version`
+                                and the `segments` sub-fingerprints ({"start", "end", "fingerprint"}).
+            fields: Columns of the Mass to set, see MASS_FIELDS.
+        """
+        with self.transaction() as db:
+            base_name = self._add_recording(db, audio_file)
+            if fields:
+                self._update_mass(db, base_name, **fields)
+            if stages:
+                self._set_stages(db, base_name, stages)
+            if fingerprint is not None:
+                self._set_fingerprint(db, base_name, fingerprint_version, fingerprint, segments)
+
+    def set_annotation(self, base_name, priest):
+        """
+        Records the priest a person labelled a recording with (None to clear it).
+
+        Returns:
+            bool: Whether the recording is in the catalog.
+        """
+        with self.transaction() as db:
+            return self._update_mass(db, base_name, annotated_priest=priest or None)
+
+    def annotation(self, base_name):
+        """
+        Returns the priest a person labelled a recording with, or None if it has no label yet.
+        """
+        row = self._connection().execute(
+            "SELECT annotated_priest FROM masses WHERE base_name = ?", (recording_key(base_name),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def mass(self, base_name):
+        """
+        Returns a recording's row as a dictionary (with the effective "priest": the annotated one,
+        else the predicted one), or None if it is not in the catalog.
+        """
+        row = self._connection().execute("SELECT * FROM masses WHERE base_name = ?", (recording_key(base_name),)).fetchone()
+        return _row(row) if row else None
+
+    def stages(self, base_name):
+        rows = self._connection().execute("SELECT stage, status FROM stages WHERE base_name = ?", (recording_key(base_name),))
+        return {stage: status for stage, status in rows}
+
+    def masses(self, priest=None, location=None, date_from=None, date_to=None, labelled=None, with_homily=None, under=None):
+        """
+        Returns the Masses matching every given filter, oldest first.
+
+        Args:
+            priest (str): Only Masses of this priest (annotated, else predicted).
+            location (str): Only Masses recorded at this location (e.g. 'GoH').
+            date_from (str): Only Masses on or after this ISO date.
+            date_to (str): Only Masses on or before this ISO date.
+            labelled (bool): Only Masses a person labelled (True) or did not (False).
+            with_homily (bool): Only Masses whose homily was (True) or was not (False) extracted.
+            under (str): Only recordings under this directory.
+        """
+        conditions, parameters = [], []
+        if priest is not None:
+            conditions.append("COALESCE(annotated_priest, predicted_priest) = ?")
+            parameters.append(priest)
+        if location is not None:
+            conditions.append("location = ?")
+            parameters.append(location)
+        if date_from is not None:
+            conditions.append("date >= ?")
+            parameters.append(date_from)
+        if date_to is not None:
+            conditions.append("date <= ?")
+            parameters.append(date_to)
+        if labelled is not None:
+            conditions.append("annotated_priest IS NOT NULL" if labelled else "annotated_priest IS NULL")
+        if with_homily is not None:
+            conditions.append("homily_audio IS NOT NULL" if with_homily else "homily_audio IS NULL")
+        if under is not None:
+            conditions.append("base_name >= ? AND base_name < ?")
+            parameters.extend(_prefix_range(under))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = self._connection().execute(f"SELECT * FROM masses {where} ORDER BY date, base_name", parameters)
+        return [_row(row) for row in rows]
+
+    def changed_since(self, revision):
+        """
+        Returns the Masses written after `revision`, and the latest revision.
+        Pass the latest revision back in to get only what changed next.
+        """
+        rows = self._connection().execute("SELECT * FROM masses WHERE revision > ? ORDER BY revision", (revision,)).fetchall()
+        masses = [_row(row) for row in rows]
+        return masses, (masses[-1]["revision"] if masses else revision)
+
+    def fingerprint(self, base_name):
+        """
+        Returns a recording's (version, fingerprint, segments), or None if it has no fingerprint.
+        The segments are {"start", "end", "fingerprint"} dictionaries.
+        """
+        row = self._connection().execute("SELECT * FROM fingerprints WHERE base_name = ?", (recording_key(base_name),)).fetchone()
+        if row is None:
+            return None
+        fingerprint = np.frombuffer(row["fingerprint"], dtype=np.float32)
+        segments = []
+        if row["segment_times"]:
+            vectors = np.frombuffer(row["segment_fingerprints"], dtype=np.float32).reshape(-1, len(fingerprint))
+            segments = [{"start": start, "end": end, "fingerprint": vector} for (start, end), vector in zip(json.loads(row["segment_times"]), vectors)]
+        return row["version"], fingerprint, segments
+
+    def fingerprints(self, version=None, under=None, labelled=None):
+        """
+        Yields the (Mass, fingerprint) of every recording with a fingerprint (of `version`, if given), oldest first.
+
+        Args:
+            version (int): Only fingerprints of this version.
+            under (str): Only recordings under this directory.
+            labelled (bool): Only recordings a person labelled (True) or did not (False).
+        """
+        conditions, parameters = [], []
+        if version is not None:
+            conditions.append("fingerprints.version = ?")
+            parameters.append(version)
+        if under is not None:
+            conditions.append("base_name >= ? AND base_name < ?")
+            parameters.extend(_prefix_range(under))
+        if labelled is not None:
+            conditions.append("annotated_priest IS NOT NULL" if labelled else "annotated_priest IS NULL")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        query = f"SELECT masses.*, fingerprints.version AS fingerprint_version, fingerprints.fingerprint AS vector FROM fingerprints JOIN masses USING (base_name) {where}"
+        for row in self._connection().execute(query + " ORDER BY date, base_name", parameters):
+            mass = _row(row)
+            yield mass, np.frombuffer(mass.pop("vector"), dtype=np.float32)
+
+    def sync_recordings(self, data_dir):
+        """
+        Adds the recordings under `data_dir` that are not in the catalog yet.
+
+        Only directories whose modification time changed since the last sync (an entry was added,
+        removed or renamed) are listed. The others are walked through the child directories
+        remembered from their last listing, so a sync of an unchanged archive costs one stat per
+        directory rather than a listing of every file.
+
+        Returns:
+            int: How many recordings were added.
+        """
+        known = {path: (mtime, children) for path, mtime, children in self._connection().execute("SELECT path, mtime, children FROM directories")}
+        changed_directories = []
+        recordings = []
+        stack = [os.path.realpath(data_dir)]
+        while stack:
+            directory = stack.pop()
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            previous = known.get(directory)
+            if previous is not None and previous[0] == mtime:
+                stack.extend(json.loads(previous[1]))
+                continue
+            children = []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        children.append(entry.path)
+                    elif is_recording(entry.name):
+                        recordings.append(entry.path)
+            stack.extend(children)
+            changed_directories.append((directory, mtime, json.dumps(sorted(children))))
+
+        with self.transaction() as db:
+            before = db.execute("SELECT COUNT(*) FROM masses").fetchone()[0]
+            for audio_file in recordings:
+                self._add_recording(db, audio_file)
+            db.executemany(
+                "INSERT OR REPLACE INTO directories (path, mtime, children) VALUES (?, ?, ?)", changed_directories
+            )
+            return db.execute("SELECT COUNT(*) FROM masses").fetchone()[0] - before
+
+    def recordings(self, under=None):
+        """
+        Returns the paths of the recordings in the catalog (under a directory, if given), oldest first.
+        """
+        return [mass["audio_file"] for mass in self.masses(under=under)]
+
+    def import_sidecars(self, data_dir):
+        """
+        Copies what earlier versions of the pipeline left next to the recordings under `data_dir`
+        (analysis, homily, fingerprint, label and prediction files) into the catalog.
+        This walks the whole archive, so it is only needed once.
+        """
+        from speaker_index import (
+            FINGERPRINT_SUFFIX, PREDICTION_SUFFIX, UNKNOWN_PRIEST,
+            read_annotation, read_fingerprint_file, read_fingerprint_segments
+        )
+        self.sync_recordings(data_dir)
+        imported = 0
+        for mass in self.masses(under=data_dir):
+            base_name = os.path.splitext(mass["audio_file"])[0]
+            fields = {}
+            fingerprint = version = segments = None
+            if os.path.exists(f"{base_name}_analysis.json"):
+                with open(f"{base_name}_analysis.json", "r") as f:
+                    fields["mass_parts"] = json.load(f)
+            if os.path.exists(f"{base_name}_homily.mp3"):
+                fields["homily_audio"] = f"{base_name}_homily.mp3"
+            if os.path.exists(base_name + PREDICTION_SUFFIX):
+                with open(base_name + PREDICTION_SUFFIX, "r") as f:
+                    prediction = json.load(f)
+                if prediction.get("label") != UNKNOWN_PRIEST:
+                    fields["predicted_priest"] = prediction.get("label")
+                fields["prediction_confidence"] = prediction.get("confidence")
+            annotation = read_annotation(base_name)
+            if annotation is not None:
+                fields["annotated_priest"] = annotation
+            if os.path.exists(base_name + FINGERPRINT_SUFFIX):
+                try:
+                    version, fingerprint = read_fingerprint_file(base_name + FINGERPRINT_SUFFIX)
+                    segments = read_fingerprint_segments(base_name + FINGERPRINT_SUFFIX)
+                except (ValueError, KeyError) as e:
+                    print(f"Skipping unreadable fingerprint of {base_name}: {e}")
+            if fields or fingerprint is not None:
+                self.save_run(mass["audio_file"], fingerprint=fingerprint, fingerprint_version=version, segments=segments, **fields)
+                imported += 1
+        print(f"Imported the sidecar files of {imported} recordings under {data_dir} into {self.path}.")
+        return imported
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path=None):
+    """
+    Returns the process-wide database at `path` (DEFAULT_DATABASE if None), opening it on first use.
+    """
+    path = path or DEFAULT_DATABASE
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = MassDatabase(path)
+        return _databases[path]
+
+
+def add_database_arguments(parser):
+    """
+    Adds the catalog database option to a command line parser.
+    """
+    parser.add_argument("--database", default=DEFAULT_DATABASE, help="The catalog database of every recording.")
+
+
+def database_from_args(args):
+    return get_database(args.database)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the catalog database of every recording.")
+    add_database_arguments(parser)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Add every recording under a directory, with the sidecar files earlier versions of the pipeline wrote.")
+    import_parser.add_argument("data_dir")
+    sync_parser = subparsers.add_parser("sync", help="Add the recordings under a directory that are not in the catalog yet.")
+    sync_parser.add_argument("data_dir")
+    list_parser = subparsers.add_parser("list", help="List the Masses in the catalog.")
+    list_parser.add_argument("--priest")
+    list_parser.add_argument("--location")
+    list_parser.add_argument("--from", dest="date_from")
+    list_parser.add_argument("--to", dest="date_to")
+
+    args = parser.parse_args()
+    database = MassDatabase(args.database)
+    if args.command == "import":
+        database.import_sidecars(args.data_dir)
+    elif args.command == "sync":
+        print(f"Added {database.sync_recordings(args.data_dir)} recordings.")
+    else:
+        for mass in database.masses(priest=args.priest, location=args.location, date_from=args.date_from, date_to=args.date_to):
+            print(f"{mass['date']} {mass['location']} {mass['priest'] or '?'} {mass['audio_file']}")
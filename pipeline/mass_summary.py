@@ -0,0 +1,115 @@
+import re
+
+# The parts that can end the homily, in the order they are looked for
+HOMILY_END_PARTS = ["creed", "prayers_of_the_faithful", "eucharistic_prayer"]
+
+# The sections of the Mass the dashboard breaks a Mass down into. A section starts at its first
+# part that was found and ends at its first end part that was found.
+MASS_SECTIONS = [
+    ("introductory_rites", ["beginning_of_mass"], ["first_reading"]),
+    ("liturgy_of_the_word", ["first_reading"], ["homily"]),
+    ("homily", ["homily"], ["creed", "prayers_of_the_faithful"]),
+    ("creed_and_prayers", ["creed", "prayers_of_the_faithful"], ["eucharistic_prayer"]),
+    ("liturgy_of_the_eucharist", ["eucharistic_prayer"], ["distribution_of_communion"]),
+    ("communion_and_concluding_rites", ["distribution_of_communion"], ["end_of_mass"]),
+]
+
+# A transcript line as written by the pipeline: "(start, end) text", or "[start, end] text"
+TRANSCRIPT_LINE_PATTERN = re.compile(r'^[(\[]\s*([\d.]+|None)\s*,\s*([\d.]+|None)\s*[)\]]\s?(.*)$')
+
+
+def part_time(mass_parts, part_name):
+    """
+    Returns the start time of a part in seconds, or None if it was not found.
+    """
+    try:
+        return float(mass_parts[part_name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def first_part_time(mass_parts, part_names):
+    for part_name in part_names:
+        time = part_time(mass_parts, part_name)
+        if time is not None:
+            return time
+    return None
+
+
+def homily_bounds(mass_parts):
+    """
+    Returns the (start, end) times of the homily. The start is None if the homily was not found,
+    and the end is None if no part after it was found (the homily then runs to the end of the transcript).
+    """
+    return part_time(mass_parts, "homily"), first_part_time(mass_parts, HOMILY_END_PARTS)
+
+
+def section_durations(mass_parts):
+    """
+    Returns the duration in seconds of each section of MASS_SECTIONS whose start and end were found.
+    """
+    durations = {}
+    for section, start_parts, end_parts in MASS_SECTIONS:
+        start = first_part_time(mass_parts, start_parts)
+        end = first_part_time(mass_parts, end_parts)
+        if start is not None and end is not None and end >= start:
+            durations[section] = round(end - start, 2)
+    return durations
+
+
+def parse_transcript(transcript):
+    """
+    Parses a transcript written by the pipeline, one "(start, end) text" line per segment, back
+    into segments. Used for results saved before the segments were stored with them.
+    """
+    chunks = []
+    for line in transcript.splitlines():
+        match = TRANSCRIPT_LINE_PATTERN.match(line)
+        if not match or match.group(1) == "None":
+            continue
+        end = match.group(2)
+        chunks.append({
+            "start": float(match.group(1)),
+            "end": None if end == "None" else float(end),
+            "text": match.group(3).strip()
+        })
+    return chunks
+
+
+def homily_text(chunks, mass_parts):
+    """
+    Returns the text of the segments that start during the homily, or None if the homily was not found.
+    """
+    start, end = homily_bounds(mass_parts)
+    if start is None:
+        return None
+    return " ".join(
+        chunk["text"] for chunk in chunks
+        if chunk["start"] >= start and (end is None or chunk["start"] < end)
+    )
+
+
+def summarize_mass(mass_parts, chunks):
+    """
+    Computes the fields derived from a Mass's analysis, so the dashboard does not have to.
+
+    Args:
+        mass_parts (dict): The start time of each part of the Mass found.
+        chunks (list): The transcript segments, as {"start", "end", "text"} dictionaries.
+
+    Returns:
+        dict: The Mass's "duration", the homily's "homily_start", "homily_end" and
+              "homily_duration", the "section_durations" (all in seconds, None when unknown),
+              and the "homily_text".
+    """
+    mass_start = part_time(mass_parts, "beginning_of_mass")
+    mass_end = part_time(mass_parts, "end_of_mass")
+    homily_start, homily_end = homily_bounds(mass_parts)
+    return {
+        "duration": round(mass_end - mass_start, 2) if mass_start is not None and mass_end is not None else None,
+        "homily_start": homily_start,
+        "homily_end": homily_end,
+        "homily_duration": round(homily_end - homily_start, 2) if homily_start is not None and homily_end is not None else None,
+        "section_durations": section_durations(mass_parts),
+        "homily_text": homily_text(chunks, mass_parts),
+    }
@@ -1,5 +1,5 @@
-from dataclasses import dataclass
-from typing import Dict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
 
 @dataclass
 class MassMetadata:
@@ -25,11 +25,27 @@ class MassAnalysisResult:
     mass_parts: Dict[str, str]
     audio_file: str
     metadata: MassMetadata
+    # Derived from the fields above once by the pipeline (see mass_summary.summarize_mass),
+    # so the dashboard does not re-derive them from the transcript text
+    chunks: List[dict] = field(default_factory=list)
+    duration: Optional[float] = None
+    homily_start: Optional[float] = None
+    homily_end: Optional[float] = None
+    homily_duration: Optional[float] = None
+    section_durations: Dict[str, float] = field(default_factory=dict)
+    homily_text: Optional[str] = None
     
     def to_dict(self):
         return {
             'transcript': self.transcript,
             'mass_parts': self.mass_parts,
             'audio_file': self.audio_file,
-            'metadata': self.metadata.to_dict()
+            'metadata': self.metadata.to_dict(),
+            'chunks': self.chunks,
+            'duration': self.duration,
+            'homily_start': self.homily_start,
+            'homily_end': self.homily_end,
+            'homily_duration': self.homily_duration,
+            'section_durations': self.section_durations,
+            'homily_text': self.homily_text
         }
\ No newline at end of file
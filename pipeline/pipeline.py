@@ -4,346 +4,514 @@ import sys
 import json
 import pickle
 import numpy as np
-from pydub import AudioSegment
-import torch
 import time
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
-from analyze_transcription_deterministic import analyze_transcription
-import librosa
+from dataclasses import asdict
+from analyze_transcription_deterministic import analyze_transcription, KEYWORDS_FILE
+from analyze_transcription_hybrid import HYBRID_VERSION, analyze_transcription as analyze_transcription_hybrid
+from llm_engine import add_llm_arguments, get_engine, llm_options_from_args
 from model import MassMetadata, MassAnalysisResult
+from mass_summary import homily_bounds, summarize_mass
+from previews import PREVIEW_VERSION, preview_key, submit_previews, wait_for_previews
+from audio import SPEECH_SAMPLE_RATE, PEAKS_VERSION, load_audio, windowed_rms, find_first_run, peak_envelope, waveform_peaks
+from transcriber import DEFAULT_MODEL_ID, TranscriptionOptions, get_transcriber, set_cpu_threads
+from transcript_store import TRANSCRIPT_SUFFIX, write_transcript, load_transcript
+from transcript_compaction import is_hallucinated
+from stage_cache import StageCache, stage_key, hash_file, DEFAULT_CACHE_DIR
+from mass_database import get_database, add_database_arguments, database_from_args
+from fingerprint import FINGERPRINT_VERSION, compute_voice_fingerprint, stream_voice_fingerprint
+from speaker_index import (
+    UNKNOWN_PRIEST, DEFAULT_MIN_CONFIDENCE, LABEL_SUFFIX, PREDICTION_SUFFIX,
+    find_speaker_changes, get_speaker_index, read_annotation, read_fingerprint_file,
+    read_fingerprint_segments, write_fingerprint_file
+)
 from datetime import datetime
 
 
 
 time_synonyms = ["time", "start_time", "start-time", "startTime"]
 
-def create_voice_fingerprint(audio_path):
+# Bump a stage's version whenever its code changes in a way that changes its output
+STAGE_VERSIONS = {
+    "cut": 1,
+    "transcription": 2,
+    "analysis": 1,
+    "homily": 1,
+    "fingerprint": FINGERPRINT_VERSION,
+    "peaks": PEAKS_VERSION,
+    "previews": PREVIEW_VERSION,
+}
+
+def get_homily_bounds(mass_parts):
     """
-    Creates a voice fingerprint from an audio file using MFCCs.
+    Returns the (start, end) times of the homily from the analysis, or None if they cannot be found.
+    They are the bounds of mass_summary.homily_bounds, so the homily audio, its fingerprint and
+    previews cover the same span as the homily text and duration exported to the dashboard.
+    """
+    if 'homily' not in mass_parts:
+        print("Could not find homily in the analysis.")
+        return None
 
-    Args:
-        audio_path (str): The file path to the audio recording (e.g., 'my_voice.mp3').
+    start_time, end_time = homily_bounds(mass_parts)
+    if start_time is None or end_time is None:
+        print("Could not find homily start and end times in the analysis.")
+        return None
+
+    return start_time, end_time
+
+def extract_homily_audio(audio, mass_parts, output_file=None):
+    """
+    Extracts the homily audio from the decoded recording based on the analysis.
+    The homily is written to `output_file` if one is given.
 
     Returns:
-        numpy.ndarray: A 1D array representing the voice fingerprint.
-                         Returns None if the file cannot be loaded.
+        DecodedAudio: The homily audio, or None if the homily could not be found.
     """
-    try:
-        # 1. Load the audio file
-        #    - sr=16000: Resample to 16kHz, a standard for speech
-        #    - mono=True: Convert to mono
-        y, sr = librosa.load(audio_path, sr=16000, mono=True)
-
-        # 2. Extract MFCCs
-        #    - n_mfcc=13: Number of MFCC coefficients to return
-        #    - The result is a matrix where columns are frames and rows are MFCCs
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-
-        # 3. Create the fingerprint by taking the mean of each coefficient
-        fingerprint = np.concatenate([
-            np.mean(mfccs, axis=1)
-        ])
-
-        return fingerprint
-
-    except Exception as e:
-        print(f"Error processing {audio_path}: {e}")
+    bounds = get_homily_bounds(mass_parts)
+    if bounds is None:
         return None
 
-def extract_homily_audio(input_file, mass_parts, output_file):
-    """
-    Extracts the homily audio from the input file based on the analysis.
+    homily_audio = audio.slice(*bounds)
+    if output_file is not None:
+        homily_audio.export(output_file, format="mp3")
+    return homily_audio
+
+
+def find_cut_time(audio, rms_plot_file=None, channels_plot_file=None, rms_threshold=200, silence_duration_min=10):
     """
+    Analyzes the decoded audio to find a suitable cut time.
+    The cut time is the beginning of the first silence longer than `silence_duration_min`
 
-    if 'homily' not in mass_parts:
-        print("Could not find homily in the analysis.")
-        return
+    The diagnostic plots are only drawn when their output files are given.
+    """
+    samples = audio.mono_samples()
+    frame_rate = audio.segment.frame_rate
+    window_size = int(frame_rate * 0.1)  # 100ms
 
-    start_time = mass_parts['homily']
-    end_time = None
+    rms_values = windowed_rms(samples, window_size)
+    times = np.arange(len(rms_values)) * (window_size / frame_rate)
 
-    if 'prayers_of_the_faithful' in mass_parts:
-        end_time = mass_parts['prayers_of_the_faithful']
-    
-    if 'creed' in mass_parts:
-        end_time = mass_parts['creed']
-    
-    
-    if start_time is None or end_time is None:
-        print("Could not find homily start and end times in the analysis.")
-        return
+    if channels_plot_file is not None or rms_plot_file is not None:
+        plot_cut_diagnostics(samples, times, rms_values, rms_threshold, rms_plot_file, channels_plot_file)
 
-    audio = AudioSegment.from_file(input_file)
-    start_ms = float(start_time) * 1000
-    end_ms = float(end_time) * 1000
-    homily_audio = audio[start_ms:end_ms]
-    homily_audio.export(output_file, format="mp3")
+    silence_duration_ms = silence_duration_min * 60 * 1000
+    silence_windows = int(silence_duration_ms / 100)
+    start_window = find_first_run(rms_values < rms_threshold, silence_windows)
+    if start_window is None:
+        return None
+    return float(times[start_window])
 
 
-def find_cut_time(file_path, rms_plot_file, channels_plot_file, rms_threshold=200, silence_duration_min=10):
+def plot_cut_diagnostics(samples, times, rms_values, rms_threshold, rms_plot_file=None, channels_plot_file=None, max_points=10000):
     """
-    Analyzes the audio file to find a suitable cut time.
-    The cut time is the beginning of the first silence longer than `silence_duration_min`
+    Plots the waveform and the RMS values compared to the threshold.
+    Both series are decimated to at most `max_points` points.
     """
-    audio = AudioSegment.from_file(file_path)
-    samples = np.array(audio.get_array_of_samples())
-    if audio.channels == 2:
-        samples = samples.reshape((-1, 2))
-        samples = samples.mean(axis=1)
-    
     import matplotlib.pyplot as plt
 
-    # Plot raw audio samples
-    plt.figure(figsize=(15,5))
-    plt.plot(samples)
-    plt.xlabel('Sample')
-    plt.ylabel('Amplitude')
-    plt.title('Audio Waveform')
-    plt.grid(True)
-    plt.savefig(channels_plot_file)
-    plt.close()
-
-    window_size = int(audio.frame_rate * 0.1)  # 100ms
-
-    # Plot RMS values compared to threshold
-    rms_values = []
-    times = []
-    for i in range(0, len(samples) - window_size, window_size):
-        window = samples[i:i + window_size]
-        rms = np.sqrt(np.mean(window**2))
-        time_seconds = i / audio.frame_rate
-        rms_values.append(rms)
-        times.append(time_seconds)
-
-    plt.figure(figsize=(15,5))
-    plt.plot(times, rms_values, label='RMS')
-    plt.axhline(y=rms_threshold, color='r', linestyle='--', label='Threshold')
-    plt.xlabel('Time (seconds)')
-    plt.ylabel('RMS')
-    plt.title('RMS Values vs Threshold')
-    plt.legend()
-    plt.grid(True)
-    plt.savefig(rms_plot_file)
-    plt.close()    
-    silence_duration_ms = silence_duration_min * 60 * 1000
-    silence_windows = int(silence_duration_ms / 100)
-    consecutive_silent_windows = 0
-    start_of_silence = 0
-
-    for i in range(0, len(samples) - window_size, window_size):
-        window = samples[i:i + window_size]
-        rms = np.sqrt(np.mean(window**2))
-        time_seconds = i / audio.frame_rate
-
-        if rms < rms_threshold:
-            if consecutive_silent_windows == 0:
-                start_of_silence = time_seconds
-            consecutive_silent_windows += 1
-            if consecutive_silent_windows >= silence_windows:
-                return start_of_silence
-        else:
-            consecutive_silent_windows = 0
+    if channels_plot_file is not None:
+        # Plot the waveform envelope rather than every raw sample
+        mins, maxs = peak_envelope(samples, max_points)
+        bucket_starts = np.linspace(0, len(samples), len(mins), endpoint=False)
+        plt.figure(figsize=(15,5))
+        plt.fill_between(bucket_starts, mins, maxs, linewidth=0)
+        plt.xlabel('Sample')
+        plt.ylabel('Amplitude')
+        plt.title('Audio Waveform')
+        plt.grid(True)
+        plt.savefig(channels_plot_file)
+        plt.close()
+
+    if rms_plot_file is not None:
+        step = max(1, int(np.ceil(len(rms_values) / max_points)))
+        plt.figure(figsize=(15,5))
+        plt.plot(times[::step], rms_values[::step], label='RMS')
+        plt.axhline(y=rms_threshold, color='r', linestyle='--', label='Threshold')
+        plt.xlabel('Time (seconds)')
+        plt.ylabel('RMS')
+        plt.title('RMS Values vs Threshold')
+        plt.legend()
+        plt.grid(True)
+        plt.savefig(rms_plot_file)
+        plt.close()
+
+
+def transcribe_audio(audio, transcriber=None, options=None):
+    """
+    Transcribes the decoded audio with a persistent Whisper model.
+    The process-wide transcriber is used unless another one is given.
+    """
+    if transcriber is None:
+        transcriber = get_transcriber()
+    return transcriber.transcribe(audio, options)
 
-    return None
 
+def add_transcription_arguments(parser):
+    """
+    Adds the chunked transcription options to a command line parser.
+    """
+    parser.add_argument("--chunk-length", type=float, help="Transcribe in chunks of this many seconds, decoded in batches. Whisper uses 30.")
+    parser.add_argument("--stride", type=float, help="Overlap in seconds on each side of a chunk. Defaults to a sixth of the chunk length.")
+    parser.add_argument("--batch-size", type=int, default=1, help="Number of chunks decoded together in chunked mode.")
+    parser.add_argument("--threads", type=int, help="Number of torch CPU threads. 0 uses all cores.")
 
-def cut_audio(input_file, end_seconds, output_file):
-    audio = AudioSegment.from_file(input_file)
-    if end_seconds is None:
-        audio.export(output_file, format="mp3")
-    else:
-        end_ms = end_seconds * 1000
-        cut_audio = audio[:end_ms]
-        cut_audio.export(output_file, format="mp3")
 
+def transcription_options_from_args(args):
+    return TranscriptionOptions(
+        chunk_length_s=args.chunk_length,
+        stride_length_s=args.stride,
+        batch_size=args.batch_size
+    )
 
-def transcribe_audio(file_path):
-    device = "cuda:0" if torch.cuda.is_available() else "cpu"
-    torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
 
-    model_id = "openai/whisper-medium.en"
+def add_cache_arguments(parser):
+    """
+    Adds the stage cache options to a command line parser.
+    """
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the stage cache.")
+    parser.add_argument("--cache-size", type=float, default=50, help="Maximum size of the stage cache in GB.")
 
-    model = AutoModelForSpeechSeq2Seq.from_pretrained(
-        model_id, torch_dtype=torch_dtype, low_cpu_mem_usage=True, use_safetensors=True
-    )
-    model.to(device)
-
-    processor = AutoProcessor.from_pretrained(model_id)
-
-    pipe = pipeline(
-        "automatic-speech-recognition",
-        model=model,
-        tokenizer=processor.tokenizer,
-        feature_extractor=processor.feature_extractor,
-        torch_dtype=torch_dtype,
-        device=device,
-        return_timestamps=True
-    )
 
-    result = pipe(file_path)
-    return result
+def cache_from_args(args):
+    return StageCache(args.cache_dir, int(args.cache_size * 1024 ** 3))
 
 
+def set_stage_status(stages, stage, status):
+    """
+    Records the status of a pipeline stage ("running", "done" or "skipped") if the caller is tracking them.
+    """
+    if stages is not None:
+        stages[stage] = status
 
 
+def main(input_file, service, model, override=False, plots=False, transcriber=None, transcription_options=None, stages=None, cache=None,
+         analysis="deterministic", llm_options=None, database=None, previews=False, llm_engine=None):
+    """
+    Runs the pipeline on one recording.
 
-def main(input_file, service, model, override=False):
-    print(f"Starting pipeline for {input_file} using {service}...")
+    The Mass parts are found with the keyword analyzer. With `analysis` set to "hybrid", the
+    parts it misses or places implausibly are then looked up with `model` on `service`,
+    configured by `llm_options` (see llm_engine.create_engine), or sent through `llm_engine`
+    if given (e.g. a batch's shared engine).
+
+    Stage outputs are kept in a content-addressed StageCache, so a stage only runs again when
+    one of its inputs changes: the recording, its parameters, its code version, or the output
+    of an earlier stage. `override` forces stages to run anyway: True for every stage, or a
+    collection of stage names (e.g. {"analysis", "homily"}).
+
+    `stages`, if given, is a dict that is updated with the status of each stage as it runs,
+    so that a caller can tell which stage a failure happened in.
+
+    With `previews`, a low-bitrate speech transcode and short preview clips of the homily are
+    made for the annotation tool, in a pool of worker threads while the later stages run.
+
+    What the run produced (stage statuses, Mass parts, fingerprint, priest and metadata) is
+    recorded in the catalog `database` (the default MassDatabase if None) in one transaction.
+    The sidecar files next to the recording are still written, for tools that read them.
+    """
+    print(f"Starting pipeline for {input_file} with {analysis} analysis...")
+
+    if cache is None:
+        cache = StageCache()
+    if database is None:
+        database = get_database()
+    if stages is None:
+        stages = {}
+    if transcription_options is None:
+        transcription_options = TranscriptionOptions()
+
+    def forced(stage):
+        return override is True or (bool(override) and stage in override)
+
+    base_name = os.path.splitext(input_file)[0]
+    transcription_output_file = f"{base_name}_transcription{TRANSCRIPT_SUFFIX}"
+    legacy_transcription_file = f"{base_name}_transcription.pkl"
+    output_json_file = f"{base_name}_analysis.json"
+    transcript_file = f"{base_name}_transcript.txt"
+    homily_audio_file = f"{base_name}_homily.mp3"
+    homily_peaks_file = f"{base_name}_homily_peaks.json"
+    fingerprint_file = f"{base_name}_fingerprint.json"
+
+    audio_hash = hash_file(input_file)
+
+    # The recording is decoded at most once, and only if a stage that needs audio has to run.
+    audio = None
+    def decoded_audio():
+        nonlocal audio
+        if audio is None:
+            print(f"Decoding {input_file}...")
+            set_stage_status(stages, "decode", "running")
+            audio = load_audio(input_file)
+            set_stage_status(stages, "decode", "done")
+        return audio
+
+    # 1. Find cut time. The cut time is a function of the recording and the cut parameters,
+    # so later stages are keyed on those and the cut only runs when the transcription has to.
+    cut_key = stage_key("cut", STAGE_VERSIONS["cut"], audio=audio_hash, rms_threshold=200, silence_duration_min=10)
+
+    def find_cached_cut_time():
+        cached_cut = None if forced("cut") else cache.get_json(cut_key)
+        if cached_cut is not None:
+            set_stage_status(stages, "cut", "skipped")
+            return cached_cut["cut_time"]
 
-    cut_audio_file = f"{os.path.splitext(input_file)[0]}_cut.mp3"
-    skip_cut_audio = False
-    if os.path.exists(cut_audio_file) and not override:
-        print(f"Cut audio file {cut_audio_file} already exists. Skipping cut audio step.")
-        skip_cut_audio = True
-    
-    if not skip_cut_audio:
-        # 1. Find cut time
         print("Finding cut time...")
-        rms_plot_file = f"{os.path.splitext(input_file)[0]}_rms_plot.png"
-        channels_plot_file = f"{os.path.splitext(input_file)[0]}_channels_plot.png"
-        cut_time = find_cut_time(input_file, rms_plot_file=rms_plot_file, channels_plot_file=channels_plot_file)
+        set_stage_status(stages, "cut", "running")
+        rms_plot_file = None
+        channels_plot_file = None
+        if plots:
+            rms_plot_file = f"{base_name}_rms_plot.png"
+            channels_plot_file = f"{base_name}_channels_plot.png"
+        cut_time = find_cut_time(decoded_audio(), rms_plot_file=rms_plot_file, channels_plot_file=channels_plot_file)
         if cut_time == None:
             print("Could not find a suitable cut time, processing entire file.")
         else:
             print(f"Cut time found at {cut_time} seconds.")
+        cache.put_json(cut_key, {"cut_time": cut_time})
+        set_stage_status(stages, "cut", "done")
+        return cut_time
+
+    # 2. Transcribe the cut audio
+    model_id = getattr(transcriber, "model_id", DEFAULT_MODEL_ID)
+    transcription_key = stage_key(
+        "transcription", STAGE_VERSIONS["transcription"],
+        cut=cut_key,
+        model_id=model_id,
+        options=asdict(transcription_options)
+    )
+    transcription_path = None if forced("transcription") else cache.get_path(transcription_key, TRANSCRIPT_SUFFIX)
+    if transcription_path is None and not forced("transcription") and os.path.exists(legacy_transcription_file):
+        # Adopt pickled transcriptions from earlier versions of the pipeline rather than re-transcribing
+        # the archive. Each is converted once, and only the transcript file is read afterwards.
+        print(f"Converting legacy transcription {legacy_transcription_file}...")
+        with open(legacy_transcription_file, "rb") as f:
+            legacy_transcription = pickle.load(f)
+        temp_path = cache.put_path(transcription_key, TRANSCRIPT_SUFFIX)
+        write_transcript(temp_path, legacy_transcription)
+        transcription_path = cache.commit(transcription_key, TRANSCRIPT_SUFFIX, temp_path)
+        os.rename(legacy_transcription_file, legacy_transcription_file + ".converted")
+
+    if transcription_path is not None:
+        print("Transcription is up to date. Skipping transcription step.")
+        set_stage_status(stages, "transcription", "skipped")
+    else:
+        cut_time = find_cached_cut_time()
 
-        # 2. Cut audio
-        print(f"Cutting audio to {cut_audio_file}...")
-        cut_audio(input_file, cut_time, cut_audio_file)
-
-    
-    transcription_output_file = f"{os.path.splitext(input_file)[0]}_transcription.pkl"
-    skip_transcription = False
-    if os.path.exists(transcription_output_file) and not override:
-        print(f"Transcription file {transcription_output_file} already exists. Skipping transcription step.")
-        skip_transcription = True
-    
-    if not skip_transcription:
-        # 3. Transcribe audio
         print("Transcribing audio...")
-        transcription_result = transcribe_audio(cut_audio_file)
+        set_stage_status(stages, "transcription", "running")
+        transcription_result = transcribe_audio(decoded_audio().trim(cut_time), transcriber, transcription_options)
 
-        # 4. Save transcription result to pickle
-        print(f"Saving transcription to {transcription_output_file}...")
-        with open(transcription_output_file, "wb") as f:
-            pickle.dump(transcription_result, f)
-    else:
-        try:
-            with open(transcription_output_file, "rb") as f:
-                transcription_result = pickle.load(f)
-        except FileNotFoundError:
-            print(f"Transcription file {transcription_output_file} not found")
-            return
-    
-    skip_analysis = False
-    output_json_file = f"{os.path.splitext(input_file)[0]}_analysis.json"
-    transcript_file = f"{os.path.splitext(input_file)[0]}_transcript.txt"
-    if os.path.exists(output_json_file) and not override:
-        print(f"Output file {output_json_file} already exists. Skipping analysis step.")
-        skip_analysis = True
+        temp_path = cache.put_path(transcription_key, TRANSCRIPT_SUFFIX)
+        write_transcript(temp_path, transcription_result)
+        transcription_path = cache.commit(transcription_key, TRANSCRIPT_SUFFIX, temp_path)
+        set_stage_status(stages, "transcription", "done")
+    transcription_result = load_transcript(transcription_path)
+    print(f"Saving transcription to {transcription_output_file}...")
+    cache.materialize(transcription_key, TRANSCRIPT_SUFFIX, transcription_output_file)
 
     transcript_text = ""
-    hallucinated_silence_words = [
-        "Thank you very much",
-        "We're going to move on to the next one, please.",
-        "Thank you.",
-        "Thank you for joining us today.",
-        "Okay, we're going to move on to the next item,",
-        "the next item,",
-        "All right, we're going to move on to the next one,",
-        "the next one,",
-        "next item, which is",
-        "We're going to take a short break.",
-        "So, thank you very much for being with us today, and we'll see you in the next session.",
-        "I'm not sure what I'm going to do with this, but I'm going to try to do it in a different way.",
-        "Thank you for your attention.",
-        "I'll see you in the next video.",
-        "And I'll see you guys in the next video, thanks.",
-        "more minutes to take a few more minutes to take a few",
-        "minutes to take a few more minutes to take a few more",
-        "So, thank you very much for being with us today, and have a great rest of your day."
-    ]
+    transcript_chunks = []
     for segment in transcription_result["chunks"]:
-        if "text" not in segment:
-            continue
-        hallucinated_silence = False
-        for hallucinated_word in hallucinated_silence_words:
-            if hallucinated_word in segment["text"]:
-                hallucinated_silence = True
-                break
-        if hallucinated_silence:
+        if "text" not in segment or is_hallucinated(segment["text"]):
             continue
         transcript_text += str(segment.get("timestamp")) + " " + segment.get("text", "") + "\n"
-    # 5. Save result to JSON
+        start, end = segment.get("timestamp", (None, None))
+        if start is not None:
+            transcript_chunks.append({"start": start, "end": end, "text": segment["text"].strip()})
     print(f"Saving transcript to {transcript_file}...")
     with open(transcript_file, "w") as f:
         f.write(transcript_text)
 
-    if not skip_analysis:
-        # 6. Analyze transcription
-        print(f"Analyzing transcription with {service}...")
-        mass_parts = analyze_transcription(transcription_result)
-        
-        print(f"Saving analysis to {output_json_file}...")
-        with open(output_json_file, "w") as f:
-            json.dump(mass_parts, f, indent=4)
+    # The homily bounds found by a previous run, used to adopt homily files made before the cache existed
+    previous_homily_bounds = None
+    if os.path.exists(output_json_file):
+        with open(output_json_file, "r") as f:
+            previous_homily_bounds = get_homily_bounds(json.load(f))
+
+    # 3. Analyze transcription
+    analysis_inputs = {"service": "deterministic"}
+    if analysis != "hybrid":
+        llm_engine = None
+    elif llm_engine is None:
+        llm_engine = get_engine(service, model, cache, json_format=True, **(llm_options or {}))
+    if llm_engine is not None:
+        analysis_inputs = {"service": "hybrid", "hybrid": HYBRID_VERSION, "llm": llm_engine.model_id}
+    analysis_key = stage_key(
+        "analysis", STAGE_VERSIONS["analysis"],
+        transcription=hash_file(transcription_path),
+        keywords=hash_file(KEYWORDS_FILE),
+        **analysis_inputs
+    )
+    mass_parts = None if forced("analysis") else cache.get_json(analysis_key)
+    if mass_parts is not None:
+        print("Analysis is up to date. Skipping analysis step.")
+        set_stage_status(stages, "analysis", "skipped")
     else:
-        try:
-            with open(output_json_file, "r") as f:
-                mass_parts = json.load(f)
-        except FileNotFoundError:
-            print(f"Analysis file {output_json_file} not found")
-            return
-
-
-    homily_audio_file = f"{os.path.splitext(input_file)[0]}_homily.mp3"
-
-
-    skip_extract_homily = False
-    if os.path.exists(homily_audio_file) and not override:
-        print(f"Homily audio file {homily_audio_file} already exists. Skipping extract homily audio step.")
-        skip_extract_homily = True
-    
-    if not skip_extract_homily:            
-        # 7. Extract homily audio
-        print(f"Extracting homily audio to {homily_audio_file}...")
-        extract_homily_audio(input_file, mass_parts, homily_audio_file)
-
-
-    skip_fingerprint = False
-    fingerprint_file = f"{os.path.splitext(input_file)[0]}_fingerprint.json"
-    if os.path.exists(fingerprint_file) and not override:
-        print(f"Fingerprint file {fingerprint_file} already exists. Skipping fingerprint step.")
-        skip_fingerprint = True
-    
-    if not skip_fingerprint:
-        # 8. Create voice fingerprint
-        print("Creating voice fingerprint...")
-        fingerprint = create_voice_fingerprint(homily_audio_file)
+        set_stage_status(stages, "analysis", "running")
+        if llm_engine is not None:
+            print(f"Analyzing transcription with keywords, checked by {llm_engine.model_id}...")
+            mass_parts = analyze_transcription_hybrid(transcription_result, llm_engine)
+        else:
+            print("Analyzing transcription with keywords...")
+            mass_parts = analyze_transcription(transcription_result)
+        cache.put_json(analysis_key, mass_parts)
+        set_stage_status(stages, "analysis", "done")
+    print(f"Saving analysis to {output_json_file}...")
+    cache.materialize(analysis_key, ".json", output_json_file)
+
+    homily_bounds = get_homily_bounds(mass_parts)
+    adopt_homily = homily_bounds is not None and homily_bounds == previous_homily_bounds
+
+    # 4. Extract homily audio, and its waveform peaks and previews for the annotation tool
+    homily_audio = None
+    preview_jobs = []
+    if homily_bounds is None:
+        set_stage_status(stages, "homily", "skipped")
+    else:
+        homily_key = stage_key("homily", STAGE_VERSIONS["homily"], audio=audio_hash, bounds=homily_bounds)
+        homily_path = None if forced("homily") else cache.get_path(homily_key, ".mp3")
+        if homily_path is None and not forced("homily") and adopt_homily and os.path.exists(homily_audio_file):
+            homily_path = cache.put_file(homily_key, ".mp3", homily_audio_file)
+
+        if homily_path is not None:
+            print("Homily audio is up to date. Skipping extract homily audio step.")
+            set_stage_status(stages, "homily", "skipped")
+        else:
+            print(f"Extracting homily audio to {homily_audio_file}...")
+            set_stage_status(stages, "homily", "running")
+            homily_audio = extract_homily_audio(decoded_audio(), mass_parts)
+            temp_path = cache.put_path(homily_key, ".mp3")
+            homily_audio.export(temp_path, format="mp3")
+            cache.commit(homily_key, ".mp3", temp_path)
+            set_stage_status(stages, "homily", "done")
+        cache.materialize(homily_key, ".mp3", homily_audio_file)
+
+        peaks_key = stage_key("peaks", STAGE_VERSIONS["peaks"], homily=homily_key)
+        if forced("peaks") or cache.get_json(peaks_key) is None:
+            # Homilies extracted before peaks were are decoded from the homily file, not the recording
+            if homily_audio is None:
+                homily_audio = load_audio(homily_audio_file)
+            cache.put_json(peaks_key, waveform_peaks(homily_audio))
+        cache.materialize(peaks_key, ".json", homily_peaks_file)
+
+        if previews:
+            set_stage_status(stages, "previews", "running")
+            preview_jobs = submit_previews(cache, preview_key(homily_audio_file), homily_audio_file, cache.get_json(peaks_key)["duration"],
+                                           force=forced("previews"))
+
+    # 5. Create voice fingerprint. A homily extracted (or decoded for its peaks) in this run is
+    # fingerprinted from its speech buffer; otherwise it is streamed from the homily audio file a
+    # block at a time, so neither the recording nor the homily has to be decoded into memory.
+    fingerprint = None
+    segments = []
+    if homily_bounds is None:
+        set_stage_status(stages, "fingerprint", "skipped")
+    else:
+        # The speech buffer and the decoded homily file differ by rounding, so the fingerprint of each
+        # is cached under its own key: a cached value always comes from the source its key names.
+        # Either one is reused rather than computing the other.
+        file_fingerprint_key = stage_key("fingerprint", STAGE_VERSIONS["fingerprint"], homily=homily_key)
+        speech_fingerprint_key = stage_key("fingerprint", STAGE_VERSIONS["fingerprint"], homily=homily_key, source="speech")
+        fingerprint_key = speech_fingerprint_key if homily_audio is not None else file_fingerprint_key
+        cached = None
+        if not forced("fingerprint"):
+            cached = cache.get_json(file_fingerprint_key) or cache.get_json(speech_fingerprint_key)
+        if cached is None and not forced("fingerprint") and adopt_homily and os.path.exists(fingerprint_file):
+            # Sidecars computed by an older fingerprint version are recomputed, not adopted
+            version, sidecar_fingerprint = read_fingerprint_file(fingerprint_file)
+            sidecar_segments = read_fingerprint_segments(fingerprint_file)
+            if version == FINGERPRINT_VERSION and sidecar_segments is not None:
+                cached = {"fingerprint": sidecar_fingerprint, "segments": sidecar_segments}
+                # Sidecars were streamed from the homily file
+                cache.put_json(file_fingerprint_key, cached)
+
+        if cached is not None:
+            print("Fingerprint is up to date. Skipping fingerprint step.")
+            set_stage_status(stages, "fingerprint", "skipped")
+            fingerprint, segments = cached["fingerprint"], cached["segments"]
+        else:
+            print("Creating voice fingerprint...")
+            set_stage_status(stages, "fingerprint", "running")
+            try:
+                if homily_audio is not None:
+                    result = compute_voice_fingerprint(homily_audio.speech, homily_audio.sample_rate)
+                else:
+                    result = stream_voice_fingerprint(homily_audio_file)
+            except Exception as e:
+                print(f"Error creating voice fingerprint: {e}")
+                result = None
+            if result is None:
+                print("Could not compute a voice fingerprint for the homily.")
+            else:
+                fingerprint = result.fingerprint.tolist()
+                segments = [dict(segment, fingerprint=segment["fingerprint"].tolist()) for segment in result.segments]
+                cache.put_json(fingerprint_key, {"fingerprint": fingerprint, "segments": segments})
+            # A homily without a fingerprint is recorded as failed, so it is tried again
+            set_stage_status(stages, "fingerprint", "done" if result is not None else "failed")
         if fingerprint is not None:
             print(f"Saving fingerprint to {fingerprint_file}...")
-            with open(fingerprint_file, "w") as f:
-                json.dump(fingerprint.tolist(), f, indent=4)
-
-    skip_priest_detection = False
-    priest_file = f"{os.path.splitext(input_file)[0]}_homily_priest_label.txt"
-    if os.path.exists(priest_file) and not override:
-        print(f"Priest detection file {priest_file} already exists. Skipping priest detection step.")
-        skip_priest_detection = True
-    
-    if not skip_priest_detection:
-        # 9. Detect priest
+            write_fingerprint_file(fingerprint_file, fingerprint, FINGERPRINT_VERSION, segments)
+
+    if previews and homily_bounds is not None:
+        set_stage_status(stages, "previews", "done" if wait_for_previews(preview_jobs) else "failed")
+
+    cache.evict()
+
+    # 6. Detect priest. A label set in the annotation tool always wins, and its fingerprint is
+    # added to the speaker index; otherwise the fingerprint is classified against the index.
+    priest_file = base_name + LABEL_SUFFIX
+    prediction_file = base_name + PREDICTION_SUFFIX
+    # Annotations made before the catalog existed are only in the label files
+    annotated_label = database.annotation(base_name) or read_annotation(base_name)
+    prediction = {}
+    previous_label = None
+    if annotated_label is None and os.path.exists(priest_file):
+        with open(priest_file, "r") as f:
+            previous_label = f.read().strip()
+
+    if annotated_label is not None:
+        print(f"Priest was annotated as {annotated_label}. Skipping priest detection step.")
+        set_stage_status(stages, "priest", "skipped")
+        priest_label = annotated_label
+        if fingerprint is not None:
+            speaker_index = get_speaker_index(fingerprint_version=STAGE_VERSIONS["fingerprint"])
+            speaker_index.add(os.path.realpath(base_name), fingerprint, annotated_label)
+    elif previous_label and previous_label != UNKNOWN_PRIEST and not forced("priest"):
+        print(f"Priest was already detected in {priest_file}. Skipping priest detection step.")
+        set_stage_status(stages, "priest", "skipped")
+        priest_label = previous_label
+    else:
         print("Detecting priest...")
-        # TODO Create method for detecting priest
-        priest_label = "Unknown"
+        set_stage_status(stages, "priest", "running")
+        priest_label, confidence = UNKNOWN_PRIEST, 0.0
+        segment_predictions = []
+        if fingerprint is not None:
+            speaker_index = get_speaker_index(fingerprint_version=STAGE_VERSIONS["fingerprint"])
+            label, confidence = speaker_index.classify(fingerprint)
+            print(f"Closest priest is {label} (confidence {confidence:.2f}).")
+            if confidence >= DEFAULT_MIN_CONFIDENCE:
+                priest_label = label
+            # Each segment is classified on its own, to catch a different priest taking over mid-homily
+            for segment in segments:
+                segment_label, segment_confidence = speaker_index.classify(segment["fingerprint"])
+                segment_predictions.append({
+                    "start": segment["start"],
+                    "end": segment["end"],
+                    "label": segment_label,
+                    "confidence": segment_confidence
+                })
+            for change in find_speaker_changes(segment_predictions):
+                print(f"Speaker may change from {change['from']} to {change['to']} at {change['time']:.0f}s.")
+        # The label file is written first, so it only looks annotated once someone edits it
         with open(priest_file, "w") as f:
             f.write(priest_label)
-    else:
-        with open(priest_file, "r") as f:
-            priest_label = f.read().strip()
+        with open(prediction_file, "w") as f:
+            json.dump({"label": priest_label, "confidence": confidence, "segments": segment_predictions}, f)
+        prediction = {"predicted_priest": None if priest_label == UNKNOWN_PRIEST else priest_label, "prediction_confidence": confidence}
+        set_stage_status(stages, "priest", "done")
 
     print(f"Priest label: {priest_label}")
 
+    set_stage_status(stages, "metadata", "running")
     file_name = os.path.basename(input_file)
 
     hour = file_name.split("-")[0]
@@ -398,7 +566,24 @@ def main(input_file, service, model, override=False):
         transcript=transcript_text,
         mass_parts=mass_parts,
         audio_file=input_file,
-        metadata=metadata
+        metadata=metadata,
+        chunks=transcript_chunks,
+        **summarize_mass(mass_parts, transcript_chunks)
+    )
+
+    set_stage_status(stages, "metadata", "done")
+
+    database.save_run(
+        input_file,
+        stages=stages,
+        fingerprint=fingerprint,
+        fingerprint_version=FINGERPRINT_VERSION,
+        segments=segments,
+        mass_parts=mass_parts,
+        homily_audio=os.path.realpath(homily_audio_file) if homily_bounds is not None else None,
+        mass_time=mass_time,
+        is_sunday=metadata.is_sunday,
+        **prediction
     )
 
     print("Pipeline finished successfully!")
@@ -411,9 +596,26 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Process an audio file to detect parts of a Mass.")
     parser.add_argument("input_file", help="The input MP3 file.")
-    parser.add_argument("--service", choices=['bedrock', 'ollama'], default='bedrock', help="The service to use for analysis.")
-    parser.add_argument("--model", help="The model to use for analysis.")
-    parser.add_argument("--override", action="store_true", help="Override existing files.", default=False)
+    parser.add_argument("--analysis", choices=["deterministic", "hybrid"], default="deterministic", help="Find the parts of the Mass with keywords only, or also ask an LLM about the parts the keywords miss or place implausibly.")
+    parser.add_argument("--service", choices=['bedrock', 'ollama'], default='bedrock', help="The service to use for hybrid analysis.")
+    parser.add_argument("--model", help="The model to use for hybrid analysis.")
+    parser.add_argument("--override", nargs="?", const="all", help="Re-run stages even if their cached outputs are up to date. Takes a comma-separated list of stages (cut, transcription, analysis, homily, peaks, previews, fingerprint, priest), or re-runs all of them if none are given.")
+    parser.add_argument("--plots", action="store_true", help="Save the RMS and waveform plots used to find the cut time.", default=False)
+    parser.add_argument("--previews", action="store_true", default=False, help="Also make a low-bitrate speech transcode and preview clips of the homily for the annotation tool.")
+    add_transcription_arguments(parser)
+    add_cache_arguments(parser)
+    add_llm_arguments(parser)
+    add_database_arguments(parser)
 
     args = parser.parse_args()
-    main(args.input_file, args.service, args.model, args.override)
+    if args.threads is not None:
+        set_cpu_threads(args.threads)
+    override = False
+    if args.override == "all":
+        override = True
+    elif args.override:
+        override = set(args.override.split(","))
+    main(args.input_file, args.service, args.model, override, args.plots,
+         transcription_options=transcription_options_from_args(args), cache=cache_from_args(args),
+         analysis=args.analysis, llm_options=llm_options_from_args(args), database=database_from_args(args),
+         previews=args.previews)
@@ -0,0 +1,164 @@
+import os
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from stage_cache import stage_key, hash_file
+
+# Bump when the transcodes change (bitrate, clip length, positions...)
+PREVIEW_VERSION = 1
+# Mono speech at 16kHz and 24kbps: plenty to recognize a voice, and a fifth of a 128kbps stereo homily
+PREVIEW_BITRATE = "24k"
+PREVIEW_SAMPLE_RATE = 16000
+CLIP_SECONDS = 20
+CLIP_POSITIONS = ("start", "middle", "end")
+SPEECH_SUFFIX = "_speech.mp3"
+DEFAULT_PREVIEW_WORKERS = max(1, (os.cpu_count() or 2) // 2)
+
+
+def clip_suffix(position):
+    """
+    Returns the suffix of a preview clip, added to the homily's path without its extension
+    (e.g. '14-01-27_homily_preview_start.mp3').
+    """
+    return f"_preview_{position}.mp3"
+
+
+def clip_bounds(duration, clip_seconds=CLIP_SECONDS):
+    """
+    Returns the (start, length) in seconds of each clip of CLIP_POSITIONS in a homily of `duration` seconds.
+    Clips of a homily shorter than `clip_seconds` are the whole homily.
+    """
+    length = min(clip_seconds, duration)
+    starts = {"start": 0.0, "middle": (duration - length) / 2, "end": duration - length}
+    return {position: (round(max(float(starts[position]), 0.0), 2), length) for position in CLIP_POSITIONS}
+
+
+def preview_outputs(duration, clip_seconds=CLIP_SECONDS):
+    """
+    Returns the (start, length) of every file made from a homily, keyed by its suffix.
+    The speech transcode has no length: it is the whole homily.
+    """
+    outputs = {SPEECH_SUFFIX: (0.0, None)}
+    for position, bounds in clip_bounds(duration, clip_seconds).items():
+        outputs[clip_suffix(position)] = bounds
+    return outputs
+
+
+def transcode(input_file, output_file, start=0.0, length=None, bitrate=PREVIEW_BITRATE, sample_rate=PREVIEW_SAMPLE_RATE):
+    """
+    Writes a mono, low-bitrate MP3 of `length` seconds of `input_file` from `start` (to the end if
+    `length` is None). ffmpeg seeks in and encodes the audio itself, so nothing is decoded in Python
+    and transcodes can run in parallel threads.
+    """
+    from pydub.utils import get_encoder_name
+
+    command = [get_encoder_name(), "-nostdin", "-loglevel", "error", "-y", "-ss", str(start)]
+    if length is not None:
+        command += ["-t", str(length)]
+    command += ["-i", input_file, "-vn", "-ac", "1", "-ar", str(sample_rate), "-b:a", bitrate, "-f", "mp3", output_file]
+    subprocess.run(command, check=True, capture_output=True)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def preview_key(homily_file):
+    """
+    Returns the stage cache key of the previews of a homily file. It is the homily's content hash,
+    so the pipeline and the backfill below find the same previews for the same homily.
+    """
+    return stage_key("previews", PREVIEW_VERSION, homily=hash_file(homily_file))
+
+
+def get_preview_pool(workers=None):
+    """
+    Returns the process-wide pool that transcodes run in, creating it on first use.
+    """
+    workers = workers or DEFAULT_PREVIEW_WORKERS
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="previews")
+        return _pools[workers]
+
+
+def _make_preview(cache, key, suffix, homily_file, output_file, start, length):
+    temp_path = cache.put_path(key, suffix)
+    try:
+        transcode(homily_file, temp_path, start, length)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    cache.commit(key, suffix, temp_path)
+    cache.materialize(key, suffix, output_file)
+    return output_file
+
+
+def submit_previews(cache, key, homily_file, duration, workers=None, force=False):
+    """
+    Starts making the speech transcode and preview clips of a homily in the preview pool.
+    Files already in the stage cache under `key` are only put next to the homily, unless `force` is set.
+
+    Args:
+        cache (StageCache): The stage cache.
+        key (str): The cache key of the previews, from `preview_key`.
+        homily_file (str): The homily's audio file. The previews are written next to it.
+        duration (float): The homily's duration in seconds.
+        workers (int): The size of the preview pool.
+        force (bool): Make every file again, even if it is cached.
+
+    Returns:
+        list: A future per file to make, each resolving to the file's path.
+    """
+    output_base = os.path.splitext(homily_file)[0]
+    jobs = []
+    for suffix, (start, length) in preview_outputs(duration).items():
+        output_file = output_base + suffix
+        if not force and cache.get_path(key, suffix) is not None:
+            cache.materialize(key, suffix, output_file)
+            continue
+        jobs.append(get_preview_pool(workers).submit(_make_preview, cache, key, suffix, homily_file, output_file, start, length))
+    return jobs
+
+
+def wait_for_previews(jobs):
+    """
+    Waits for the jobs of `submit_previews`. Previews are optional, so errors are printed, not raised.
+
+    Returns:
+        bool: Whether every file was made.
+    """
+    succeeded = True
+    for job in jobs:
+        try:
+            job.result()
+        except Exception as e:
+            print(f"Could not make a homily preview: {e}")
+            succeeded = False
+    return succeeded
+
+
+if __name__ == "__main__":
+    import argparse
+    from pydub.utils import mediainfo
+    from stage_cache import StageCache, DEFAULT_CACHE_DIR
+    from mass_database import add_database_arguments, database_from_args
+
+    parser = argparse.ArgumentParser(description="Make the speech transcodes and preview clips of homilies extracted before previews were.")
+    parser.add_argument("data_dir", help="Only homilies of recordings under this directory.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_PREVIEW_WORKERS, help="Number of transcodes run at the same time.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory of the stage cache.")
+    add_database_arguments(parser)
+    args = parser.parse_args()
+
+    cache = StageCache(args.cache_dir)
+    jobs = []
+    for mass in database_from_args(args).masses(with_homily=True, under=args.data_dir):
+        homily_file = mass["homily_audio"]
+        output_base = os.path.splitext(homily_file)[0]
+        if not os.path.exists(homily_file) or os.path.exists(output_base + SPEECH_SUFFIX):
+            continue
+        jobs.extend(submit_previews(cache, preview_key(homily_file), homily_file, float(mediainfo(homily_file)["duration"]), args.workers))
+    print(f"Making {len(jobs)} preview files...")
+    wait_for_previews(jobs)
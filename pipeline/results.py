@@ -0,0 +1,178 @@
+import os
+import json
+import hashlib
+from mass_summary import parse_transcript, summarize_mass
+from search_index import SEARCH_DIR, COUNTS_DIR, POSTINGS_DIR, SearchIndexBuilder
+
+RESULTS_LOG = "results.jsonl"
+EXPORT_DIR = "results"
+INDEX_FILE = "index.json"
+TRANSCRIPTS_DIR = "transcripts"
+INDEX_VERSION = 2
+
+
+class ResultsLog:
+    """
+    An append-only file of analysis results, one JSON record per line.
+
+    Each result is written as soon as its Mass is done, so nothing is held in memory and an
+    interrupted batch keeps everything it finished. A Mass that is processed again is simply
+    appended again; readers keep the last record for each audio file.
+    """
+
+    def __init__(self, path=RESULTS_LOG):
+        self.path = path
+
+    def append(self, result):
+        with open(self.path, "ab+") as f:
+            # Start a new line if a batch was killed in the middle of writing the last one
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write((json.dumps(result) + "\n").encode("utf-8"))
+
+
+def read_results(path):
+    """
+    Yields the results in a results file one at a time.
+
+    Args:
+        path (str): A results.jsonl log, or a results.json list written by older versions.
+    """
+    if path.endswith(".json"):
+        with open(path, "r") as f:
+            yield from json.load(f)
+        return
+
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                # A batch killed mid-write leaves a truncated last line
+                print(f"Skipping unreadable line {line_number} of {path}")
+
+
+def mass_id(audio_file):
+    """
+    Returns a short stable id for a Mass, used to name its transcript shard.
+    """
+    return hashlib.sha1(audio_file.encode("utf-8")).hexdigest()[:16]
+
+
+def derived_fields(result):
+    """
+    Returns a result's segments and the fields derived from them (see mass_summary.summarize_mass).
+    Results saved before the pipeline derived them get them from their transcript text instead.
+    """
+    chunks = result.get("chunks")
+    if chunks is None:
+        chunks = parse_transcript(result.get("transcript", ""))
+    if "homily_text" in result:
+        summary = {name: result.get(name) for name in ("duration", "homily_start", "homily_end", "homily_duration", "section_durations", "homily_text")}
+    else:
+        summary = summarize_mass(result["mass_parts"], chunks)
+    return chunks, summary
+
+
+def _write_if_changed(path, content):
+    # Unchanged shards keep their modification time, so browsers and servers can keep caching them
+    data = content.encode("utf-8")
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return True
+
+
+def write_search_index(summaries, output_dir):
+    """
+    Builds the search index (see search_index.SearchIndexBuilder) from the exported transcript
+    shards of the Masses in `summaries`, and writes it to `output_dir`.
+    """
+    builder = SearchIndexBuilder()
+    for summary in summaries:
+        with open(os.path.join(output_dir, summary["transcript_shard"]), "r") as f:
+            chunks = json.load(f)["chunks"]
+        builder.add(summary["id"], summary["metadata"].get("priest"), chunks, summary["homily_start"], summary["homily_end"])
+
+    files = builder.files()
+    for kind in (COUNTS_DIR, POSTINGS_DIR):
+        os.makedirs(os.path.join(output_dir, SEARCH_DIR, kind), exist_ok=True)
+    written = sum(_write_if_changed(os.path.join(output_dir, path), content) for path, content in files.items())
+    # Remove shards left over from an index with more shards
+    for kind in (COUNTS_DIR, POSTINGS_DIR):
+        for entry in os.scandir(os.path.join(output_dir, SEARCH_DIR, kind)):
+            if f"{SEARCH_DIR}/{kind}/{entry.name}" not in files:
+                os.remove(entry.path)
+    print(f"Indexed {len(builder.postings)} words of {len(builder.masses)} Masses ({written} search files updated).")
+
+
+def export_results(results_path=RESULTS_LOG, output_dir=EXPORT_DIR):
+    """
+    Exports results for the dashboard as a small summary index and one transcript shard per Mass.
+
+    The index holds each Mass's metadata, Mass parts, durations (of the Mass, the homily and each
+    section) and the path of its transcript shard (relative to `output_dir`), so the dashboard can
+    draw everything from it and fetch a transcript only when it is shown. The shard holds the
+    transcript's segments and the homily text. A search index over every transcript is
+    written to `output_dir`/search (see `write_search_index`). Results are read one at a time, so memory use does not
+    grow with the number of transcripts.
+
+    Returns:
+        str: The path of the index file.
+    """
+    os.makedirs(os.path.join(output_dir, TRANSCRIPTS_DIR), exist_ok=True)
+
+    summaries = {}
+    written = 0
+    for result in read_results(results_path):
+        shard = f"{TRANSCRIPTS_DIR}/{mass_id(result['audio_file'])}.json"
+        chunks, summary = derived_fields(result)
+        # The segments hold the whole transcript, so it is not stored a second time as one string
+        shard_content = {"chunks": chunks, "homily_text": summary["homily_text"]}
+        if _write_if_changed(os.path.join(output_dir, shard), json.dumps(shard_content)):
+            written += 1
+        summaries[result["audio_file"]] = {
+            "id": mass_id(result["audio_file"]),
+            "audio_file": result["audio_file"],
+            "metadata": result["metadata"],
+            "mass_parts": result["mass_parts"],
+            "duration": summary["duration"],
+            "homily_start": summary["homily_start"],
+            "homily_end": summary["homily_end"],
+            "homily_duration": summary["homily_duration"],
+            "section_durations": summary["section_durations"],
+            "transcript_shard": shard
+        }
+
+    # Remove shards of Masses that are no longer in the results
+    shards = {os.path.basename(summary["transcript_shard"]) for summary in summaries.values()}
+    for entry in os.scandir(os.path.join(output_dir, TRANSCRIPTS_DIR)):
+        if entry.name not in shards:
+            os.remove(entry.path)
+
+    write_search_index(summaries.values(), output_dir)
+
+    index_path = os.path.join(output_dir, INDEX_FILE)
+    _write_if_changed(index_path, json.dumps({"version": INDEX_VERSION, "masses": list(summaries.values())}))
+    print(f"Exported {len(summaries)} Masses to {output_dir} ({written} transcript shards updated).")
+    return index_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export analysis results as a summary index and per-Mass transcript shards for the dashboard.")
+    parser.add_argument("results", nargs="?", default=RESULTS_LOG, help="The results.jsonl log (or a legacy results.json).")
+    parser.add_argument("--output-dir", default=EXPORT_DIR, help="Directory to write index.json and the transcript shards to.")
+    args = parser.parse_args()
+    export_results(args.results, args.output_dir)
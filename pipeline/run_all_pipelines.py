@@ -1,30 +1,65 @@
 import os
-import glob
-import subprocess
-from pipeline import main as pipeline_main
-from model import MassMetadata, MassAnalysisResult
-import json
+from pipeline import add_transcription_arguments, transcription_options_from_args, add_cache_arguments, cache_from_args
+from llm_engine import add_llm_arguments, llm_options_from_args
+from batch import run_batch
+from results import RESULTS_LOG, EXPORT_DIR, export_results
+from mass_database import get_database, add_database_arguments, database_from_args
 
-def main():
+def main(warm_up=False, transcription_options=None, workers=None, asr_slots=1, num_threads=None, manifest_path="batch_manifest.json", cache=None, rerun=False,
+         results_path=RESULTS_LOG, export_dir=EXPORT_DIR, analysis="deterministic", llm_options=None, database=None, previews=False):
     s3_downloads_dir = "/home/john/Documents/MassAnalysis/s3_downloads"
-    mp3_files = glob.glob(os.path.join(s3_downloads_dir, "**", "*.mp3"), recursive=True)
+    if database is None:
+        database = get_database()
 
-    results: List[MassAnalysisResult] = []
+    # New recordings are added to the catalog (only directories that changed are listed), and the
+    # recordings to process are read from it rather than globbed
+    added = database.sync_recordings(s3_downloads_dir)
+    print(f"Found {added} new recordings.")
+    mp3_files = database.recordings(under=s3_downloads_dir)
 
-    for mp3_file in mp3_files:
+    manifest = run_batch(
+        mp3_files, manifest_path, "ollama", "gemma3:12b-30k",
+        workers=workers,
+        asr_slots=asr_slots,
+        num_threads=num_threads,
+        transcription_options=transcription_options,
+        cache=cache,
+        warm_up=warm_up,
+        rerun=rerun,
+        results_path=results_path,
+        analysis=analysis,
+        llm_options=llm_options,
+        database=database,
+        previews=previews
+    )
 
-        # Don't process cut mp3 files
-        if "_cut" in mp3_file or "_homily" in mp3_file:
-            continue
-        print(f"Processing {mp3_file}...")
+    failed = [input_file for input_file, job in manifest.jobs.items() if job["status"] == "failed"]
+    if failed:
+        print(f"{len(failed)} files failed, see {manifest_path}. Re-run to retry them.")
 
-        result = pipeline_main(mp3_file, "ollama", "gemma3:12b-30k")
-        results.append(result)
-        print("\n" + "="*50 + "\n")
-    
-    # Save results to json file
-    with open("results.json", "w") as f:
-        json.dump([result.to_dict() for result in results], f, indent=4)
+    # Export the summary index and transcript shards for the dashboard
+    if os.path.exists(results_path):
+        export_results(results_path, export_dir)
 
 if __name__ == "__main__":
-    main()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the pipeline over every Mass recording in s3_downloads.")
+    parser.add_argument("--warm-up", action="store_true", help="Load the transcription model before processing the first file.", default=False)
+    parser.add_argument("--workers", type=int, help="Number of worker processes for decoding, trimming and fingerprinting. Defaults to the number of cores.")
+    parser.add_argument("--asr-slots", type=int, default=1, help="Number of files transcribed at the same time.")
+    parser.add_argument("--manifest", default="batch_manifest.json", help="Job manifest used to resume an interrupted run.")
+    parser.add_argument("--rerun", action="store_true", default=False, help="Re-run files that are already done. Only stages whose inputs changed are recomputed.")
+    parser.add_argument("--results", default=RESULTS_LOG, help="Log that every result is appended to as soon as its file is done.")
+    parser.add_argument("--export-dir", default=EXPORT_DIR, help="Directory for the dashboard's summary index and transcript shards.")
+    parser.add_argument("--analysis", choices=["deterministic", "hybrid"], default="deterministic", help="Find the parts of the Mass with keywords only, or also ask an LLM about the parts the keywords miss or place implausibly.")
+    parser.add_argument("--previews", action="store_true", default=False, help="Also make a low-bitrate speech transcode and preview clips of each homily for the annotation tool.")
+    add_transcription_arguments(parser)
+    add_cache_arguments(parser)
+    add_llm_arguments(parser)
+    add_database_arguments(parser)
+
+    args = parser.parse_args()
+    main(args.warm_up, transcription_options_from_args(args), args.workers, args.asr_slots, args.threads, args.manifest, cache_from_args(args), args.rerun,
+         args.results, args.export_dir, args.analysis, llm_options_from_args(args), database_from_args(args),
+         args.previews)
@@ -0,0 +1,228 @@
+import os
+import re
+import json
+from collections import defaultdict
+from functools import lru_cache
+
+SEARCH_DIR = "search"
+MANIFEST_FILE = "manifest.json"
+COUNTS_DIR = "counts"
+POSTINGS_DIR = "postings"
+SEARCH_INDEX_VERSION = 1
+# Terms are spread over this many shards by `term_shard`, so a lookup fetches one small file.
+# Postings shards grow linearly with the archive (about 85 KB each at 99 Masses, so roughly
+# 0.9 KB per Mass); raise this as the archive grows to keep each lookup's download small. The
+# manifest records the count, so the dashboard follows without changes.
+SHARD_COUNT = 64
+
+HOMILY = "homily"
+REST = "rest"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*")
+
+
+def tokenize(text):
+    """
+    Splits text into lowercase words, keeping apostrophes inside words ("god's").
+    The dashboard tokenizes queries the same way (see MassAnalysis/src/hooks/useSearchIndex.ts).
+    """
+    return TOKEN_PATTERN.findall(text.lower().replace("’", "'"))
+
+
+def term_shard(term):
+    """
+    Returns the shard a term is stored in: its 32-bit FNV-1a hash modulo SHARD_COUNT.
+    """
+    h = 0x811c9dc5
+    for byte in term.encode("utf-8"):
+        h = ((h ^ byte) * 0x01000193) & 0xffffffff
+    return h % SHARD_COUNT
+
+
+def shard_path(kind, shard):
+    """
+    Returns the path of a shard of counts (COUNTS_DIR) or postings (POSTINGS_DIR), relative to the export directory.
+    """
+    return f"{SEARCH_DIR}/{kind}/{shard:02d}.json"
+
+
+class SearchIndexBuilder:
+    """
+    Builds an inverted index over the transcripts of every Mass, one Mass at a time.
+
+    Each term's postings are stored column by column: the Mass ("m", an index into the
+    manifest's list of Masses, each an {"id", "priest"} dictionary), the word's position in the
+    Mass's transcript ("p"), the start time of its segment in seconds ("t") and whether it was
+    said in the homily ("h", 1 or 0).
+    Each term also has a table of how often each priest said it ({priest: [in homilies, in total]}),
+    stored in separate, much smaller shards, so per-priest counts of a word need no postings at all.
+    """
+
+    def __init__(self):
+        self.masses = []
+        self.priests = {}
+        self.postings = defaultdict(lambda: {"m": [], "p": [], "t": [], "h": []})
+        self.counts = defaultdict(dict)
+
+    def add(self, mass_id, priest, chunks, homily_start=None, homily_end=None):
+        """
+        Adds a Mass's transcript to the index.
+
+        Args:
+            mass_id (str): The Mass's id in the results index.
+            priest (str): The priest who said the Mass.
+            chunks (list): The transcript segments, as {"start", "end", "text"} dictionaries.
+            homily_start (float): When the homily starts, or None if it was not found.
+            homily_end (float): When it ends, or None if it runs to the end of the transcript.
+        """
+        mass = len(self.masses)
+        position = 0
+        homily_tokens = 0
+        for chunk in chunks:
+            # The same rule as mass_summary.homily_text, so counts agree with the homily text
+            in_homily = homily_start is not None and chunk["start"] >= homily_start and (homily_end is None or chunk["start"] < homily_end)
+            time = round(chunk["start"], 1)
+            for term in tokenize(chunk["text"]):
+                postings = self.postings[term]
+                postings["m"].append(mass)
+                postings["p"].append(position)
+                postings["t"].append(time)
+                postings["h"].append(int(in_homily))
+                counts = self.counts[term].setdefault(priest, [0, 0])
+                counts[0] += in_homily
+                counts[1] += 1
+                position += 1
+                homily_tokens += in_homily
+
+        self.masses.append({"id": mass_id, "priest": priest})
+        totals = self.priests.setdefault(priest, {"masses": 0, "homily_tokens": 0, "tokens": 0})
+        totals["masses"] += 1
+        totals["homily_tokens"] += homily_tokens
+        totals["tokens"] += position
+
+    def files(self):
+        """
+        Returns the contents of the index's files, keyed by their paths relative to the export directory:
+        the manifest, with the Masses and each priest's word counts, and the counts and postings shards.
+        """
+        counts = [{} for _ in range(SHARD_COUNT)]
+        postings = [{} for _ in range(SHARD_COUNT)]
+        for term in sorted(self.postings):
+            counts[term_shard(term)][term] = self.counts[term]
+            postings[term_shard(term)][term] = self.postings[term]
+
+        files = {
+            f"{SEARCH_DIR}/{MANIFEST_FILE}": json.dumps({
+                "version": SEARCH_INDEX_VERSION,
+                "shards": SHARD_COUNT,
+                "masses": self.masses,
+                "priests": self.priests,
+            })
+        }
+        for shard in range(SHARD_COUNT):
+            files[shard_path(COUNTS_DIR, shard)] = json.dumps(counts[shard], separators=(",", ":"))
+            files[shard_path(POSTINGS_DIR, shard)] = json.dumps(postings[shard], separators=(",", ":"))
+        return files
+
+
+class SearchIndex:
+    """
+    Queries the search index exported with the results. Shards are read when a term in them is
+    first looked up, and kept.
+    """
+
+    def __init__(self, export_dir):
+        self.export_dir = export_dir
+        with open(os.path.join(export_dir, SEARCH_DIR, MANIFEST_FILE), "r") as f:
+            manifest = json.load(f)
+        if manifest["version"] != SEARCH_INDEX_VERSION:
+            raise ValueError(f"Search index version {manifest['version']} is not supported; export the results again.")
+        self.shard_count = manifest["shards"]
+        self.masses = manifest["masses"]
+        self.priests = manifest["priests"]
+        self._shard = lru_cache(maxsize=None)(self._read_shard)
+
+    def _read_shard(self, kind, shard):
+        with open(os.path.join(self.export_dir, shard_path(kind, shard)), "r") as f:
+            return json.load(f)
+
+    def postings(self, term):
+        """
+        Returns a term's postings (see SearchIndexBuilder), or None if it never occurs.
+        """
+        return self._shard(POSTINGS_DIR, term_shard(term)).get(term)
+
+    def counts(self, term):
+        """
+        Returns how often each priest said a term, as {priest: [in homilies, in total]}.
+        """
+        return self._shard(COUNTS_DIR, term_shard(term)).get(term, {})
+
+    def occurrences(self, query, priest=None, part=None):
+        """
+        Finds every occurrence of a word or phrase.
+
+        Args:
+            query (str): The word or phrase, tokenized like the transcripts.
+            priest (str): Only occurrences in Masses of this priest.
+            part (str): Only occurrences in the homily (HOMILY) or outside it (REST).
+
+        Returns:
+            list: An {"mass_id", "priest", "time", "part"} dictionary per occurrence, in the order of the Masses.
+        """
+        terms = tokenize(query)
+        if not terms:
+            return []
+        entries = [self.postings(term) for term in terms]
+        if any(entry is None for entry in entries):
+            return []
+
+        first = entries[0]
+        # A phrase occurs where each of its words follows the previous one in the same Mass
+        following = [set(zip(entry["m"], entry["p"])) for entry in entries[1:]]
+        results = []
+        for mass, position, time, in_homily in zip(first["m"], first["p"], first["t"], first["h"]):
+            if priest is not None and self.masses[mass]["priest"] != priest:
+                continue
+            occurrence_part = HOMILY if in_homily else REST
+            if part is not None and occurrence_part != part:
+                continue
+            if all((mass, position + offset) in positions for offset, positions in enumerate(following, start=1)):
+                results.append({"mass_id": self.masses[mass]["id"], "priest": self.masses[mass]["priest"], "time": time, "part": occurrence_part})
+        return results
+
+    def priest_counts(self, query, part=HOMILY):
+        """
+        Returns how many times each priest said a word or phrase, in the homily (HOMILY), outside
+        it (REST) or anywhere (None). Single words are read from the precomputed counts.
+        """
+        terms = tokenize(query)
+        if len(terms) == 1:
+            column = {HOMILY: lambda c: c[0], REST: lambda c: c[1] - c[0], None: lambda c: c[1]}[part]
+            return {priest: column(counts) for priest, counts in self.counts(terms[0]).items() if column(counts)}
+
+        counts = defaultdict(int)
+        for occurrence in self.occurrences(query, part=part):
+            counts[occurrence["priest"]] += 1
+        return dict(counts)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Search the transcripts of every exported Mass.")
+    parser.add_argument("query", help="A word or phrase.")
+    parser.add_argument("--export-dir", default="results", help="The directory the results were exported to.")
+    parser.add_argument("--priest", help="Only list occurrences in Masses of this priest.")
+    parser.add_argument("--part", choices=[HOMILY, REST], help="Only count occurrences in the homily, or outside it. Counts anywhere by default.")
+    args = parser.parse_args()
+
+    index = SearchIndex(args.export_dir)
+    counts = index.priest_counts(args.query, args.part)
+    for priest, count in sorted(counts.items(), key=lambda item: -item[1]):
+        totals = index.priests[priest]
+        words = {HOMILY: totals["homily_tokens"], REST: totals["tokens"] - totals["homily_tokens"], None: totals["tokens"]}[args.part]
+        print(f"{priest}: {count} ({count / max(words, 1) * 10000:.1f} per 10,000 words)")
+    if args.priest:
+        for occurrence in index.occurrences(args.query, args.priest, args.part):
+            print(f"{occurrence['mass_id']} {occurrence['time']:.0f}s ({occurrence['part']})")
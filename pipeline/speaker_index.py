@@ -0,0 +1,393 @@
+import os
+import json
+import fcntl
+import numpy as np
+
+DEFAULT_SPEAKER_INDEX_DIR = os.environ.get(
+    "MASS_ANALYSIS_SPEAKER_INDEX",
+    os.path.join(os.path.expanduser("~"), ".local", "share", "mass_analysis", "speaker_index")
+)
+UNKNOWN_PRIEST = "Unknown"
+DEFAULT_MIN_CONFIDENCE = 0.2
+INDEX_VERSION = 1
+
+LABEL_SUFFIX = "_homily_priest_label.txt"
+PREDICTION_SUFFIX = "_homily_priest_prediction.json"
+FINGERPRINT_SUFFIX = "_fingerprint.json"
+
+
+def write_fingerprint_file(path, fingerprint, version, segments=None):
+    """
+    Writes a _fingerprint.json sidecar holding the fingerprint and its version, and optionally
+    the sub-fingerprints of the homily's segments, as {"start", "end", "fingerprint"} dicts.
+    """
+    data = {"version": version, "fingerprint": [float(x) for x in fingerprint]}
+    if segments is not None:
+        data["segments"] = [
+            {"start": segment["start"], "end": segment["end"], "fingerprint": [float(x) for x in segment["fingerprint"]]}
+            for segment in segments
+        ]
+    with open(path, "w") as f:
+        json.dump(data, f)
+
+
+def read_fingerprint_file(path):
+    """
+    Reads a _fingerprint.json sidecar.
+
+    Returns:
+        tuple: (version, fingerprint). Sidecars from before fingerprints were versioned are version 1.
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return 1, data
+    return data["version"], data["fingerprint"]
+
+
+def read_fingerprint_segments(path):
+    """
+    Returns the segment sub-fingerprints stored in a _fingerprint.json sidecar, or None if it has none.
+    """
+    with open(path, "r") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return None
+    return data.get("segments")
+
+
+def read_annotation(base_name):
+    """
+    Returns the priest a person labelled a recording with, or None if it has no label yet.
+
+    The pipeline writes its own guesses to the same label file the annotation tool edits, next to
+    a prediction file. A label only counts as an annotation if there is no prediction file, or if
+    the label file was written after it.
+
+    Args:
+        base_name (str): The recording's path without its extension.
+    """
+    label_file = base_name + LABEL_SUFFIX
+    prediction_file = base_name + PREDICTION_SUFFIX
+    if not os.path.exists(label_file):
+        return None
+    with open(label_file, "r") as f:
+        label = f.read().strip()
+    if not label or label == UNKNOWN_PRIEST:
+        return None
+    if os.path.exists(prediction_file) and os.path.getmtime(label_file) <= os.path.getmtime(prediction_file):
+        return None
+    return label
+
+
+class SpeakerIndex:
+    """
+    Voice fingerprints labelled with the priest speaking, used to label new homilies.
+
+    The index is a directory holding:
+    - meta.json: the fingerprint dimension and the fingerprint stage version.
+    - vectors.f32: every fingerprint, as one row of a contiguous float32 matrix.
+    - rows.jsonl: the label table, one {"key", "label"} line per row of the matrix.
+
+    Both data files are only ever appended to. Adding an annotation costs one small write,
+    and `refresh` picks up rows added by other processes by reading only the new bytes.
+    When a recording is added again, its newest row replaces the older ones, and a row
+    labelled "Unknown" removes the recording from the index.
+    """
+
+    def __init__(self, root=DEFAULT_SPEAKER_INDEX_DIR, fingerprint_version=None):
+        """
+        Args:
+            root (str): The index directory. It is created on the first `add`.
+            fingerprint_version (int): The version of the fingerprints that will be added and
+                                       classified. An index built from another version is not used.
+        """
+        self.root = root
+        self.fingerprint_version = fingerprint_version
+        self.meta_file = os.path.join(root, "meta.json")
+        self.vectors_file = os.path.join(root, "vectors.f32")
+        self.rows_file = os.path.join(root, "rows.jsonl")
+
+        self.dim = None
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.keys = []
+        self.label_ids = np.zeros(0, dtype=np.int32)
+        self.labels = []
+        self._label_lookup = {}
+        self._latest_row = {}
+        self._rows_offset = 0
+        self._model = None
+        self.compatible = True
+
+        self.refresh()
+
+    def _load_meta(self):
+        if self.dim is not None or not os.path.exists(self.meta_file):
+            return
+        with open(self.meta_file, "r") as f:
+            meta = json.load(f)
+        self.dim = meta["dim"]
+        self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        index_version = meta.get("fingerprint_version")
+        if meta.get("version") != INDEX_VERSION or (
+            None not in (index_version, self.fingerprint_version) and index_version != self.fingerprint_version
+        ):
+            print(f"Speaker index {self.root} was built from fingerprint version {index_version}, "
+                  f"not {self.fingerprint_version}. Rebuild it with `python speaker_index.py build <data_dir> --rebuild`.")
+            self.compatible = False
+
+    def refresh(self):
+        """
+        Loads the rows appended since the last refresh.
+        """
+        self._load_meta()
+        if self.dim is None or not self.compatible:
+            return
+        try:
+            size = os.path.getsize(self.rows_file)
+        except FileNotFoundError:
+            return
+        if size <= self._rows_offset:
+            return
+
+        with open(self.rows_file, "rb") as f:
+            f.seek(self._rows_offset)
+            new_bytes = f.read(size - self._rows_offset)
+        # Only complete lines; a writer may be in the middle of the last one
+        complete = new_bytes.rfind(b"\n") + 1
+        if complete == 0:
+            return
+        rows = [json.loads(line) for line in new_bytes[:complete].splitlines() if line]
+        self._rows_offset += complete
+
+        # Vectors are written before their rows, so they are always there to read
+        first_row = len(self.keys)
+        new_vectors = np.fromfile(
+            self.vectors_file, dtype="<f4", count=len(rows) * self.dim, offset=first_row * self.dim * 4
+        ).reshape(len(rows), self.dim)
+        self.vectors = np.concatenate([self.vectors, new_vectors])
+
+        new_label_ids = np.empty(len(rows), dtype=np.int32)
+        for i, row in enumerate(rows):
+            label_id = self._label_lookup.get(row["label"])
+            if label_id is None:
+                label_id = len(self.labels)
+                self.labels.append(row["label"])
+                self._label_lookup[row["label"]] = label_id
+            new_label_ids[i] = label_id
+            self._latest_row[row["key"]] = first_row + i
+            self.keys.append(row["key"])
+        self.label_ids = np.concatenate([self.label_ids, new_label_ids])
+        self._model = None
+
+    def add(self, key, fingerprint, label):
+        """
+        Appends a labelled fingerprint. Does nothing if the recording already has this label and fingerprint.
+
+        Args:
+            key (str): Identifies the recording, so a later annotation of it replaces this one.
+            fingerprint (array-like): The voice fingerprint.
+            label (str): The priest, or "Unknown" to remove the recording from the index.
+
+        Returns:
+            bool: Whether a row was appended.
+        """
+        vector = np.asarray(fingerprint, dtype="<f4").reshape(-1)
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, "lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.refresh()
+            if not self.compatible:
+                return False
+            if self.dim is None:
+                self.dim = len(vector)
+                self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+                with open(self.meta_file, "w") as f:
+                    json.dump({"version": INDEX_VERSION, "dim": self.dim, "fingerprint_version": self.fingerprint_version}, f)
+            if len(vector) != self.dim:
+                raise ValueError(f"Fingerprint has {len(vector)} values, the speaker index expects {self.dim}")
+
+            row = self._latest_row.get(key)
+            if row is not None and self.labels[self.label_ids[row]] == label and np.array_equal(self.vectors[row], vector):
+                return False
+            if row is None and label == UNKNOWN_PRIEST:
+                return False
+
+            # Drop anything a writer that crashed mid-append left after the last complete row
+            with open(self.vectors_file, "ab") as f:
+                f.truncate(len(self.keys) * self.dim * 4)
+                f.write(vector.tobytes())
+            if os.path.exists(self.rows_file) and os.path.getsize(self.rows_file) > self._rows_offset:
+                os.truncate(self.rows_file, self._rows_offset)
+            with open(self.rows_file, "a") as f:
+                f.write(json.dumps({"key": key, "label": label}) + "\n")
+            self.refresh()
+        return True
+
+    def _fit(self):
+        """
+        Returns the standardization and per-priest centroids of the current rows, computed once per refresh.
+        """
+        if self._model is not None:
+            return self._model
+        active = np.zeros(len(self.keys), dtype=bool)
+        active[list(self._latest_row.values())] = True
+        unknown = self._label_lookup.get(UNKNOWN_PRIEST)
+        if unknown is not None:
+            active &= self.label_ids != unknown
+        if not active.any():
+            return None
+
+        vectors = self.vectors[active].astype(np.float64)
+        label_ids = self.label_ids[active]
+        mean = vectors.mean(axis=0)
+        std = vectors.std(axis=0)
+        std[std == 0] = 1
+        standardized = (vectors - mean) / std
+
+        present = np.unique(label_ids)
+        counts = np.bincount(label_ids, minlength=len(self.labels))
+        sums = np.zeros((len(self.labels), self.dim))
+        np.add.at(sums, label_ids, standardized)
+        centroids = sums[present] / counts[present, None]
+
+        self._model = {
+            "mean": mean,
+            "std": std,
+            "vectors": standardized,
+            "label_ids": np.searchsorted(present, label_ids),
+            "labels": [self.labels[label_id] for label_id in present],
+            "centroids": centroids
+        }
+        return self._model
+
+    def classify(self, fingerprint, method="centroid"):
+        """
+        Finds the priest whose fingerprints are closest to `fingerprint`.
+
+        Distances are measured after standardizing every dimension over the index. With the
+        "centroid" method each priest is represented by the mean of their fingerprints; with
+        "nearest" by their single closest fingerprint. The confidence is the relative margin
+        between the closest and the second closest priest, 1 - best / second, so it is 0 when
+        the two are equally close, and also when the index knows fewer than two priests.
+
+        Returns:
+            tuple: (label, confidence), with label "Unknown" if the index is empty.
+        """
+        self.refresh()
+        model = self._fit() if self.compatible else None
+        if model is None:
+            return UNKNOWN_PRIEST, 0.0
+        vector = np.asarray(fingerprint, dtype=np.float64).reshape(-1)
+        if len(vector) != self.dim:
+            raise ValueError(f"Fingerprint has {len(vector)} values, the speaker index expects {self.dim}")
+        x = (vector - model["mean"]) / model["std"]
+
+        if method == "centroid":
+            distances = np.linalg.norm(model["centroids"] - x, axis=1)
+        elif method == "nearest":
+            distances = np.full(len(model["labels"]), np.inf)
+            np.minimum.at(distances, model["label_ids"], np.linalg.norm(model["vectors"] - x, axis=1))
+        else:
+            raise ValueError(f"Unknown classification method {method}")
+
+        order = np.argsort(distances)
+        best = distances[order[0]]
+        confidence = 0.0
+        if len(order) > 1 and distances[order[1]] > 0:
+            confidence = float(1 - best / distances[order[1]])
+        return model["labels"][order[0]], confidence
+
+
+def find_speaker_changes(segments, min_confidence=DEFAULT_MIN_CONFIDENCE):
+    """
+    Finds where a different priest seems to take over within a homily.
+
+    Segments classified with less than `min_confidence` are ignored, so a single unclear
+    segment (a hymn, a reading, a pause) is not reported as two changes.
+
+    Args:
+        segments (list): Classified segments, as {"start", "end", "label", "confidence"} dicts in time order.
+
+    Returns:
+        list: A {"time", "from", "to"} dict for every change, with the time in seconds.
+    """
+    changes = []
+    current = None
+    for segment in segments:
+        if segment["confidence"] < min_confidence or segment["label"] == UNKNOWN_PRIEST:
+            continue
+        if current is not None and segment["label"] != current:
+            changes.append({"time": segment["start"], "from": current, "to": segment["label"]})
+        current = segment["label"]
+    return changes
+
+
+_speaker_indexes = {}
+
+
+def get_speaker_index(root=DEFAULT_SPEAKER_INDEX_DIR, fingerprint_version=None):
+    """
+    Returns the speaker index for a directory, loading it once per process.
+    Later calls only read rows appended since.
+    """
+    index = _speaker_indexes.get((root, fingerprint_version))
+    if index is None:
+        index = SpeakerIndex(root, fingerprint_version)
+        _speaker_indexes[(root, fingerprint_version)] = index
+    else:
+        index.refresh()
+    return index
+
+
+def build_index(data_dir, root=DEFAULT_SPEAKER_INDEX_DIR, fingerprint_version=None, rebuild=False, database=None):
+    """
+    Adds every annotated recording under `data_dir` in the catalog `database` (the default
+    MassDatabase if None) to the index.
+
+    This is only needed once to seed the index (or after a fingerprint change); from then on,
+    annotations and new fingerprints are appended as they arrive.
+    """
+    from mass_database import get_database
+    if database is None:
+        database = get_database()
+    if rebuild:
+        for path in (os.path.join(root, "meta.json"), os.path.join(root, "vectors.f32"), os.path.join(root, "rows.jsonl")):
+            if os.path.exists(path):
+                os.remove(path)
+    index = SpeakerIndex(root, fingerprint_version)
+    added = 0
+    stale = 0
+    for mass, fingerprint in database.fingerprints(under=data_dir, labelled=True):
+        if fingerprint_version is not None and mass["fingerprint_version"] != fingerprint_version:
+            stale += 1
+            continue
+        if index.add(mass["base_name"], fingerprint, mass["annotated_priest"]):
+            added += 1
+    print(f"Added {added} fingerprints to {root}. The index knows {len(index._latest_row)} recordings of {len(index.labels)} labels.")
+    if stale:
+        print(f"Skipped {stale} annotated recordings whose fingerprints are not version {fingerprint_version}; re-run the pipeline on them first.")
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or query the speaker index used to detect the priest.")
+    parser.add_argument("--index-dir", default=DEFAULT_SPEAKER_INDEX_DIR, help="The speaker index directory.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Add every annotated recording under a directory, from the catalog database.")
+    build_parser.add_argument("data_dir")
+    build_parser.add_argument("--rebuild", action="store_true", help="Start from an empty index.")
+    classify_parser = subparsers.add_parser("classify", help="Label a _fingerprint.json file.")
+    classify_parser.add_argument("fingerprint_file")
+    classify_parser.add_argument("--method", choices=["centroid", "nearest"], default="centroid")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        from fingerprint import FINGERPRINT_VERSION
+        build_index(args.data_dir, args.index_dir, FINGERPRINT_VERSION, args.rebuild)
+    else:
+        version, fingerprint = read_fingerprint_file(args.fingerprint_file)
+        label, confidence = SpeakerIndex(args.index_dir, version).classify(fingerprint, args.method)
+        print(f"{label} (confidence {confidence:.2f})")
@@ -0,0 +1,151 @@
+import os
+import json
+import shutil
+import hashlib
+
+DEFAULT_CACHE_DIR = os.environ.get("MASS_ANALYSIS_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "mass_analysis"))
+DEFAULT_MAX_BYTES = 50 * 1024 ** 3
+# Entries `evict` never removes: transcriptions (".mtr") take minutes of Whisper each but only a
+# few hundred KB, and once evicted the pipeline would transcribe the recording again
+PINNED_SUFFIXES = (".mtr",)
+
+
+def hash_file(path, block_size=1 << 20):
+    """
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_key(stage, version, **inputs):
+    """
+    Returns the cache key of a stage output.
+
+    The key is a hash of the stage name, the stage's code version and every input that
+    affects the output (hashes of input data, parameters, model ids). Any change to one
+    of them gives a new key, so stale outputs are never reused.
+    """
+    payload = json.dumps({"stage": stage, "version": version, "inputs": inputs}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class StageCache:
+    """
+    A content-addressed store for pipeline stage outputs.
+
+    Each entry is a file named after its key, sharded by the first two characters of the key.
+    Reading an entry refreshes its modification time, and `evict` removes the least recently
+    used entries once the cache is larger than `max_bytes`, except those ending in one of
+    `pinned_suffixes`, which still count towards its size.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES, pinned_suffixes=PINNED_SUFFIXES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.pinned_suffixes = tuple(pinned_suffixes)
+
+    def path(self, key, suffix):
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def _touch(self, path):
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get_path(self, key, suffix):
+        """
+        Returns the path of a cached file, or None if it is not cached.
+        """
+        path = self.path(key, suffix)
+        return path if self._touch(path) else None
+
+    def put_path(self, key, suffix):
+        """
+        Returns a temporary path to write a new entry to. Pass it to `commit` once written.
+        """
+        path = self.path(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return f"{path}.{os.getpid()}.tmp"
+
+    def commit(self, key, suffix, temp_path):
+        """
+        Atomically moves a file written to a `put_path` path into the cache.
+        """
+        path = self.path(key, suffix)
+        os.replace(temp_path, path)
+        return path
+
+    def put_file(self, key, suffix, source_path):
+        """
+        Copies an existing file into the cache.
+        """
+        temp_path = self.put_path(key, suffix)
+        shutil.copyfile(source_path, temp_path)
+        return self.commit(key, suffix, temp_path)
+
+    def get_json(self, key):
+        path = self.get_path(key, ".json")
+        if path is None:
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def put_json(self, key, value):
+        temp_path = self.put_path(key, ".json")
+        with open(temp_path, "w") as f:
+            json.dump(value, f)
+        return self.commit(key, ".json", temp_path)
+
+    def materialize(self, key, suffix, output_file):
+        """
+        Places a cached file at `output_file`, hard-linking it when possible.
+        """
+        path = self.path(key, suffix)
+        if os.path.exists(output_file) and os.path.samefile(path, output_file):
+            return
+        temp_path = f"{output_file}.{os.getpid()}.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        try:
+            os.link(path, temp_path)
+        except OSError:
+            shutil.copyfile(path, temp_path)
+        os.replace(temp_path, output_file)
+
+    def evict(self):
+        """
+        Removes the least recently used entries that are not pinned until the cache fits in `max_bytes`.
+        """
+        entries = []
+        total_bytes = 0
+        if not os.path.isdir(self.root):
+            return
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                total_bytes += stat.st_size
+                if not entry.name.endswith(self.pinned_suffixes):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
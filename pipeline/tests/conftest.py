@@ -0,0 +1,34 @@
+import os
+import sys
+import pytest
+
+# The pipeline's modules import each other by bare name, as when they are run as scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def database(tmp_path):
+    """
+    An empty catalog database in the test's temporary directory.
+    """
+    from mass_database import MassDatabase
+    return MassDatabase(str(tmp_path / "catalog.sqlite"))
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """
+    An empty archive directory in the test's temporary directory.
+    """
+    path = tmp_path / "data"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """
+    An empty stage cache in the test's temporary directory.
+    """
+    from stage_cache import StageCache
+    return StageCache(str(tmp_path / "cache"))
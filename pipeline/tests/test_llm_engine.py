@@ -0,0 +1,129 @@
+import asyncio
+import time
+import pytest
+from llm_engine import LLMEngine, StubLLM, ThrottlingError, TokenBucket, backoff_delay
+from stage_cache import StageCache
+
+
+def throttle_first(count, reply="{}"):
+    """
+    Returns a StubLLM reply function that throttles the first `count` requests.
+    """
+    calls = []
+
+    def respond(system_prompt, user_message):
+        calls.append(user_message)
+        if len(calls) <= count:
+            raise ThrottlingError("ThrottlingException: Rate exceeded")
+        return reply
+    return respond
+
+
+def complete_all(engine, transcripts):
+    async def run():
+        return await asyncio.gather(*(engine.complete("system", transcript) for transcript in transcripts))
+    return asyncio.run(run())
+
+
+def test_token_bucket_spaces_requests_after_burst():
+    bucket = TokenBucket(rate=10, capacity=2)
+    delays = [bucket.reserve() for _ in range(4)]
+    assert delays[:2] == [0.0, 0.0]
+    assert delays[2] == pytest.approx(0.1, abs=0.01)
+    assert delays[3] == pytest.approx(0.2, abs=0.01)
+
+
+def test_rate_limit_holds_across_concurrent_requests():
+    engine = LLMEngine(StubLLM(), max_concurrency=8, requests_per_second=20, burst=1)
+    started = time.monotonic()
+    complete_all(engine, [f"transcript {i}" for i in range(5)])
+    # The first request goes at once, the other four 1/20 s apart
+    assert time.monotonic() - started >= 0.18
+    assert engine.stats["requests"] == 5
+
+
+def test_throttled_request_is_retried():
+    client = StubLLM(respond=throttle_first(2, '{"ok": true}'))
+    engine = LLMEngine(client, requests_per_second=0, max_retries=2, base_delay=0.001)
+    assert complete_all(engine, ["transcript"]) == ['{"ok": true}']
+    assert engine.stats["requests"] == 3
+    assert engine.stats["retries"] == 2
+
+
+def test_retries_give_up_and_nothing_is_cached(tmp_path):
+    client = StubLLM(throttle_rate=1.0)
+    engine = LLMEngine(client, StageCache(str(tmp_path)), requests_per_second=0, max_retries=1, base_delay=0.001)
+    with pytest.raises(ThrottlingError):
+        complete_all(engine, ["transcript"])
+    assert client.calls == 2
+    assert engine.cache.get_json(engine.cache_key("system", "transcript", "{transcript}")) is None
+
+
+def test_no_retries_still_makes_one_attempt(tmp_path):
+    engine = LLMEngine(StubLLM(), StageCache(str(tmp_path)), requests_per_second=0, max_retries=0)
+    assert complete_all(engine, ["transcript"]) == ["{}"]
+    assert engine.stats["requests"] == 1
+
+    throttled = LLMEngine(StubLLM(respond=throttle_first(1)), requests_per_second=0, max_retries=0)
+    with pytest.raises(ThrottlingError):
+        complete_all(throttled, ["transcript"])
+
+
+def test_negative_retries_are_rejected():
+    with pytest.raises(ValueError):
+        LLMEngine(StubLLM(), max_retries=-1)
+
+
+def test_backoff_delay_is_capped():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base_delay=1.0, max_delay=8.0) <= min(8.0, 2 ** attempt)
+
+
+def test_cached_response_is_not_requested_again(tmp_path):
+    client = StubLLM(respond=lambda system_prompt, user_message: '{"part": 1}')
+    engine = LLMEngine(client, StageCache(str(tmp_path)), requests_per_second=0)
+    assert complete_all(engine, ["transcript"]) == ['{"part": 1}']
+    assert complete_all(engine, ["transcript"]) == ['{"part": 1}']
+    assert client.calls == 1
+    assert engine.stats["cached"] == 1
+
+    # Another engine on the same cache, e.g. the next run, reuses it too
+    other = LLMEngine(StubLLM(), StageCache(str(tmp_path)), requests_per_second=0)
+    assert complete_all(other, ["transcript"]) == ['{"part": 1}']
+    assert other.client.calls == 0
+
+
+def test_empty_response_is_not_cached(tmp_path):
+    client = StubLLM(respond=lambda system_prompt, user_message: "")
+    engine = LLMEngine(client, StageCache(str(tmp_path)), requests_per_second=0)
+    complete_all(engine, ["transcript"])
+    complete_all(engine, ["transcript"])
+    assert client.calls == 2
+    assert engine.stats["cached"] == 0
+
+
+class CountingLLM(StubLLM):
+    """
+    A StubLLM that records the most requests it was answering at once.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def complete(self, system_prompt, user_message):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await super().complete(system_prompt, user_message)
+        finally:
+            self.in_flight -= 1
+
+
+def test_concurrency_is_capped():
+    client = CountingLLM(latency=0.02)
+    engine = LLMEngine(client, max_concurrency=3, requests_per_second=0)
+    complete_all(engine, [f"transcript {i}" for i in range(12)])
+    assert client.calls == 12
+    assert client.max_in_flight == 3
@@ -0,0 +1,53 @@
+import os
+import mass_database
+
+
+def add_recording(data_dir, relative_path):
+    path = data_dir / relative_path
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"")
+    return path
+
+
+def count_listings(monkeypatch):
+    listed = []
+    scandir = os.scandir
+
+    def counting_scandir(path):
+        listed.append(path)
+        return scandir(path)
+    monkeypatch.setattr(mass_database.os, "scandir", counting_scandir)
+    return listed
+
+
+def test_sync_adds_recordings_but_not_derived_audio(database, data_dir):
+    add_recording(data_dir, "2025/6/30/GoH/10-00-00.mp3")
+    add_recording(data_dir, "2025/6/30/GoH/10-00-00_homily.mp3")
+    add_recording(data_dir, "2025/6/30/GoH/notes.txt")
+    assert database.sync_recordings(str(data_dir)) == 1
+    mass = database.masses()[0]
+    assert (mass["date"], mass["location"]) == ("2025-06-30", "GoH")
+
+
+def test_unchanged_archive_is_not_listed_again(database, data_dir, monkeypatch):
+    add_recording(data_dir, "2025/6/30/GoH/10-00-00.mp3")
+    add_recording(data_dir, "2025/7/6/GoH/10-00-00.mp3")
+    database.sync_recordings(str(data_dir))
+
+    listed = count_listings(monkeypatch)
+    assert database.sync_recordings(str(data_dir)) == 0
+    assert listed == []
+
+
+def test_only_changed_directories_are_listed(database, data_dir, monkeypatch):
+    add_recording(data_dir, "2025/6/30/GoH/10-00-00.mp3")
+    database.sync_recordings(str(data_dir))
+
+    new_day = add_recording(data_dir, "2025/7/6/GoH/10-00-00.mp3").parent
+    # Only the year directory gained an entry; make sure its mtime moved even on coarse clocks
+    os.utime(data_dir / "2025", ns=(0, 1))
+    listed = count_listings(monkeypatch)
+    assert database.sync_recordings(str(data_dir)) == 1
+    assert os.path.realpath(data_dir / "2025" / "6") not in listed
+    assert os.path.realpath(new_day) in listed
+    assert len(database.recordings()) == 2
@@ -0,0 +1,66 @@
+import os
+import json
+from results import ResultsLog, export_results, mass_id
+
+
+def make_result(audio_file, homily="Today the Gospel tells us to love one another.", priest="Fr. Smith"):
+    return {
+        "audio_file": audio_file,
+        "metadata": {"priest": priest, "location": "GoH"},
+        "mass_parts": {"beginning_of_mass": 0.0, "homily": 10.0, "creed": 20.0, "end_of_mass": 30.0},
+        "chunks": [
+            {"start": 0.0, "end": 5.0, "text": "In the name of the Father."},
+            {"start": 10.0, "end": 15.0, "text": homily},
+            {"start": 20.0, "end": 25.0, "text": "I believe in one God."},
+        ],
+    }
+
+
+def export(tmp_path, results):
+    log = ResultsLog(str(tmp_path / "results.jsonl"))
+    for result in results:
+        log.append(result)
+    output_dir = tmp_path / "export"
+    export_results(log.path, str(output_dir))
+    return output_dir
+
+
+def shard_path(output_dir, audio_file):
+    return output_dir / "transcripts" / f"{mass_id(audio_file)}.json"
+
+
+def age(path):
+    os.utime(path, (1000, 1000))
+
+
+def test_export_writes_index_and_shards(tmp_path):
+    output_dir = export(tmp_path, [make_result("/data/a.mp3"), make_result("/data/b.mp3")])
+    index = json.loads((output_dir / "index.json").read_text())
+    assert [mass["audio_file"] for mass in index["masses"]] == ["/data/a.mp3", "/data/b.mp3"]
+    assert index["masses"][0]["homily_duration"] == 10.0
+
+    shard = json.loads(shard_path(output_dir, "/data/a.mp3").read_text())
+    assert set(shard) == {"chunks", "homily_text"}
+    assert shard["homily_text"] == "Today the Gospel tells us to love one another."
+
+
+def test_only_changed_shards_are_rewritten(tmp_path):
+    output_dir = export(tmp_path, [make_result("/data/a.mp3"), make_result("/data/b.mp3")])
+    unchanged, changed = shard_path(output_dir, "/data/a.mp3"), shard_path(output_dir, "/data/b.mp3")
+    age(unchanged)
+    age(changed)
+
+    # The log keeps the last record of each Mass, so appending one reprocesses it
+    ResultsLog(str(tmp_path / "results.jsonl")).append(make_result("/data/b.mp3", homily="A different homily."))
+    export_results(str(tmp_path / "results.jsonl"), str(output_dir))
+    assert os.path.getmtime(unchanged) == 1000
+    assert os.path.getmtime(changed) != 1000
+    assert json.loads(changed.read_text())["homily_text"] == "A different homily."
+
+
+def test_shards_of_removed_masses_are_deleted(tmp_path):
+    output_dir = export(tmp_path, [make_result("/data/a.mp3"), make_result("/data/b.mp3")])
+    os.remove(tmp_path / "results.jsonl")
+    export(tmp_path, [make_result("/data/a.mp3")])
+    assert shard_path(output_dir, "/data/a.mp3").exists()
+    assert not shard_path(output_dir, "/data/b.mp3").exists()
@@ -0,0 +1,49 @@
+import os
+import pytest
+from search_index import HOMILY, REST, SearchIndex, SearchIndexBuilder, tokenize
+
+
+@pytest.fixture
+def index(tmp_path):
+    builder = SearchIndexBuilder()
+    builder.add("mass-a", "Fr. Smith", [
+        {"start": 0.0, "end": 5.0, "text": "The Holy Spirit be with you."},
+        {"start": 10.0, "end": 15.0, "text": "God's love is the Holy Spirit's gift."},
+    ], homily_start=10.0, homily_end=20.0)
+    builder.add("mass-b", "Fr. Jones", [
+        {"start": 3.0, "end": 8.0, "text": "Spirit and holy water."},
+    ])
+    for path, content in builder.files().items():
+        os.makedirs(os.path.dirname(tmp_path / path), exist_ok=True)
+        (tmp_path / path).write_text(content)
+    return SearchIndex(str(tmp_path))
+
+
+def test_tokenize_keeps_apostrophes_inside_words():
+    assert tokenize("God’s  LOVE, 'tis") == ["god's", "love", "tis"]
+
+
+def test_word_occurrences_have_mass_time_and_part(index):
+    assert index.occurrences("holy") == [
+        {"mass_id": "mass-a", "priest": "Fr. Smith", "time": 0.0, "part": REST},
+        {"mass_id": "mass-a", "priest": "Fr. Smith", "time": 10.0, "part": HOMILY},
+        {"mass_id": "mass-b", "priest": "Fr. Jones", "time": 3.0, "part": REST},
+    ]
+    assert index.occurrences("holy", priest="Fr. Jones", part=REST) == [
+        {"mass_id": "mass-b", "priest": "Fr. Jones", "time": 3.0, "part": REST},
+    ]
+    assert index.occurrences("absent") == []
+
+
+def test_phrases_only_match_consecutive_words(index):
+    # "spirit and holy" in mass-b has the words, but not in this order
+    assert [occurrence["mass_id"] for occurrence in index.occurrences("holy spirit")] == ["mass-a"]
+    assert len(index.occurrences("holy spirit")) == 1
+    assert index.occurrences("the holy spirit's gift")[0]["part"] == HOMILY
+
+
+def test_priest_counts_of_words_and_phrases(index):
+    assert index.priest_counts("holy", part=None) == {"Fr. Smith": 2, "Fr. Jones": 1}
+    assert index.priest_counts("holy", part=HOMILY) == {"Fr. Smith": 1}
+    assert index.priest_counts("holy spirit", part=REST) == {"Fr. Smith": 1}
+    assert index.priests["Fr. Jones"] == {"masses": 1, "homily_tokens": 0, "tokens": 4}
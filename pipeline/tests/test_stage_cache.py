@@ -0,0 +1,56 @@
+import os
+from stage_cache import StageCache, stage_key, hash_file
+
+
+def put_bytes(cache, key, suffix, size, age):
+    temp_path = cache.put_path(key, suffix)
+    with open(temp_path, "wb") as f:
+        f.write(b"x" * size)
+    path = cache.commit(key, suffix, temp_path)
+    os.utime(path, (age, age))
+    return path
+
+
+def test_key_changes_with_every_input():
+    key = stage_key("analysis", 1, transcription="abc", keywords="def")
+    assert key == stage_key("analysis", 1, keywords="def", transcription="abc")
+    assert key != stage_key("analysis", 2, transcription="abc", keywords="def")
+    assert key != stage_key("analysis", 1, transcription="abd", keywords="def")
+    assert key != stage_key("homily", 1, transcription="abc", keywords="def")
+
+
+def test_hash_file_follows_content(tmp_path):
+    first, second = tmp_path / "a.mp3", tmp_path / "b.mp3"
+    first.write_bytes(b"audio")
+    second.write_bytes(b"audio")
+    assert hash_file(str(first)) == hash_file(str(second))
+    second.write_bytes(b"other audio")
+    assert hash_file(str(first)) != hash_file(str(second))
+
+
+def test_json_round_trip_and_miss(cache):
+    assert cache.get_json("ab12") is None
+    cache.put_json("ab12", {"cut_time": 12.5})
+    assert cache.get_json("ab12") == {"cut_time": 12.5}
+
+
+def test_evict_removes_least_recently_used_first(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"), max_bytes=250)
+    oldest = put_bytes(cache, "aa01", ".json", 100, 1000)
+    newer = put_bytes(cache, "bb02", ".json", 100, 2000)
+    newest = put_bytes(cache, "cc03", ".json", 100, 3000)
+    # Reading refreshes an entry, so the oldest entry is now the most recently used
+    cache.get_path("aa01", ".json")
+    cache.evict()
+    assert os.path.exists(oldest)
+    assert not os.path.exists(newer)
+    assert os.path.exists(newest)
+
+
+def test_evict_keeps_transcriptions(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"), max_bytes=150)
+    transcription = put_bytes(cache, "aa01", ".mtr", 100, 1000)
+    homily = put_bytes(cache, "bb02", ".mp3", 100, 2000)
+    cache.evict()
+    assert os.path.exists(transcription)
+    assert not os.path.exists(homily)
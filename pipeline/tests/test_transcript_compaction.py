@@ -0,0 +1,21 @@
+from transcript_compaction import compact_chunks
+
+
+def segments(texts, gap=10):
+    return [{"timestamp": [i * gap, i * gap + 2], "text": text} for i, text in enumerate(texts)]
+
+
+def test_repeated_responses_are_kept():
+    texts = ["Lord, have mercy.", "Christ, have mercy.", "Lord, have mercy.", "Amen.", "Amen."]
+    assert [segment["text"] for segment in compact_chunks(segments(texts))] == texts
+
+
+def test_short_loops_are_cut_once_they_fill_the_lookback():
+    compacted = compact_chunks(segments(["Yeah."] * 8))
+    assert [segment["text"] for segment in compacted] == ["Yeah."] * 3
+
+
+def test_long_repeats_are_dropped_at_once():
+    loop = "I'm going to leave it at that for now, but I'm going to leave it at that for now, thanks."
+    compacted = compact_chunks(segments([loop, loop, "The Gospel of the Lord.", loop]))
+    assert [segment["text"] for segment in compacted] == [loop, "The Gospel of the Lord."]
@@ -0,0 +1,140 @@
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+import torch
+from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+from audio import SPEECH_SAMPLE_RATE
+
+DEFAULT_MODEL_ID = "openai/whisper-medium.en"
+
+
+@dataclass
+class TranscriptionOptions:
+    """
+    Decoding options for the ASR pipeline.
+
+    With `chunk_length_s` unset, Whisper decodes the recording sequentially 30 seconds at a time.
+    With it set, the recording is split into overlapping chunks of that length which are decoded
+    `batch_size` at a time and stitched back together, which is much faster on CPU.
+    `stride_length_s` is the overlap on each side of a chunk (defaults to chunk_length_s / 6).
+    """
+    chunk_length_s: Optional[float] = None
+    stride_length_s: Optional[float] = None
+    batch_size: int = 1
+
+    def to_kwargs(self):
+        kwargs = {}
+        if self.chunk_length_s:
+            kwargs["chunk_length_s"] = self.chunk_length_s
+            kwargs["batch_size"] = self.batch_size
+            if self.stride_length_s is not None:
+                kwargs["stride_length_s"] = self.stride_length_s
+        return kwargs
+
+
+def set_cpu_threads(num_threads=None):
+    """
+    Sets the number of threads torch uses for CPU inference.
+    Uses every available core when `num_threads` is None or 0.
+    """
+    if not num_threads:
+        num_threads = os.cpu_count() or 1
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(num_threads)
+    except RuntimeError:
+        # Inter-op threads can only be set before torch runs any parallel work
+        pass
+    return num_threads
+
+
+class WhisperTranscriber:
+    """
+    A long-lived Whisper ASR pipeline. The model is loaded on first use (or by `warm_up`)
+    and reused for every file transcribed afterwards.
+    """
+
+    def __init__(self, model_id=DEFAULT_MODEL_ID):
+        self.model_id = model_id
+        self._pipe = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_loaded(self):
+        return self._pipe is not None
+
+    def load(self):
+        """
+        Loads the model and builds the ASR pipeline if that has not happened yet.
+        """
+        with self._lock:
+            if self._pipe is not None:
+                return self._pipe
+
+            device = "cuda:0" if torch.cuda.is_available() else "cpu"
+            torch_dtype = torch.float16 if torch.cuda.is_available() else torch.float32
+
+            print(f"Loading {self.model_id} on {device}...")
+            model = AutoModelForSpeechSeq2Seq.from_pretrained(
+                self.model_id, torch_dtype=torch_dtype, low_cpu_mem_usage=True, use_safetensors=True
+            )
+            model.to(device)
+
+            processor = AutoProcessor.from_pretrained(self.model_id)
+
+            self._pipe = pipeline(
+                "automatic-speech-recognition",
+                model=model,
+                tokenizer=processor.tokenizer,
+                feature_extractor=processor.feature_extractor,
+                torch_dtype=torch_dtype,
+                device=device,
+                return_timestamps=True
+            )
+            return self._pipe
+
+    def warm_up(self, seconds=1.0):
+        """
+        Loads the model and runs it once on a short silent clip, so that the first real
+        file does not pay for loading the weights or initializing the backend.
+        """
+        pipe = self.load()
+        silence = np.zeros(int(SPEECH_SAMPLE_RATE * seconds), dtype=np.float32)
+        pipe({"raw": silence, "sampling_rate": SPEECH_SAMPLE_RATE})
+
+    def transcribe(self, audio, options=None):
+        """
+        Transcribes a DecodedAudio.
+
+        Args:
+            audio (DecodedAudio): The audio to transcribe.
+            options (TranscriptionOptions): Chunking and batching options. Defaults to sequential decoding.
+
+        Returns:
+            dict: The ASR pipeline output, with "text" and timestamped "chunks".
+        """
+        return self.transcribe_speech(audio.speech, audio.sample_rate, options)
+
+    def transcribe_speech(self, speech, sample_rate=SPEECH_SAMPLE_RATE, options=None):
+        """
+        Transcribes a mono float32 speech buffer. See `transcribe`.
+        """
+        pipe = self.load()
+        kwargs = options.to_kwargs() if options is not None else {}
+        return pipe({"raw": speech, "sampling_rate": sample_rate}, **kwargs)
+
+
+_transcribers = {}
+_transcribers_lock = threading.Lock()
+
+
+def get_transcriber(model_id=DEFAULT_MODEL_ID):
+    """
+    Returns the process-wide transcriber for `model_id`, creating it on first use.
+    """
+    with _transcribers_lock:
+        if model_id not in _transcribers:
+            _transcribers[model_id] = WhisperTranscriber(model_id)
+        return _transcribers[model_id]
@@ -0,0 +1,166 @@
+from bisect import bisect_right
+from analyze_transcription_deterministic import KEYWORDS_FILE, find_keywords
+from keyword_matcher import normalize_text
+
+# Phrases Whisper makes up over silence and music
+HALLUCINATED_PHRASES = [
+    "Thank you very much",
+    "We're going to move on to the next one, please.",
+    "Thank you.",
+    "Thank you for joining us today.",
+    "Okay, we're going to move on to the next item,",
+    "the next item,",
+    "All right, we're going to move on to the next one,",
+    "the next one,",
+    "next item, which is",
+    "We're going to take a short break.",
+    "So, thank you very much for being with us today, and we'll see you in the next session.",
+    "I'm not sure what I'm going to do with this, but I'm going to try to do it in a different way.",
+    "Thank you for your attention.",
+    "I'll see you in the next video.",
+    "And I'll see you guys in the next video, thanks.",
+    "more minutes to take a few more minutes to take a few",
+    "minutes to take a few more minutes to take a few more",
+    "So, thank you very much for being with us today, and have a great rest of your day."
+]
+
+# Segments less than this many seconds apart are merged, up to MERGE_MAX_CHARS characters
+MERGE_MAX_GAP = 2.0
+MERGE_MAX_CHARS = 400
+# How many recent segments a segment is compared with to find repeats
+REPEAT_LOOKBACK = 3
+# Responses like "Lord, have mercy." or "Amen." are said several times in a row, so a short repeat
+# is only Whisper stuck in a loop once it fills the whole lookback. A long one is a loop at once.
+REPEAT_MIN_CHARS = 80
+REPEAT_MIN_COUNT = REPEAT_LOOKBACK
+# How many characters of the transcript are kept on each side of a keyword match
+DEFAULT_WINDOW_CHARS = 30
+OMITTED_MARKER = "..."
+
+
+def is_hallucinated(text):
+    """
+    Returns whether a segment's text contains one of the phrases Whisper makes up over silence.
+    """
+    return any(phrase in text for phrase in HALLUCINATED_PHRASES)
+
+
+def compact_chunks(chunks, max_gap=MERGE_MAX_GAP, max_chars=MERGE_MAX_CHARS):
+    """
+    Shrinks a transcript's segments before they are put in a prompt.
+
+    Hallucinated segments, empty segments and segments repeating recent segments (Whisper stuck in
+    a loop) are dropped: a segment of at least REPEAT_MIN_CHARS characters as soon as it repeats one
+    of the last REPEAT_LOOKBACK segments, a shorter one only if all of them are the same text. Consecutive segments less than `max_gap` seconds
+    apart are merged into one, as long as the merged text stays under `max_chars` characters.
+
+    Args:
+        chunks (list): The transcript segments, each a dictionary with "timestamp" ([start, end]) and "text".
+
+    Returns:
+        list: The compacted segments, in the same format.
+    """
+    compacted = []
+    recent = []
+    for segment in chunks:
+        text = segment.get("text", "").strip()
+        if not text or is_hallucinated(text):
+            continue
+        normalized = normalize_text(text)
+        repeats = recent.count(normalized)
+        recent = (recent + [normalized])[-REPEAT_LOOKBACK:]
+        if repeats and (len(normalized) >= REPEAT_MIN_CHARS or repeats >= REPEAT_MIN_COUNT):
+            continue
+
+        start, end = segment.get("timestamp", (None, None))
+        if start is None:
+            continue
+        if compacted:
+            previous = compacted[-1]
+            previous_end = previous["timestamp"][1]
+            if (previous_end is not None and start - previous_end <= max_gap
+                    and len(previous["text"]) + len(text) < max_chars):
+                previous["text"] += " " + text
+                previous["timestamp"][1] = end
+                continue
+        compacted.append({"timestamp": [start, end], "text": text})
+    return compacted
+
+
+def keyword_windows(chunks, window_chars=DEFAULT_WINDOW_CHARS, keywords_file=KEYWORDS_FILE):
+    """
+    Cuts a transcript down to the text around its candidate boundaries: `window_chars`
+    characters on each side of every keyword match. Overlapping windows are merged, and
+    segments without a window are dropped.
+
+    The windows are found in the same stream of normalized text the deterministic analyzer
+    searches, so a keyword split across two segments keeps both halves.
+
+    Returns:
+        list: The segments that have windows, with their text replaced by the (lowercased)
+              windows, joined with OMITTED_MARKER where text was left out.
+    """
+    stream, offsets, keyword_matches = find_keywords(chunks, keywords_file)
+    spans = []
+    for start, end in sorted((start, end) for start, end, _ in keyword_matches):
+        start, end = max(0, start - window_chars), min(len(stream), end + window_chars)
+        if spans and start <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+
+    # Split the windows at segment boundaries, so every piece keeps its segment's timestamp
+    pieces = {}
+    for start, end in spans:
+        segment = bisect_right(offsets, start) - 1
+        while start < end:
+            segment_end = offsets[segment + 1] - 1 if segment + 1 < len(offsets) else len(stream)
+            text = stream[start:min(end, segment_end)].strip()
+            if text:
+                pieces.setdefault(segment, []).append((start, min(end, segment_end), text))
+            start = segment_end + 1
+            segment += 1
+
+    windowed = []
+    for segment, segment_pieces in sorted(pieces.items()):
+        segment_start = offsets[segment]
+        segment_end = offsets[segment + 1] - 1 if segment + 1 < len(offsets) else len(stream)
+        text = f" {OMITTED_MARKER} ".join(text for _, _, text in segment_pieces)
+        if segment_pieces[0][0] > segment_start:
+            text = f"{OMITTED_MARKER} {text}"
+        if segment_pieces[-1][1] < segment_end:
+            text = f"{text} {OMITTED_MARKER}"
+        windowed.append({"timestamp": list(chunks[segment]["timestamp"]), "text": text})
+    return windowed
+
+
+def format_chunks(chunks):
+    """
+    Formats segments as one "[start] text" line each, with the start rounded to whole seconds.
+    """
+    return "\n".join(f"[{round(segment['timestamp'][0])}] {segment['text']}" for segment in chunks)
+
+
+def prepare_transcript(transcription_data, use_keyword_windows=False, window_chars=DEFAULT_WINDOW_CHARS):
+    """
+    Turns a transcription into the compact text sent to the model.
+
+    Args:
+        transcription_data (dict): The transcription, with its segments under "chunks".
+        use_keyword_windows (bool): Only send the text around keyword matches, see `keyword_windows`.
+        window_chars (int): How much text to keep on each side of a keyword match.
+
+    Returns:
+        str: One "[start] text" line per compacted segment.
+    """
+    chunks = compact_chunks(transcription_data["chunks"])
+    if use_keyword_windows:
+        chunks = keyword_windows(chunks, window_chars)
+    return format_chunks(chunks)
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimates how many tokens a text takes, at about four characters per token for English.
+    """
+    return len(text) // 4
@@ -0,0 +1,142 @@
+import os
+import struct
+from collections.abc import Mapping, Sequence
+import numpy as np
+
+TRANSCRIPT_MAGIC = b"MATR"
+TRANSCRIPT_VERSION = 1
+TRANSCRIPT_SUFFIX = ".mtr"
+
+# magic, version, number of chunks, size of the text blob in bytes
+_HEADER = struct.Struct("<4sIQQ")
+
+
+def write_transcript(path, transcription):
+    """
+    Writes a transcription to a columnar transcript file.
+
+    The file holds a small header, then the chunk start times and end times as float64 arrays
+    (NaN where Whisper gave no time), the uint64 offsets of each chunk's text, and finally the
+    UTF-8 text of all chunks back to back. Every section is 8-byte aligned, so the arrays can be
+    memory-mapped without copying.
+
+    Args:
+        path (str): The file to write. It is replaced atomically.
+        transcription (Mapping): The ASR pipeline output, or anything with a "chunks" list of
+                                 {"timestamp": (start, end), "text": str} segments.
+    """
+    chunks = transcription["chunks"]
+    starts = np.full(len(chunks), np.nan, dtype="<f8")
+    ends = np.full(len(chunks), np.nan, dtype="<f8")
+    encoded_texts = []
+    for i, chunk in enumerate(chunks):
+        start, end = chunk.get("timestamp", (None, None))
+        if start is not None:
+            starts[i] = start
+        if end is not None:
+            ends[i] = end
+        encoded_texts.append(chunk.get("text", "").encode("utf-8"))
+
+    offsets = np.zeros(len(chunks) + 1, dtype="<u8")
+    offsets[1:] = np.cumsum([len(text) for text in encoded_texts], dtype=np.uint64)
+    text_blob = b"".join(encoded_texts)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(_HEADER.pack(TRANSCRIPT_MAGIC, TRANSCRIPT_VERSION, len(chunks), len(text_blob)))
+        f.write(starts.tobytes())
+        f.write(ends.tobytes())
+        f.write(offsets.tobytes())
+        f.write(text_blob)
+    os.replace(temp_path, path)
+
+
+class TranscriptChunks(Sequence):
+    """
+    The chunks of a Transcript. Indexing builds the {"timestamp", "text"} dict of one chunk on demand.
+    """
+
+    def __init__(self, transcript):
+        self._transcript = transcript
+
+    def __len__(self):
+        return len(self._transcript.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("chunk index out of range")
+        return {
+            "timestamp": self._transcript.timestamp(index),
+            "text": self._transcript.text(index)
+        }
+
+
+class Transcript(Mapping):
+    """
+    A memory-mapped columnar transcript file.
+
+    It reads like the ASR pipeline output (`transcript["chunks"]`, `transcript["text"]`), so it can be
+    passed to the analyzers as is, and gives O(1) access to any chunk and a binary search over time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._raw = np.memmap(path, dtype=np.uint8, mode="r")
+        magic, version, n_chunks, text_size = _HEADER.unpack(self._raw[:_HEADER.size].tobytes())
+        if magic != TRANSCRIPT_MAGIC:
+            raise ValueError(f"{path} is not a transcript file")
+        if version != TRANSCRIPT_VERSION:
+            raise ValueError(f"{path} has unsupported transcript version {version}")
+
+        position = _HEADER.size
+        self.starts = self._raw[position:position + 8 * n_chunks].view("<f8")
+        position += 8 * n_chunks
+        self.ends = self._raw[position:position + 8 * n_chunks].view("<f8")
+        position += 8 * n_chunks
+        self.offsets = self._raw[position:position + 8 * (n_chunks + 1)].view("<u8")
+        position += 8 * (n_chunks + 1)
+        self._text = self._raw[position:position + text_size]
+
+        self.chunks = TranscriptChunks(self)
+        self._sorted_starts = None
+
+    def __getitem__(self, key):
+        if key == "chunks":
+            return self.chunks
+        if key == "text":
+            return self._text.tobytes().decode("utf-8")
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("text", "chunks"))
+
+    def __len__(self):
+        return 2
+
+    def text(self, index):
+        return self._text[int(self.offsets[index]):int(self.offsets[index + 1])].tobytes().decode("utf-8")
+
+    def timestamp(self, index):
+        start, end = self.starts[index], self.ends[index]
+        return (None if np.isnan(start) else float(start), None if np.isnan(end) else float(end))
+
+    def chunks_between(self, start_time, end_time):
+        """
+        Returns the indices of the chunks that start at or after `start_time` and before `end_time`.
+        """
+        if self._sorted_starts is None:
+            starts = self.starts
+            self._sorted_starts = not np.isnan(starts).any() and bool(np.all(starts[1:] >= starts[:-1]))
+        if self._sorted_starts:
+            first = np.searchsorted(self.starts, start_time, side="left")
+            last = np.searchsorted(self.starts, end_time, side="left")
+            return range(int(first), int(last))
+        return np.flatnonzero((self.starts >= start_time) & (self.starts < end_time)).tolist()
+
+
+def load_transcript(path):
+    return Transcript(path)